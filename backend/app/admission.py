@@ -0,0 +1,333 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Tokens reserved for the reply of a call when estimating its size
+COMPLETION_ALLOWANCE = 1000
+WINDOW_SECONDS = 60.0
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough size of a model call for the token budgets, ~4 characters per token"""
+    return len(text) // 4 + COMPLETION_ALLOWANCE
+
+
+class AdmissionRejected(Exception):
+    """Raised when a call has waited in the queue for longer than allowed"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(
+            f"Too many requests to the model, retry in {retry_after:.0f} seconds"
+        )
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """One admitted (or waiting) model call"""
+
+    __slots__ = ("user", "tokens", "queued_at", "admitted_at", "future")
+
+    def __init__(self, user: str, tokens: int, now: float):
+        self.user = user
+        self.tokens = tokens
+        self.queued_at = now
+        self.admitted_at: float | None = None
+        self.future: asyncio.Future | None = None
+
+    @property
+    def wait(self) -> float:
+        """Seconds spent in the queue"""
+        return (self.admitted_at or self.queued_at) - self.queued_at
+
+
+class TokenWindow:
+    """Tokens used during the last minute"""
+
+    def __init__(self):
+        self._entries: deque[tuple[float, int]] = deque()
+        self.total = 0
+
+    def used(self, now: float) -> int:
+        while self._entries and self._entries[0][0] <= now - WINDOW_SECONDS:
+            self.total -= self._entries.popleft()[1]
+        return self.total
+
+    def add(self, now: float, tokens: int) -> None:
+        self._entries.append((now, tokens))
+        self.total += tokens
+
+    def fits(self, now: float, tokens: int, limit: int | None) -> bool:
+        if limit is None:
+            return True
+        used = self.used(now)
+        # A call larger than the whole budget may still run on an idle window
+        return used == 0 or used + tokens <= limit
+
+    def free_at(self, now: float, tokens: int, limit: int) -> float:
+        """Time at which `tokens` more will fit in the budget"""
+        remaining = self.used(now)
+        for at, size in self._entries:
+            remaining -= size
+            if remaining == 0 or remaining + tokens <= limit:
+                return at + WINDOW_SECONDS
+        return now
+
+
+class AdmissionController:
+    """
+    Limits the model calls in flight and queues the rest fairly.
+
+    A call is admitted when the global and per-user concurrency limits and the
+    global and per-user token-per-minute budgets allow it. Waiting calls are
+    served round-robin across users, so one user's burst of long conversations
+    cannot starve the others. A call that waits longer than `max_queue_time`
+    is rejected with AdmissionRejected. Queue times are available from
+    `stats()`.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 32,
+        max_per_user: int = 4,
+        tokens_per_minute: int | None = None,
+        tokens_per_minute_per_user: int | None = None,
+        max_queue_time: float = 30.0,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_per_user = max_per_user
+        self.tokens_per_minute = tokens_per_minute
+        self.tokens_per_minute_per_user = tokens_per_minute_per_user
+        self.max_queue_time = max_queue_time
+
+        self._active = 0
+        self._active_per_user: dict[str, int] = {}
+        # Users with waiting calls, in round-robin order
+        self._queues: OrderedDict[str, deque[Ticket]] = OrderedDict()
+        self._window = TokenWindow()
+        # Only kept with a per-user budget, and dropped once used up and idle
+        self._user_windows: dict[str, TokenWindow] = {}
+        self._pruned_at = time.monotonic()
+        self._timer: asyncio.TimerHandle | None = None
+        self.counters = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected": 0,
+            "queue_seconds_total": 0.0,
+            "queue_seconds_max": 0.0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        """
+        Reads DA_LLM_MAX_CONCURRENCY, DA_LLM_MAX_CONCURRENCY_PER_USER,
+        DA_LLM_TPM and DA_LLM_TPM_PER_USER (0 means no budget) and
+        DA_LLM_MAX_QUEUE_SECONDS.
+        """
+
+        tpm = int(os.getenv("DA_LLM_TPM", "0"))
+        tpm_per_user = int(os.getenv("DA_LLM_TPM_PER_USER", "0"))
+        return cls(
+            max_concurrency=int(os.getenv("DA_LLM_MAX_CONCURRENCY", "32")),
+            max_per_user=int(os.getenv("DA_LLM_MAX_CONCURRENCY_PER_USER", "4")),
+            tokens_per_minute=tpm or None,
+            tokens_per_minute_per_user=tpm_per_user or None,
+            max_queue_time=float(os.getenv("DA_LLM_MAX_QUEUE_SECONDS", "30")),
+        )
+
+    # -- admission -------------------------------------------------------------
+
+    def _add_user_tokens(self, user: str, now: float, tokens: int) -> None:
+        if self.tokens_per_minute_per_user is None:
+            return
+        window = self._user_windows.get(user)
+        if window is None:
+            window = self._user_windows[user] = TokenWindow()
+        window.add(now, tokens)
+
+    def _user_fits(self, user: str, tokens: int, now: float) -> bool:
+        window = self._user_windows.get(user)
+        return window is None or window.fits(
+            now, tokens, self.tokens_per_minute_per_user
+        )
+
+    def _fits(self, user: str, tokens: int, now: float) -> bool:
+        return (
+            self._active < self.max_concurrency
+            and self._active_per_user.get(user, 0) < self.max_per_user
+            and self._window.fits(now, tokens, self.tokens_per_minute)
+            and self._user_fits(user, tokens, now)
+        )
+
+    def _budget_free_at(self, user: str, tokens: int, now: float) -> float | None:
+        """When the token budgets allow the call, None if they already do"""
+        times = []
+        if not self._window.fits(now, tokens, self.tokens_per_minute):
+            times.append(self._window.free_at(now, tokens, self.tokens_per_minute))
+        if not self._user_fits(user, tokens, now):
+            times.append(
+                self._user_windows[user].free_at(
+                    now, tokens, self.tokens_per_minute_per_user
+                )
+            )
+        return max(times) if times else None
+
+    def _prune_user_windows(self, now: float) -> None:
+        """Drops the windows of users with no recent tokens and no calls"""
+        if now - self._pruned_at < WINDOW_SECONDS:
+            return
+        self._pruned_at = now
+        for user, window in list(self._user_windows.items()):
+            if (
+                window.used(now) == 0
+                and user not in self._active_per_user
+                and user not in self._queues
+            ):
+                del self._user_windows[user]
+
+    def _admit(self, ticket: Ticket, now: float) -> None:
+        ticket.admitted_at = now
+        self._active += 1
+        self._active_per_user[ticket.user] = (
+            self._active_per_user.get(ticket.user, 0) + 1
+        )
+        self._window.add(now, ticket.tokens)
+        self._add_user_tokens(ticket.user, now, ticket.tokens)
+
+        self.counters["admitted"] += 1
+        self.counters["queue_seconds_total"] += ticket.wait
+        self.counters["queue_seconds_max"] = max(
+            self.counters["queue_seconds_max"], ticket.wait
+        )
+
+    def try_acquire(self, user: str, tokens: int = 0) -> Ticket | None:
+        """Admits the call right away if it fits and the user has no calls waiting"""
+        now = time.monotonic()
+        if user in self._queues or not self._fits(user, tokens, now):
+            return None
+        ticket = Ticket(user, tokens, now)
+        self._admit(ticket, now)
+        return ticket
+
+    async def acquire(self, user: str, tokens: int = 0) -> Ticket:
+        """Waits for the call to be admitted, raises AdmissionRejected on timeout"""
+        ticket = self.try_acquire(user, tokens)
+        if ticket is not None:
+            return ticket
+
+        ticket = Ticket(user, tokens, time.monotonic())
+        ticket.future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user, deque()).append(ticket)
+        self.counters["queued"] += 1
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), self.max_queue_time)
+        except asyncio.TimeoutError:
+            if ticket.admitted_at is not None:
+                # Admitted just as the wait ran out
+                return ticket
+            self._remove(ticket)
+            self.counters["rejected"] += 1
+            now = time.monotonic()
+            free_at = self._budget_free_at(user, tokens, now)
+            raise AdmissionRejected(max(1.0, (free_at or now) - now))
+        except asyncio.CancelledError:
+            if ticket.admitted_at is not None:
+                self.release(ticket)
+            else:
+                self._remove(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        self._active -= 1
+        remaining = self._active_per_user.get(ticket.user, 1) - 1
+        if remaining:
+            self._active_per_user[ticket.user] = remaining
+        else:
+            self._active_per_user.pop(ticket.user, None)
+        self._dispatch()
+        self._prune_user_windows(time.monotonic())
+
+    def charge(self, user: str, tokens: int) -> None:
+        """
+        Counts tokens spent outside the estimate of an admitted call, like a
+        history summary made for it, against the token budgets.
+        """
+
+        now = time.monotonic()
+        self._window.add(now, tokens)
+        self._add_user_tokens(user, now, tokens)
+
+    @asynccontextmanager
+    async def slot(self, user: str, tokens: int = 0):
+        ticket = await self.acquire(user, tokens)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def _remove(self, ticket: Ticket) -> None:
+        queue = self._queues.get(ticket.user)
+        if queue is None or ticket not in queue:
+            return
+        queue.remove(ticket)
+        if not queue:
+            del self._queues[ticket.user]
+
+    def _dispatch(self) -> None:
+        """Admits waiting calls round-robin across users while they fit"""
+        now = time.monotonic()
+        wake_at = None
+        progressed = True
+        while progressed and self._queues and self._active < self.max_concurrency:
+            progressed = False
+            for user in list(self._queues):
+                queue = self._queues[user]
+                ticket = queue[0]
+                if not self._fits(user, ticket.tokens, now):
+                    free_at = self._budget_free_at(user, ticket.tokens, now)
+                    if free_at is not None:
+                        wake_at = free_at if wake_at is None else min(wake_at, free_at)
+                    continue
+
+                queue.popleft()
+                if queue:
+                    self._queues.move_to_end(user)
+                else:
+                    del self._queues[user]
+                self._admit(ticket, now)
+                if not ticket.future.done():
+                    ticket.future.set_result(None)
+                progressed = True
+                if self._active >= self.max_concurrency:
+                    break
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if wake_at is not None:
+            # Token budgets free up with time, not with releases
+            self._timer = asyncio.get_running_loop().call_later(
+                max(wake_at - now, 0.01), self._dispatch
+            )
+
+    def stats(self) -> dict[str, float]:
+        admitted = self.counters["admitted"]
+        return {
+            "active": self._active,
+            "waiting": sum(len(q) for q in self._queues.values()),
+            "waiting_users": len(self._queues),
+            "queue_seconds_avg": (
+                self.counters["queue_seconds_total"] / admitted if admitted else 0.0
+            ),
+            **self.counters,
+        }
+
+
+admission = AdmissionController.from_env()
@@ -1,148 +1,498 @@
+import asyncio
+import logging
 import os
+import time
+import httpx
+from collections.abc import Iterator
+from functools import lru_cache
 from typing import Dict, Any
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langgraph.checkpoint.memory import MemorySaver
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.prompt_values import ChatPromptValue
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph import START, MessagesState, StateGraph
+from app.checkpointer import BoundedMemorySaver
+from app.context import ContextManager
+from app.metrics import prompt_build
+from app.resilience import RetryPolicy, retry_policy
+from app.response_cache import ResponseCache, cache_key
+from app.usage import UsageTracker, usage_tracker
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+
+AZURE_OPENAI_BASE_URL = "https://doubleagents.openai.azure.com/openai/v1"
+DEFAULT_TEMPERATURE = 1.0
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class ModelPool:
+    """
+    Process-wide registry of ChatOpenAI clients, one per model.
+
+    Clients are created lazily and shared by every ChatbotService, so switching
+    models between requests never rebuilds a client. Per-call settings such as
+    the temperature are passed with the call, so they never add clients. All clients send their
+    requests through one httpx connection pool (HTTP/2 when the h2 package is
+    installed), so keep-alive connections to the endpoint survive model
+    switches. Limits come from DA_HTTP_MAX_CONNECTIONS,
+    DA_HTTP_MAX_KEEPALIVE and DA_HTTP_KEEPALIVE_SECONDS.
+    """
+
+    def __init__(
+        self, http_client: httpx.AsyncClient | None = None, preconnect: bool = True
+    ):
+        self._clients: Dict[str, ChatOpenAI] = {}
+        self._http_client = http_client
+        self._preconnect_enabled = preconnect
+        self._preconnect: asyncio.Task | None = None
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(
+                http2=_http2_available(),
+                limits=httpx.Limits(
+                    max_connections=int(os.getenv("DA_HTTP_MAX_CONNECTIONS", "100")),
+                    max_keepalive_connections=int(
+                        os.getenv("DA_HTTP_MAX_KEEPALIVE", "20")
+                    ),
+                    keepalive_expiry=float(
+                        os.getenv("DA_HTTP_KEEPALIVE_SECONDS", "120")
+                    ),
+                ),
+                timeout=httpx.Timeout(600.0, connect=10.0),
+            )
+        return self._http_client
+
+    def get(self, model_name: str) -> ChatOpenAI:
+        client = self._clients.get(model_name)
+        if client is None:
+            client = self._clients.setdefault(
+                model_name, self._create_client(model_name)
+            )
+            logger.info("Model initialized", extra={"model": model_name})
+        return client
+
+    def _create_client(self, model_name: str) -> ChatOpenAI:
+        return ChatOpenAI(
+            model=model_name,
+            openai_api_key=os.getenv("DA_OPENAI_API_KEY"),
+            openai_api_base=AZURE_OPENAI_BASE_URL,
+            http_async_client=self.http_client,
+            temperature=DEFAULT_TEMPERATURE,
+            # Retries are done by ChatbotService so its circuit breakers see them
+            max_retries=0,
+            # Adds token counts to streamed replies too
+            stream_usage=True,
+        )
+
+    async def warm_up(self, model_names: list[str]) -> None:
+        """
+        Creates the clients for `model_names` and opens a connection to the
+        endpoint so the first conversation does not pay for the TLS handshake.
+        Failures are only reported, the clients retry on first use anyway.
+        """
+
+        clients = [self.get(model_name) for model_name in model_names]
+        if not clients:
+            return
+        try:
+            await clients[0].root_async_client.models.list()
+            logger.info("Connection to the model endpoint warmed up")
+        except Exception as e:
+            logger.warning("Warm-up request failed: %s", e)
+
+    def preconnect(self) -> None:
+        """
+        Opens a connection to the endpoint in the background and leaves it in
+        the pool, so the next request does not wait for the TCP and TLS
+        handshakes while the current one holds its connection. At most one
+        runs at a time; failures are ignored, the request connects itself.
+        """
+        if not self._preconnect_enabled:
+            return
+        if self._preconnect is None or self._preconnect.done():
+            self._preconnect = asyncio.create_task(self._open_connection())
+
+    async def _open_connection(self) -> None:
+        try:
+            await self.http_client.head(AZURE_OPENAI_BASE_URL, timeout=10.0)
+        except Exception as e:
+            logger.debug("Pre-connecting to the model endpoint failed: %s", e)
+
+    def stats(self) -> dict[str, Any]:
+        """Client count and utilization of the shared connection pool"""
+        stats: dict[str, Any] = {"clients": len(self._clients)}
+        if self._http_client is None:
+            return stats
+
+        # httpx does not expose its pool, read it from the transport
+        pool = getattr(self._http_client._transport, "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for c in connections if c.is_idle())
+        stats.update(
+            http2=_http2_available(),
+            connections=len(connections),
+            active_connections=len(connections) - idle,
+            idle_connections=idle,
+            max_connections=getattr(pool, "_max_connections", None),
+            queued_requests=sum(
+                1 for r in getattr(pool, "_requests", []) if r.is_queued()
+            ),
+        )
+        return stats
+
+    async def aclose(self) -> None:
+        if self._preconnect is not None:
+            self._preconnect.cancel()
+            self._preconnect = None
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+
+
+model_pool = ModelPool(
+    preconnect=os.getenv("DA_MODEL_WARMUP", "true").lower() == "true"
+)
+
+
+@lru_cache(maxsize=int(os.getenv("DA_PROMPT_CACHE_SIZE", "1024")))
+def system_message(system_prompt: str) -> SystemMessage:
+    """
+    Pre-rendered system message for a prompt, shared by every call that uses
+    it. The prompt is used as it is, braces are not template variables.
+    """
+
+    return SystemMessage(content=system_prompt)
+
 
 class ChatbotService:
-    DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant. Answer questions clearly."
+    """
+    Owns one compiled LangGraph graph and its checkpointer.
 
-    def __init__(self, system_prompt: str = DEFAULT_SYSTEM_PROMPT):
-        self.allowed_models = {"gpt-4o", "gpt-4o-mini", "gpt-4.1", "gpt-5"}
+    The service holds no per-request state: the system prompt and the model are
+    passed per invocation through the graph config, so any number of
+    concurrent streams can share the same instance.
+    """
 
-        self.model_name = None
-        self.model = None
+    DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant. Answer questions clearly."
 
-        # Determine the initial model to use
-        initial_model_name = os.getenv("DA_OPENAI_MODEL", "gpt-4o")
-        if initial_model_name not in self.allowed_models:
-            initial_model_name = "gpt-4o"
+    def __init__(
+        self,
+        system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+        models: ModelPool | None = None,
+        checkpointer: BaseCheckpointSaver | None = None,
+        context: ContextManager | None = None,
+        retry: RetryPolicy | None = None,
+        cache: ResponseCache | None = None,
+        usage: UsageTracker | None = None,
+    ):
+        self.allowed_models = {"gpt-4o", "gpt-4o-mini", "gpt-4.1", "gpt-5"}
+        self.models = models or model_pool
 
-        self._initialize_model(initial_model_name)
+        # Determine the default model to use
+        default_model_name = os.getenv("DA_OPENAI_MODEL", "gpt-4o")
+        if default_model_name not in self.allowed_models:
+            default_model_name = "gpt-4o"
+        self.default_model_name = default_model_name
+        self.default_system_prompt = system_prompt
+        # Token accounting and quotas, shared by default
+        self.usage = usage or usage_tracker
+        # Keeps the prompt within a token budget, see app.context
+        self.context = context or ContextManager.from_env(self.models, self.usage)
+        # Backoff and per-model circuit breakers, shared by default
+        self.retry = retry or retry_policy
+        # Replies of deterministic chat() calls, None disables caching
+        self.cache = cache
 
         self.workflow = StateGraph(state_schema=MessagesState)
         self.workflow.add_edge(START, "model")
         self.workflow.add_node("model", self._call_model)
 
-        # Add memory
-        self.memory = MemorySaver()
+        # Add memory, defaults to a bounded per-process store
+        self.memory = checkpointer or BoundedMemorySaver()
         self.app = self.workflow.compile(checkpointer=self.memory)
 
-        self.default_system_prompt = system_prompt
-        self.current_system_prompt = system_prompt
-        self.set_system_prompt(system_prompt)
+    async def _call_model(self, state: MessagesState, config: RunnableConfig):
+        settings = config["configurable"]
+        model = self.models.get(settings["model"])
+        # Passed with the call so the pool keeps one client per model
+        call_options = {}
+        temperature = settings.get("temperature")
+        if temperature is None:
+            temperature = DEFAULT_TEMPERATURE
+        else:
+            call_options["temperature"] = temperature
+
+        build_started = time.perf_counter()
+        messages = await self.context.prepare(
+            state["messages"],
+            settings["model"],
+            settings["thread_id"],
+            settings["system_prompt"],
+            settings.get("user_id"),
+        )
+        prompt = ChatPromptValue(
+            messages=[system_message(settings["system_prompt"]), *messages]
+        )
+        prompt_build.observe(
+            time.perf_counter() - build_started, model=settings["model"]
+        )
+
+        key = None
+        if self._use_cache(settings.get("cache"), temperature):
+            key = cache_key(prompt.messages, settings["model"], temperature)
+            content = await self.cache.get(key)
+            if content is not None:
+                logger.debug("Reply served from the response cache")
+                return {
+                    "messages": AIMessage(
+                        content=content, response_metadata={"cache": "hit"}
+                    )
+                }
+
+        # ainvoke streams the HTTP response when the graph is run with
+        # stream_mode="messages", so tokens reach stream_chat as they arrive
+        response = await model.ainvoke(prompt, **call_options)
+        if response.usage_metadata:
+            self.usage.record(
+                settings.get("user_id") or "anonymous",
+                settings["thread_id"],
+                settings["model"],
+                response.usage_metadata["input_tokens"],
+                response.usage_metadata["output_tokens"],
+            )
+
+        logger.debug(
+            "Model responded",
+            extra={
+                "model": settings["model"],
+                "actual_model": response.response_metadata.get("model_name"),
+            },
+        )
 
-    def _initialize_model(self, model_name: str):
+        if key is not None:
+            await self.cache.set(key, response.content, settings["model"])
+            response.response_metadata["cache"] = "miss"
+        return {"messages": response}
+
+    def _use_cache(self, mode: str | None, temperature: float) -> bool:
         """
-        Private helper method to initialize or update the ChatOpenAI model.
-        This consolidates the model creation logic in one place.
+        `mode` is "auto" or "force" for chat() calls, None for streams. With
+        "auto" only deterministic (temperature 0) calls are cached.
         """
-        is_update = self.model_name is not None  # Is this an update or initial setup?
 
-        self.model_name = model_name
-        self.model = ChatOpenAI(
-            model=self.model_name,
-            openai_api_key=os.getenv("DA_OPENAI_API_KEY"),
-            openai_api_base="https://doubleagents.openai.azure.com/openai/v1",
-            temperature=1.0,
-        )
-        if is_update:
-            print(f"[ChatbotService] 🔄 Model updated to: {self.model_name}")
-        else:
-            print(f"[ChatbotService] ✅ Model initialized: {self.model_name}")
+        if self.cache is None or mode is None:
+            return False
+        return mode == "force" or temperature == 0
 
-    def _call_model(self, state: MessagesState):
-        prompt = self.prompt_template.invoke(state)
-        response = self.model.invoke(prompt)
+    def resolve_model(self, model_name: str | None) -> str:
+        """
+        Validates the model name against the allowed list.
+        Falls back to the default model when no model is given.
+        """
 
-        # Debugging calls, can be removed later if logs are getting too verbose
-        try:
-            actual_model = response.response_metadata.get("model_name", "unknown")
-            print(f"[ChatbotService] ✅ Actual model that responded: {actual_model}")
-        except Exception:
-            print("[ChatbotService] ⚠️ Could not extract actual model from response")
+        if not model_name:
+            return self.default_model_name
+        if model_name not in self.allowed_models:
+            raise ValueError(f"Unsupported model: {model_name}")
+        return model_name
 
-        return {"messages": response}
+    def build_config(
+        self,
+        thread_id: str,
+        system_prompt: str | None = None,
+        model: str | None = None,
+        **options: Any,
+    ) -> Dict[str, Any]:
+        """
+        Builds the per-invocation graph config. Empty prompts fall back to the
+        service default. `options` (temperature, cache, user_id) are passed to the
+        model node as they are.
+        """
 
-    def set_system_prompt(self, system_prompt: str):
-        self.current_system_prompt = system_prompt
-        self.prompt_template = ChatPromptTemplate.from_messages(
-            [
-                ("system", system_prompt),
-                MessagesPlaceholder(variable_name="messages"),
-            ]
-        )
+        if not system_prompt or not system_prompt.strip():
+            system_prompt = self.default_system_prompt
 
-    def set_model(self, model_name: str):
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "system_prompt": system_prompt,
+                "model": self.resolve_model(model),
+                **options,
+            }
+        }
+
+    def warm_up(
+        self,
+        thread_id: str,
+        system_prompt: str | None = None,
+        model: str | None = None,
+    ) -> None:
         """
-        Validates the model name against the allowed list and re-initializes
-        the model instance if the name is valid and different from the current one.
+        Does the part of a turn that does not depend on the message ahead of
+        time: validates the settings, makes sure the model client exists,
+        renders the system message and opens a spare connection to the
+        endpoint for the turn's request.
         """
 
-        if model_name not in self.allowed_models:
-            raise ValueError(f"Unsupported model: {model_name}")
-        if model_name != self.model_name:
-            self._initialize_model(model_name)
+        config = self.build_config(thread_id, system_prompt, model)
+        self.models.get(config["configurable"]["model"])
+        system_message(config["configurable"]["system_prompt"])
+        self.models.preconnect()
+
+    async def _backoff(self, model_name: str, exc: Exception, attempt: int) -> None:
+        """Waits before the next attempt, raises ModelError when giving up"""
+        error, delay = self.retry.failed(model_name, exc, attempt)
+        if delay is None:
+            raise error from exc
+        logger.warning(
+            "Model call failed, retrying in %.1fs: %s",
+            delay,
+            error,
+            extra={"model": model_name, "code": error.code, "attempt": attempt},
+        )
+        await asyncio.sleep(delay)
 
-    def chat(
+    async def chat(
         self,
         message: str,
         thread_id: str = "default",
         system_prompt: str = None,
         model: str = None,
     ) -> str:
-        if model:
-            self.set_model(model)
-        try:
-            if system_prompt and system_prompt.strip():
-                self.set_system_prompt(system_prompt)
+        """
+        Sends one message and returns the reply. Transient failures are
+        retried, others raise ModelError.
+        """
 
-            config = {"configurable": {"thread_id": thread_id}}
-            input_messages = [HumanMessage(content=message)]
+        reply = await self.chat_message(message, thread_id, system_prompt, model)
+        return reply.content
 
-            output = self.app.invoke({"messages": input_messages}, config)
-            ai_response = output["messages"][-1]
+    async def chat_message(
+        self,
+        message: str,
+        thread_id: str = "default",
+        system_prompt: str = None,
+        model: str = None,
+        temperature: float | None = None,
+        force_cache: bool = False,
+        user_id: str | None = None,
+    ) -> AIMessage:
+        """
+        Like chat() but returns the reply message. Its response_metadata
+        "cache" is "hit" or "miss" when the response cache was used. The cache
+        is only used with temperature 0 unless `force_cache` is set.
 
-            return ai_response.content
+        Token usage is accounted to `user_id`, whose quota is checked first.
+        """
 
-        except Exception as e:
-            return f"Error: {str(e)}"
+        config = self.build_config(
+            thread_id,
+            system_prompt,
+            model,
+            temperature=temperature,
+            cache="force" if force_cache else "auto",
+            user_id=user_id,
+        )
+        model_name = config["configurable"]["model"]
+        if user_id is not None:
+            await self.usage.check(user_id)
+        graph_input = {"messages": [HumanMessage(content=message)]}
+        for attempt in range(self.retry.max_attempts):
+            probe = self.retry.check(model_name)
+            try:
+                output = await self.app.ainvoke(graph_input, config)
+            except asyncio.CancelledError:
+                self.retry.abandoned(model_name, probe)
+                raise
+            except Exception as e:
+                await self._backoff(model_name, e, attempt)
+                # The failed run is checkpointed with the message, resume it
+                graph_input = None
+                continue
+            self.retry.succeeded(model_name)
+            return output["messages"][-1]
 
     async def stream_chat(
-        self, message: str, thread_id: str = "default", model: str = None
+        self,
+        message: str,
+        thread_id: str = "default",
+        system_prompt: str = None,
+        model: str = None,
+        user_id: str | None = None,
     ):
-        if model:
-            self.set_model(model)
-        try:
-            config = {"configurable": {"thread_id": thread_id}}
-            input_messages = [HumanMessage(content=message)]
-
-            async for chunk, metadata in self.app.astream(
-                {"messages": input_messages}, config, stream_mode="messages"
-            ):
-                if isinstance(chunk, AIMessage):
-                    yield chunk.content
-
-        except Exception as e:
-            yield f"Error: {str(e)}"
+        """
+        Streams the reply token by token. A failure before the first token is
+        retried; once tokens have been sent, or when giving up, ModelError is
+        raised so the caller can end the stream instead of using partial text.
+        Token usage is accounted to `user_id` like in chat_message().
+        """
 
-    def get_conversation_history(self, thread_id: str):
-        # this function collect all the messages from chat in str type role:message
+        config = self.build_config(thread_id, system_prompt, model, user_id=user_id)
+        model_name = config["configurable"]["model"]
+        if user_id is not None:
+            await self.usage.check(user_id)
+        graph_input = {"messages": [HumanMessage(content=message)]}
+        for attempt in range(self.retry.max_attempts):
+            probe = self.retry.check(model_name)
+            sent = False
+            try:
+                async for chunk, metadata in self.app.astream(
+                    graph_input, config, stream_mode="messages"
+                ):
+                    if isinstance(chunk, AIMessage):
+                        sent = sent or bool(chunk.content)
+                        yield chunk.content
+            except (asyncio.CancelledError, GeneratorExit):
+                # Cancelled or closed by the consumer: no verdict on the model
+                self.retry.abandoned(model_name, probe)
+                raise
+            except Exception as e:
+                if sent:
+                    error, _ = self.retry.failed(model_name, e, self.retry.max_attempts)
+                    raise error from e
+                await self._backoff(model_name, e, attempt)
+                # Resume the failed run from its checkpoint
+                graph_input = None
+                continue
+            self.retry.succeeded(model_name)
+            return
+
+    async def message_count(self, thread_id: str) -> int:
+        """Number of messages stored in the thread's checkpoint"""
+        state = await self.app.aget_state({"configurable": {"thread_id": thread_id}})
+        return len(state.values.get("messages", []))
+
+    async def seed(self, thread_id: str, messages: list[BaseMessage]) -> None:
+        """Replaces the thread's checkpointed history with `messages`"""
+        await self.memory.adelete_thread(thread_id)
+        if messages:
+            await self.app.aupdate_state(
+                {"configurable": {"thread_id": thread_id}},
+                {"messages": messages},
+                as_node="model",
+            )
+
+    def iter_conversation_history(self, thread_id: str) -> Iterator[str]:
+        """Yields the conversation one "role:\nmessage" block at a time"""
         config = {"configurable": {"thread_id": thread_id}}
         state = self.app.get_state(config)
 
-        messages = state.values.get("messages", [])
-
-        conversation_text = ""
-
-        for message in messages:
+        for message in state.values.get("messages", []):
             role = "Unk"
 
             if isinstance(message, HumanMessage):
@@ -152,6 +502,8 @@ class ChatbotService:
             elif isinstance(message, SystemMessage):
                 continue
 
-            conversation_text += f"{role}:\n{message.content}\n\n"
+            yield f"{role}:\n{message.content}\n\n"
 
-        return conversation_text
+    def get_conversation_history(self, thread_id: str):
+        # this function collect all the messages from chat in str type role:message
+        return "".join(self.iter_conversation_history(thread_id))
@@ -0,0 +1,281 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterator, Sequence
+from datetime import timedelta
+from typing import Any
+from dotenv import load_dotenv
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+)
+from langgraph.checkpoint.memory import MemorySaver
+
+load_dotenv()
+
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    MemorySaver that keeps worker memory bounded.
+
+    - Each thread keeps at most `max_checkpoints_per_thread` checkpoints, older
+      ones (and the channel values only they reference) are dropped.
+    - Threads not touched for `ttl` seconds are evicted.
+    - When more than `max_threads` threads are stored, or their serialized size
+      exceeds `max_bytes`, the least recently used threads are evicted.
+
+    Eviction counters are available from `stats()`.
+    """
+
+    def __init__(
+        self,
+        max_threads: int = 1000,
+        max_checkpoints_per_thread: int = 5,
+        max_bytes: int = 256 * 1024 * 1024,
+        ttl: float | None = 24 * 60 * 60,
+        **kwargs: Any,
+    ):
+        super().__init__(**kwargs)
+        self.max_threads = max_threads
+        self.max_checkpoints_per_thread = max_checkpoints_per_thread
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._lock = threading.RLock()
+        # thread id -> last access time, least recently used first
+        self._access: OrderedDict[str, float] = OrderedDict()
+        self._thread_bytes: dict[str, int] = {}
+        self._thread_blobs: dict[str, set[tuple]] = {}
+        # (thread id, checkpoint ns, checkpoint id) -> channel versions
+        self._checkpoint_versions: dict[tuple[str, str, str], ChannelVersions] = {}
+        self._total_bytes = 0
+        self.counters = {
+            "evicted_lru": 0,
+            "evicted_ttl": 0,
+            "evicted_bytes": 0,
+            "trimmed_checkpoints": 0,
+        }
+
+    # -- bookkeeping -----------------------------------------------------------
+
+    def _touch(self, thread_id: str) -> None:
+        self._access[thread_id] = time.monotonic()
+        self._access.move_to_end(thread_id)
+
+    def _add_bytes(self, thread_id: str, size: int) -> None:
+        self._thread_bytes[thread_id] = self._thread_bytes.get(thread_id, 0) + size
+        self._total_bytes += size
+
+    def _writes_size(self, key: tuple[str, str, str]) -> int:
+        return sum(len(w[2][1]) for w in self.writes.get(key, {}).values())
+
+    def _drop_thread(self, thread_id: str) -> None:
+        namespaces = self.storage.pop(thread_id, {})
+        for checkpoint_ns, checkpoints in namespaces.items():
+            for checkpoint_id in checkpoints:
+                key = (thread_id, checkpoint_ns, checkpoint_id)
+                self.writes.pop(key, None)
+                self._checkpoint_versions.pop(key, None)
+        for blob_key in self._thread_blobs.pop(thread_id, set()):
+            self.blobs.pop(blob_key, None)
+        self._total_bytes -= self._thread_bytes.pop(thread_id, 0)
+        self._access.pop(thread_id, None)
+
+    def _trim_history(self, thread_id: str, checkpoint_ns: str) -> None:
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        excess = len(checkpoints) - self.max_checkpoints_per_thread
+        if excess <= 0:
+            return
+
+        freed = 0
+        for checkpoint_id in sorted(checkpoints)[:excess]:
+            checkpoint, metadata, _ = checkpoints.pop(checkpoint_id)
+            key = (thread_id, checkpoint_ns, checkpoint_id)
+            freed += len(checkpoint[1]) + len(metadata[1]) + self._writes_size(key)
+            self.writes.pop(key, None)
+            self._checkpoint_versions.pop(key, None)
+        self.counters["trimmed_checkpoints"] += excess
+
+        # Drop channel values that no remaining checkpoint points to
+        referenced = {
+            (thread_id, checkpoint_ns, channel, version)
+            for checkpoint_id in checkpoints
+            for channel, version in self._checkpoint_versions.get(
+                (thread_id, checkpoint_ns, checkpoint_id), {}
+            ).items()
+        }
+        thread_blobs = self._thread_blobs.get(thread_id, set())
+        for blob_key in [
+            k for k in thread_blobs if k[1] == checkpoint_ns and k not in referenced
+        ]:
+            thread_blobs.discard(blob_key)
+            blob = self.blobs.pop(blob_key, None)
+            if blob is not None:
+                freed += len(blob[1])
+
+        self._add_bytes(thread_id, -freed)
+
+    def _evict(self, keep: str | None = None) -> None:
+        if self.ttl is not None:
+            cutoff = time.monotonic() - self.ttl
+            while self._access:
+                thread_id, last_access = next(iter(self._access.items()))
+                if last_access >= cutoff or thread_id == keep:
+                    break
+                self._drop_thread(thread_id)
+                self.counters["evicted_ttl"] += 1
+
+        while len(self._access) > self.max_threads:
+            if not self._evict_oldest(keep):
+                break
+            self.counters["evicted_lru"] += 1
+
+        while self._total_bytes > self.max_bytes:
+            if not self._evict_oldest(keep):
+                break
+            self.counters["evicted_bytes"] += 1
+
+    def _evict_oldest(self, keep: str | None) -> bool:
+        for thread_id in self._access:
+            if thread_id != keep:
+                self._drop_thread(thread_id)
+                return True
+        return False
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "threads": len(self._access),
+                "bytes": self._total_bytes,
+                **self.counters,
+            }
+
+    # -- checkpointer interface ------------------------------------------------
+
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            # Avoid creating empty entries in the defaultdict for unknown threads
+            if thread_id not in self.storage:
+                return None
+            self._touch(thread_id)
+            return super().get_tuple(config)
+
+    def list(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> Iterator[CheckpointTuple]:
+        with self._lock:
+            if config:
+                thread_id = config["configurable"]["thread_id"]
+                if thread_id not in self.storage:
+                    return
+                self._touch(thread_id)
+            items = [*super().list(config, filter=filter, before=before, limit=limit)]
+        yield from items
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        blob_keys = [
+            (thread_id, checkpoint_ns, channel, version)
+            for channel, version in new_versions.items()
+        ]
+
+        with self._lock:
+            before = sum(len(self.blobs[k][1]) for k in blob_keys if k in self.blobs)
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+
+            saved, saved_metadata, _ = self.storage[thread_id][checkpoint_ns][
+                checkpoint["id"]
+            ]
+            after = sum(len(self.blobs[k][1]) for k in blob_keys)
+            self._thread_blobs.setdefault(thread_id, set()).update(blob_keys)
+            self._checkpoint_versions[(thread_id, checkpoint_ns, checkpoint["id"])] = (
+                dict(checkpoint["channel_versions"])
+            )
+            self._add_bytes(
+                thread_id, len(saved[1]) + len(saved_metadata[1]) + after - before
+            )
+            self._touch(thread_id)
+            self._trim_history(thread_id, checkpoint_ns)
+            self._evict(keep=thread_id)
+
+        return next_config
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        key = (
+            thread_id,
+            config["configurable"].get("checkpoint_ns", ""),
+            config["configurable"]["checkpoint_id"],
+        )
+
+        with self._lock:
+            before = self._writes_size(key)
+            super().put_writes(config, writes, task_id, task_path)
+            self._add_bytes(thread_id, self._writes_size(key) - before)
+            self._touch(thread_id)
+            self._evict(keep=thread_id)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._drop_thread(thread_id)
+
+
+def create_checkpointer(scope: str) -> BaseCheckpointSaver:
+    """
+    Builds the checkpointer selected by DA_CHECKPOINTER.
+
+    - "memory" (default): per-process BoundedMemorySaver, state is lost on
+      restart and not shared between workers. Bounded by DA_MEMORY_MAX_THREADS,
+      DA_MEMORY_MAX_CHECKPOINTS, DA_MEMORY_MAX_MB and DA_MEMORY_TTL_MINUTES.
+    - "database": SQLCheckpointSaver on the application database, shared by all
+      workers and replicas. Threads idle for DA_CHECKPOINT_TTL_HOURS are pruned.
+    """
+
+    backend = os.getenv("DA_CHECKPOINTER", "memory").lower()
+
+    if backend == "memory":
+        ttl_minutes = float(os.getenv("DA_MEMORY_TTL_MINUTES", "1440"))
+        return BoundedMemorySaver(
+            max_threads=int(os.getenv("DA_MEMORY_MAX_THREADS", "1000")),
+            max_checkpoints_per_thread=int(os.getenv("DA_MEMORY_MAX_CHECKPOINTS", "5")),
+            max_bytes=int(float(os.getenv("DA_MEMORY_MAX_MB", "256")) * 1024 * 1024),
+            ttl=ttl_minutes * 60 if ttl_minutes > 0 else None,
+        )
+
+    if backend == "database":
+        # Imported lazily so the memory backend works without DA_DB_URL
+        from app.db.database import engine
+        from app.db.checkpoint_saver import SQLCheckpointSaver
+
+        ttl_hours = float(os.getenv("DA_CHECKPOINT_TTL_HOURS", "72"))
+        return SQLCheckpointSaver(
+            engine,
+            scope=scope,
+            ttl=timedelta(hours=ttl_hours) if ttl_hours > 0 else None,
+        )
+
+    raise ValueError(f"Unsupported checkpointer backend: {backend}")
@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from collections.abc import Callable, Sequence
+from functools import lru_cache
+from dotenv import load_dotenv
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    SystemMessage,
+    trim_messages,
+)
+from langchain_core.messages.utils import count_tokens_approximately
+from langgraph.constants import TAG_NOSTREAM
+
+from app.admission import AdmissionController, admission
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Context window of each allowed model
+MODEL_CONTEXT_TOKENS = {
+    "gpt-4o": 128_000,
+    "gpt-4o-mini": 128_000,
+    "gpt-4.1": 1_047_576,
+    "gpt-5": 400_000,
+}
+# Left free in the context window for the response
+RESERVED_OUTPUT_TOKENS = 16_000
+# Budget kept free for the rolling summary when summaries are enabled
+SUMMARY_TOKENS = 512
+# Per-message formatting overhead in the chat format
+TOKENS_PER_MESSAGE = 3
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below in under 200 words. Keep names, facts, "
+    "decisions and open questions, leave out small talk."
+)
+
+TokenCounter = Callable[[Sequence[BaseMessage]], int]
+
+
+def _content(message: BaseMessage) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    return str(message.content)
+
+
+@lru_cache(maxsize=None)
+def token_counter(model_name: str) -> TokenCounter:
+    """
+    Token counter for `model_name` using its tiktoken encoding.
+
+    Falls back to an approximate count when the encoding cannot be loaded, for
+    example when tiktoken cannot download it.
+    """
+
+    try:
+        import tiktoken
+
+        try:
+            encoding = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning("Using approximate token counts: %s", e)
+        return count_tokens_approximately
+
+    def count(messages: Sequence[BaseMessage]) -> int:
+        return sum(
+            len(encoding.encode(_content(m), disallowed_special=()))
+            + TOKENS_PER_MESSAGE
+            for m in messages
+        )
+
+    return count
+
+
+def _fits_without_counting(messages: Sequence[BaseMessage], budget: int) -> bool:
+    # A token is at least one byte, so this never underestimates
+    size = sum(len(_content(m).encode()) + TOKENS_PER_MESSAGE for m in messages)
+    return size <= budget
+
+
+class ContextManager:
+    """
+    Keeps the prompt sent to the model within a token budget.
+
+    The checkpoint still holds the whole thread; only the prompt is trimmed.
+    The budget is the model's context window less RESERVED_OUTPUT_TOKENS,
+    lowered to `max_tokens` when given; 0 disables trimming. The most recent
+    messages that fit the budget are kept. With `summarize` the trimmed-off
+    messages are replaced by a rolling summary that is cached per thread and
+    only extended with newly trimmed messages. The tokens of summary calls are
+    accounted to the thread's user with `usage` and charged to the token
+    budgets of `admission`.
+    """
+
+    def __init__(
+        self,
+        models,
+        max_tokens: int | None = None,
+        summarize: bool = False,
+        summary_model: str = "gpt-4o-mini",
+        max_cached_summaries: int = 1000,
+        usage=None,
+        admission: AdmissionController | None = None,
+    ):
+        self.models = models
+        self.max_tokens = max_tokens
+        self.summarize = summarize
+        self.summary_model = summary_model
+        self.max_cached_summaries = max_cached_summaries
+        self.usage = usage
+        self.admission = admission
+        # thread id -> (number of messages summarized, summary)
+        self._summaries: OrderedDict[str, tuple[int, str]] = OrderedDict()
+
+    @classmethod
+    def from_env(cls, models, usage=None) -> "ContextManager":
+        """
+        Reads DA_CONTEXT_MAX_TOKENS (lowers the budget, 0 disables trimming),
+        DA_CONTEXT_SUMMARIES and DA_CONTEXT_SUMMARY_MODEL. Summary calls are
+        charged to the shared admission controller.
+        """
+
+        max_tokens = os.getenv("DA_CONTEXT_MAX_TOKENS")
+        return cls(
+            models,
+            max_tokens=int(max_tokens) if max_tokens else None,
+            summarize=os.getenv("DA_CONTEXT_SUMMARIES", "false").lower() == "true",
+            summary_model=os.getenv("DA_CONTEXT_SUMMARY_MODEL", "gpt-4o-mini"),
+            usage=usage,
+            admission=admission,
+        )
+
+    def budget(self, model_name: str) -> int:
+        window = MODEL_CONTEXT_TOKENS.get(model_name, 128_000)
+        budget = window - RESERVED_OUTPUT_TOKENS
+        if self.max_tokens is None:
+            return budget
+        return min(self.max_tokens, budget)
+
+    async def prepare(
+        self,
+        messages: list[BaseMessage],
+        model_name: str,
+        thread_id: str,
+        system_prompt: str,
+        user_id: str | None = None,
+    ) -> list[BaseMessage]:
+        """Returns the messages to send after the system prompt"""
+        if self.max_tokens == 0:
+            return messages
+
+        budget = self.budget(model_name)
+        system = [SystemMessage(content=system_prompt)]
+        if _fits_without_counting(system + messages, budget):
+            return messages
+
+        # Loading an encoding reads (or downloads) a file, keep it off the loop
+        counter = await asyncio.to_thread(token_counter, model_name)
+        budget -= counter(system)
+        if self.summarize:
+            budget -= SUMMARY_TOKENS
+
+        kept = self._trim(messages, budget, counter)
+        dropped = len(messages) - len(kept)
+        if dropped == 0 or not self.summarize:
+            return kept
+
+        try:
+            summary = await self._summary(
+                thread_id, messages[:dropped], counter, user_id
+            )
+        except Exception as e:
+            logger.warning("Summary failed, sending trimmed history: %s", e)
+            return kept
+
+        return [
+            SystemMessage(content=f"Summary of the earlier conversation:\n{summary}"),
+            *kept,
+        ]
+
+    @staticmethod
+    def _trim(
+        messages: list[BaseMessage], budget: int, counter: TokenCounter
+    ) -> list[BaseMessage]:
+        kept = trim_messages(
+            messages,
+            max_tokens=budget,
+            token_counter=counter,
+            strategy="last",
+            start_on="human",
+        )
+        if kept or not messages:
+            return kept
+
+        # The latest message alone is over budget: keep the end of it
+        return (
+            trim_messages(
+                messages[-1:],
+                max_tokens=budget,
+                token_counter=counter,
+                strategy="last",
+                allow_partial=True,
+            )
+            or messages[-1:]
+        )
+
+    async def _summary(
+        self,
+        thread_id: str,
+        dropped: list[BaseMessage],
+        counter: TokenCounter,
+        user_id: str | None = None,
+    ) -> str:
+        covered, summary = self._summaries.get(thread_id, (0, ""))
+        if covered == len(dropped):
+            self._summaries.move_to_end(thread_id)
+            return summary
+        if covered > len(dropped):
+            # The thread was reset or the budget grew, start over
+            covered, summary = 0, ""
+
+        new_messages = self._trim(
+            dropped[covered:], self.budget(self.summary_model), counter
+        )
+        lines = [f"Earlier summary:\n{summary}\n"] if summary else []
+        for message in new_messages:
+            if isinstance(message, (AIMessage, HumanMessage)):
+                role = "Other" if isinstance(message, HumanMessage) else "You"
+                lines.append(f"{role}: {_content(message)}")
+
+        model = self.models.get(self.summary_model)
+        # Tagged so the summary is not streamed to the client as a reply
+        response = await model.ainvoke(
+            [SystemMessage(content=SUMMARY_PROMPT), HumanMessage("\n".join(lines))],
+            config={"tags": [TAG_NOSTREAM]},
+        )
+        self._account(response, thread_id, user_id)
+        summary = _content(response)
+
+        self._summaries[thread_id] = (len(dropped), summary)
+        self._summaries.move_to_end(thread_id)
+        while len(self._summaries) > self.max_cached_summaries:
+            self._summaries.popitem(last=False)
+        return summary
+
+    def _account(self, response: AIMessage, thread_id: str, user_id: str | None):
+        """Counts a summary call like the model call it was made for"""
+        tokens = response.usage_metadata
+        if not tokens:
+            return
+        user = user_id or "anonymous"
+        if self.usage is not None:
+            self.usage.record(
+                user,
+                thread_id,
+                self.summary_model,
+                tokens["input_tokens"],
+                tokens["output_tokens"],
+            )
+        if self.admission is not None:
+            self.admission.charge(user, tokens["total_tokens"])
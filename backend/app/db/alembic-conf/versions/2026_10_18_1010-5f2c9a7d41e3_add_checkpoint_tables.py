@@ -0,0 +1,77 @@
+"""add_checkpoint_tables
+
+Revision ID: 5f2c9a7d41e3
+Revises: dc000fe07d55
+Create Date: 2026-10-18 10:10:04.183512
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5f2c9a7d41e3"
+down_revision: Union[str, Sequence[str], None] = "dc000fe07d55"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "checkpoint",
+        sa.Column("scope", sa.String(length=20), nullable=False),
+        sa.Column("thread_id", sa.String(length=100), nullable=False),
+        sa.Column("checkpoint_ns", sa.String(length=255), nullable=False),
+        sa.Column("checkpoint_id", sa.String(length=64), nullable=False),
+        sa.Column("parent_checkpoint_id", sa.String(length=64), nullable=True),
+        sa.Column("checkpoint_type", sa.String(length=20), nullable=False),
+        sa.Column("checkpoint", sa.LargeBinary(), nullable=False),
+        sa.Column("metadata_type", sa.String(length=20), nullable=False),
+        sa.Column("metadata", sa.LargeBinary(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("scope", "thread_id", "checkpoint_ns", "checkpoint_id"),
+    )
+    op.create_index(
+        op.f("ix_checkpoint_created_at"), "checkpoint", ["created_at"], unique=False
+    )
+    op.create_table(
+        "checkpoint_blob",
+        sa.Column("scope", sa.String(length=20), nullable=False),
+        sa.Column("thread_id", sa.String(length=100), nullable=False),
+        sa.Column("checkpoint_ns", sa.String(length=255), nullable=False),
+        sa.Column("channel", sa.String(length=255), nullable=False),
+        sa.Column("version", sa.String(length=64), nullable=False),
+        sa.Column("type", sa.String(length=20), nullable=False),
+        sa.Column("blob", sa.LargeBinary(), nullable=False),
+        sa.PrimaryKeyConstraint(
+            "scope", "thread_id", "checkpoint_ns", "channel", "version"
+        ),
+    )
+    op.create_table(
+        "checkpoint_write",
+        sa.Column("scope", sa.String(length=20), nullable=False),
+        sa.Column("thread_id", sa.String(length=100), nullable=False),
+        sa.Column("checkpoint_ns", sa.String(length=255), nullable=False),
+        sa.Column("checkpoint_id", sa.String(length=64), nullable=False),
+        sa.Column("task_id", sa.String(length=64), nullable=False),
+        sa.Column("idx", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("channel", sa.String(length=255), nullable=False),
+        sa.Column("type", sa.String(length=20), nullable=False),
+        sa.Column("blob", sa.LargeBinary(), nullable=False),
+        sa.Column("task_path", sa.String(length=255), nullable=False),
+        sa.PrimaryKeyConstraint(
+            "scope", "thread_id", "checkpoint_ns", "checkpoint_id", "task_id", "idx"
+        ),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("checkpoint_write")
+    op.drop_table("checkpoint_blob")
+    op.drop_index(op.f("ix_checkpoint_created_at"), table_name="checkpoint")
+    op.drop_table("checkpoint")
@@ -0,0 +1,46 @@
+"""add_listing_pagination_indexes
+
+Revision ID: 8c1e4b7a92d0
+Revises: 5f2c9a7d41e3
+Create Date: 2026-10-18 18:00:12.640921
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "8c1e4b7a92d0"
+down_revision: Union[str, Sequence[str], None] = "5f2c9a7d41e3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        "ix_conversation_user_created_at_id",
+        "conversation",
+        ["user", sa.text("created_at DESC"), sa.text("id DESC")],
+        unique=False,
+    )
+    # The composite index covers lookups by user alone
+    op.drop_index(op.f("ix_conversation_user"), table_name="conversation")
+    op.create_index(
+        "ix_prompt_user_created_at_id",
+        "prompt",
+        ["user", sa.text("created_at DESC"), sa.text("id DESC")],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_prompt_user_created_at_id", table_name="prompt")
+    op.create_index(
+        op.f("ix_conversation_user"), "conversation", ["user"], unique=False
+    )
+    op.drop_index("ix_conversation_user_created_at_id", table_name="conversation")
@@ -0,0 +1,48 @@
+"""add_usage_table
+
+Revision ID: b7d3e1a95c28
+Revises: 6a9e2d4f1b87
+Create Date: 2026-10-18 23:00:27.519364
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b7d3e1a95c28"
+down_revision: Union[str, Sequence[str], None] = "6a9e2d4f1b87"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "usage",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user", sa.String(), nullable=False),
+        sa.Column("thread_id", sa.String(length=100), nullable=False),
+        sa.Column("model", sa.String(length=50), nullable=False),
+        sa.Column("period_start", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("calls", sa.Integer(), nullable=False),
+        sa.Column("prompt_tokens", sa.Integer(), nullable=False),
+        sa.Column("completion_tokens", sa.Integer(), nullable=False),
+        sa.Column("cost_usd", sa.Float(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_usage_user_period_start",
+        "usage",
+        ["user", "period_start"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_usage_user_period_start", table_name="usage")
+    op.drop_table("usage")
@@ -0,0 +1,458 @@
+import asyncio
+import logging
+import random
+import time
+from collections.abc import AsyncIterator, Iterator, Sequence
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from sqlalchemy import Engine, delete, func, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.db import models
+
+logger = logging.getLogger(__name__)
+
+
+class SQLCheckpointSaver(BaseCheckpointSaver[str]):
+    """
+    LangGraph checkpointer stored in the application database.
+
+    Every gunicorn worker and replica reads the same tables, so a thread can be
+    continued on any worker. Connections come from the engine's pool, each
+    checkpoint (with its channel blobs) and each batch of pending writes is
+    stored with a single multi-row INSERT, and threads that have not been
+    touched for `ttl` are pruned periodically.
+
+    `scope` separates savers that share the tables but must not see each
+    other's threads (chatbot A and chatbot B use the same thread ids).
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        scope: str = "default",
+        ttl: timedelta | None = None,
+        prune_interval: float = 600.0,
+    ):
+        super().__init__()
+        self.engine = engine
+        self.scope = scope
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+        self._last_prune = time.monotonic()
+
+    # -- helpers ---------------------------------------------------------------
+
+    def _insert(self, table):
+        if self.engine.dialect.name == "postgresql":
+            return postgresql.insert(table)
+        if self.engine.dialect.name == "sqlite":
+            return sqlite.insert(table)
+        raise NotImplementedError(
+            f"Unsupported database dialect: {self.engine.dialect.name}"
+        )
+
+    def _load_blobs(
+        self, conn, thread_id: str, checkpoint_ns: str, versions: ChannelVersions
+    ) -> dict[str, Any]:
+        if not versions:
+            return {}
+
+        keys = [(channel, str(version)) for channel, version in versions.items()]
+        rows = conn.execute(
+            select(
+                models.CheckpointBlob.channel,
+                models.CheckpointBlob.type,
+                models.CheckpointBlob.blob,
+            ).where(
+                models.CheckpointBlob.scope == self.scope,
+                models.CheckpointBlob.thread_id == thread_id,
+                models.CheckpointBlob.checkpoint_ns == checkpoint_ns,
+                tuple_(
+                    models.CheckpointBlob.channel, models.CheckpointBlob.version
+                ).in_(keys),
+            )
+        )
+        return {
+            row.channel: self.serde.loads_typed((row.type, row.blob))
+            for row in rows
+            if row.type != "empty"
+        }
+
+    def _load_writes(
+        self, conn, thread_id: str, checkpoint_ns: str, checkpoint_id: str
+    ) -> list[tuple[str, str, Any]]:
+        rows = conn.execute(
+            select(
+                models.CheckpointWrite.task_id,
+                models.CheckpointWrite.channel,
+                models.CheckpointWrite.type,
+                models.CheckpointWrite.blob,
+            )
+            .where(
+                models.CheckpointWrite.scope == self.scope,
+                models.CheckpointWrite.thread_id == thread_id,
+                models.CheckpointWrite.checkpoint_ns == checkpoint_ns,
+                models.CheckpointWrite.checkpoint_id == checkpoint_id,
+            )
+            .order_by(models.CheckpointWrite.task_id, models.CheckpointWrite.idx)
+        )
+        return [
+            (row.task_id, row.channel, self.serde.loads_typed((row.type, row.blob)))
+            for row in rows
+        ]
+
+    def _to_tuple(self, conn, row) -> CheckpointTuple:
+        checkpoint = self.serde.loads_typed((row.checkpoint_type, row.checkpoint))
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": row.thread_id,
+                    "checkpoint_ns": row.checkpoint_ns,
+                    "checkpoint_id": row.checkpoint_id,
+                }
+            },
+            checkpoint={
+                **checkpoint,
+                "channel_values": self._load_blobs(
+                    conn,
+                    row.thread_id,
+                    row.checkpoint_ns,
+                    checkpoint["channel_versions"],
+                ),
+            },
+            metadata=self.serde.loads_typed((row.metadata_type, row.metadata)),
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": row.thread_id,
+                        "checkpoint_ns": row.checkpoint_ns,
+                        "checkpoint_id": row.parent_checkpoint_id,
+                    }
+                }
+                if row.parent_checkpoint_id
+                else None
+            ),
+            pending_writes=self._load_writes(
+                conn, row.thread_id, row.checkpoint_ns, row.checkpoint_id
+            ),
+        )
+
+    def _checkpoint_query(self):
+        table = models.Checkpoint.__table__
+        return select(table).where(table.c.scope == self.scope)
+
+    # -- sync interface --------------------------------------------------------
+
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        table = models.Checkpoint.__table__
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+
+        query = self._checkpoint_query().where(
+            table.c.thread_id == thread_id, table.c.checkpoint_ns == checkpoint_ns
+        )
+        if checkpoint_id := get_checkpoint_id(config):
+            query = query.where(table.c.checkpoint_id == checkpoint_id)
+        else:
+            query = query.order_by(table.c.checkpoint_id.desc()).limit(1)
+
+        with self.engine.connect() as conn:
+            row = conn.execute(query).first()
+            if row is None:
+                return None
+            return self._to_tuple(conn, row)
+
+    def list(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> Iterator[CheckpointTuple]:
+        table = models.Checkpoint.__table__
+        query = self._checkpoint_query()
+        if config:
+            query = query.where(
+                table.c.thread_id == config["configurable"]["thread_id"]
+            )
+            checkpoint_ns = config["configurable"].get("checkpoint_ns")
+            if checkpoint_ns is not None:
+                query = query.where(table.c.checkpoint_ns == checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                query = query.where(table.c.checkpoint_id == checkpoint_id)
+        if before and (before_checkpoint_id := get_checkpoint_id(before)):
+            query = query.where(table.c.checkpoint_id < before_checkpoint_id)
+        query = query.order_by(table.c.checkpoint_id.desc())
+        # Metadata filters are applied after decoding, so only limit in SQL
+        # when there is nothing left to filter
+        if limit is not None and not filter:
+            query = query.limit(limit)
+
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).all()
+            results = []
+            for row in rows:
+                if limit is not None and len(results) >= limit:
+                    break
+                if filter:
+                    metadata = self.serde.loads_typed((row.metadata_type, row.metadata))
+                    if not all(metadata.get(k) == v for k, v in filter.items()):
+                        continue
+                results.append(self._to_tuple(conn, row))
+
+        yield from results
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        c = checkpoint.copy()
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        values: dict[str, Any] = c.pop("channel_values")  # type: ignore[misc]
+
+        blobs = []
+        for channel, version in new_versions.items():
+            type_, blob = (
+                self.serde.dumps_typed(values[channel])
+                if channel in values
+                else ("empty", b"")
+            )
+            blobs.append(
+                {
+                    "scope": self.scope,
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "channel": channel,
+                    "version": str(version),
+                    "type": type_,
+                    "blob": blob,
+                }
+            )
+
+        checkpoint_type, checkpoint_blob = self.serde.dumps_typed(c)
+        metadata_type, metadata_blob = self.serde.dumps_typed(
+            get_checkpoint_metadata(config, metadata)
+        )
+        checkpoint_stmt = self._insert(models.Checkpoint.__table__).values(
+            scope=self.scope,
+            thread_id=thread_id,
+            checkpoint_ns=checkpoint_ns,
+            checkpoint_id=checkpoint["id"],
+            parent_checkpoint_id=config["configurable"].get("checkpoint_id"),
+            checkpoint_type=checkpoint_type,
+            checkpoint=checkpoint_blob,
+            metadata_type=metadata_type,
+            metadata=metadata_blob,
+            created_at=datetime.now(timezone.utc),
+        )
+        checkpoint_stmt = checkpoint_stmt.on_conflict_do_update(
+            index_elements=["scope", "thread_id", "checkpoint_ns", "checkpoint_id"],
+            set_={
+                "checkpoint_type": checkpoint_stmt.excluded.checkpoint_type,
+                "checkpoint": checkpoint_stmt.excluded.checkpoint,
+                "metadata_type": checkpoint_stmt.excluded.metadata_type,
+                "metadata": checkpoint_stmt.excluded.metadata,
+                "created_at": checkpoint_stmt.excluded.created_at,
+            },
+        )
+
+        with self.engine.begin() as conn:
+            if blobs:
+                conn.execute(
+                    self._insert(models.CheckpointBlob.__table__)
+                    .values(blobs)
+                    .on_conflict_do_nothing()
+                )
+            conn.execute(checkpoint_stmt)
+
+        self._maybe_prune()
+
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        if not writes:
+            return
+
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, blob = self.serde.dumps_typed(value)
+            rows.append(
+                {
+                    "scope": self.scope,
+                    "thread_id": config["configurable"]["thread_id"],
+                    "checkpoint_ns": config["configurable"].get("checkpoint_ns", ""),
+                    "checkpoint_id": config["configurable"]["checkpoint_id"],
+                    "task_id": task_id,
+                    "idx": WRITES_IDX_MAP.get(channel, idx),
+                    "channel": channel,
+                    "type": type_,
+                    "blob": blob,
+                    "task_path": task_path,
+                }
+            )
+
+        stmt = self._insert(models.CheckpointWrite.__table__).values(rows)
+        # Special writes (errors, interrupts) replace earlier ones, regular
+        # writes are idempotent
+        if all(channel in WRITES_IDX_MAP for channel, _ in writes):
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[
+                    "scope",
+                    "thread_id",
+                    "checkpoint_ns",
+                    "checkpoint_id",
+                    "task_id",
+                    "idx",
+                ],
+                set_={
+                    "channel": stmt.excluded.channel,
+                    "type": stmt.excluded.type,
+                    "blob": stmt.excluded.blob,
+                },
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing()
+
+        with self.engine.begin() as conn:
+            conn.execute(stmt)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self.engine.begin() as conn:
+            self._delete_threads(conn, [thread_id])
+
+    def _delete_threads(self, conn, thread_ids: Sequence[str]) -> None:
+        for table in (
+            models.CheckpointWrite.__table__,
+            models.CheckpointBlob.__table__,
+            models.Checkpoint.__table__,
+        ):
+            conn.execute(
+                delete(table).where(
+                    table.c.scope == self.scope, table.c.thread_id.in_(thread_ids)
+                )
+            )
+
+    def prune(self, ttl: timedelta | None = None) -> int:
+        """
+        Deletes every thread whose newest checkpoint is older than `ttl`.
+        Returns the number of deleted threads.
+        """
+
+        ttl = ttl or self.ttl
+        if ttl is None:
+            return 0
+
+        table = models.Checkpoint.__table__
+        cutoff = datetime.now(timezone.utc) - ttl
+        stale_threads = (
+            select(table.c.thread_id)
+            .where(table.c.scope == self.scope)
+            .group_by(table.c.thread_id)
+            .having(func.max(table.c.created_at) < cutoff)
+        )
+
+        with self.engine.begin() as conn:
+            thread_ids = list(conn.scalars(stale_threads))
+            if thread_ids:
+                self._delete_threads(conn, thread_ids)
+
+        return len(thread_ids)
+
+    def _maybe_prune(self) -> None:
+        if self.ttl is None:
+            return
+        now = time.monotonic()
+        if now - self._last_prune < self.prune_interval:
+            return
+        self._last_prune = now
+        try:
+            deleted = self.prune()
+            if deleted:
+                logger.info("Pruned %d expired threads", deleted)
+        except Exception as e:
+            logger.warning("Pruning failed: %s", e)
+
+    def get_next_version(self, current: str | None, channel: None) -> str:
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        next_v = current_v + 1
+        next_h = random.random()
+        return f"{next_v:032}.{next_h:016}"
+
+    # -- async interface -------------------------------------------------------
+    # The engine is synchronous, so the blocking calls run in a worker thread
+    # to keep the event loop (and every other token stream) responsive.
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(
+            self.put, config, checkpoint, metadata, new_versions
+        )
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
@@ -1,24 +1,68 @@
+import logging
 import os
 from dotenv import load_dotenv
 
-from sqlalchemy import create_engine, pool
+from sqlalchemy import create_engine, make_url, pool
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DATABASE_URL = os.getenv("DA_DB_URL", None)
 if DATABASE_URL is None:
     raise ValueError("DA_DB_URL environment variable is not set")
 
 app_env = os.getenv("DA_ENVIRONMENT", "production").lower()
 
-engine_args = {"echo": True}
+# SQL statements are logged with DA_SQL_ECHO, see app.log
+engine_args = {}
 
 if app_env == "development":
-    print("INFO: Running in 'development' mode, using NullPool (for supabase reasons).")
+    logger.info("Running in 'development' mode, using NullPool (for supabase reasons)")
     engine_args["poolclass"] = pool.NullPool
+elif DATABASE_URL.startswith("sqlite"):
+    logger.info("Running in '%s' mode on SQLite, using default pool", app_env)
 else:
-    print(f"INFO: Running in '{app_env}' mode, using default QueuePool.")
+    logger.info("Running in '%s' mode, using QueuePool", app_env)
+    engine_args["pool_size"] = int(os.getenv("DA_DB_POOL_SIZE", "5"))
+    engine_args["max_overflow"] = int(os.getenv("DA_DB_MAX_OVERFLOW", "10"))
+    engine_args["pool_pre_ping"] = True
 
 engine = create_engine(DATABASE_URL, **engine_args)
 DBSession = sessionmaker(bind=engine)
+
+
+def _async_url(url: str):
+    """
+    Maps the synchronous DA_DB_URL to its async driver (asyncpg / aiosqlite).
+    psycopg2's sslmode query parameter is passed to asyncpg as `ssl`.
+    """
+
+    async_url = make_url(url)
+    connect_args = {}
+    backend = async_url.get_backend_name()
+
+    if backend == "postgresql":
+        async_url = async_url.set(drivername="postgresql+asyncpg")
+        if "sslmode" in async_url.query:
+            connect_args["ssl"] = async_url.query["sslmode"]
+            async_url = async_url.difference_update_query(["sslmode"])
+    elif backend == "sqlite":
+        async_url = async_url.set(drivername="sqlite+aiosqlite")
+
+    return async_url, connect_args
+
+
+ASYNC_DATABASE_URL, async_connect_args = _async_url(DATABASE_URL)
+async_engine_args = dict(engine_args)
+
+if app_env == "development" and "asyncpg" in ASYNC_DATABASE_URL.drivername:
+    # The supabase pooler does not support asyncpg's prepared statement cache
+    async_connect_args["statement_cache_size"] = 0
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, connect_args=async_connect_args, **async_engine_args
+)
+AsyncDBSession = async_sessionmaker(bind=async_engine, expire_on_commit=False)
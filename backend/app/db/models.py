@@ -1,7 +1,17 @@
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy import String, DateTime, Text, ForeignKey, CheckConstraint
+from sqlalchemy import (
+    String,
+    DateTime,
+    Text,
+    ForeignKey,
+    CheckConstraint,
+    Index,
+    LargeBinary,
+    Boolean,
+    Float,
+)
 from datetime import datetime
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 
 
 class Base(DeclarativeBase):
@@ -12,6 +22,15 @@ class Prompt(Base):
     """Table for storing prompts"""
 
     __tablename__ = "prompt"
+    __table_args__ = (
+        # Serves the newest-first keyset pagination of /get_prompts
+        Index(
+            "ix_prompt_user_created_at_id",
+            "user",
+            text("created_at DESC"),
+            text("id DESC"),
+        ),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     user: Mapped[str] = mapped_column(String(), nullable=False)
@@ -33,10 +52,17 @@ class Conversation(Base):
         CheckConstraint(
             "turns >= 1 AND turns <= 20", name="conversation_turns_range_check"
         ),
+        # Serves the newest-first keyset pagination of GET /conversations
+        Index(
+            "ix_conversation_user_created_at_id",
+            "user",
+            text("created_at DESC"),
+            text("id DESC"),
+        ),
     )
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    user: Mapped[str] = mapped_column(String(), nullable=False, index=True)
+    user: Mapped[str] = mapped_column(String(), nullable=False)
     conversation_starter: Mapped[str] = mapped_column(String(15000), nullable=False)
     thread_id: Mapped[str] = mapped_column(String(100), nullable=False)
     model: Mapped[str] = mapped_column(String(50), nullable=True)
@@ -52,6 +78,9 @@ class Conversation(Base):
         back_populates="conversation",
         cascade="all, delete-orphan",
         order_by="Message.order",
+        # Never lazy-load: queries that need messages must eager-load them,
+        # otherwise listings turn into one SELECT per conversation
+        lazy="raise_on_sql",
     )
 
     def __repr__(self):
@@ -82,3 +111,143 @@ class Message(Base):
 
     def __repr__(self):
         return f"id: {self.id}, chatbot: {self.chatbot}, order: {self.order}"
+
+
+class Checkpoint(Base):
+    """Table for storing LangGraph checkpoints, shared by all workers"""
+
+    __tablename__ = "checkpoint"
+
+    scope: Mapped[str] = mapped_column(String(20), primary_key=True)
+    thread_id: Mapped[str] = mapped_column(String(100), primary_key=True)
+    checkpoint_ns: Mapped[str] = mapped_column(String(255), primary_key=True)
+    checkpoint_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    parent_checkpoint_id: Mapped[str] = mapped_column(String(64), nullable=True)
+    checkpoint_type: Mapped[str] = mapped_column(String(20), nullable=False)
+    checkpoint: Mapped[bytes] = mapped_column(LargeBinary(), nullable=False)
+    metadata_type: Mapped[str] = mapped_column(String(20), nullable=False)
+    # "metadata" is reserved on declarative classes
+    metadata_: Mapped[bytes] = mapped_column("metadata", LargeBinary(), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, index=True
+    )
+
+    def __repr__(self):
+        return f"scope: {self.scope}, thread_id: {self.thread_id}, checkpoint_id: {self.checkpoint_id}"
+
+
+class CheckpointBlob(Base):
+    """Table for storing serialized channel values of checkpoints"""
+
+    __tablename__ = "checkpoint_blob"
+
+    scope: Mapped[str] = mapped_column(String(20), primary_key=True)
+    thread_id: Mapped[str] = mapped_column(String(100), primary_key=True)
+    checkpoint_ns: Mapped[str] = mapped_column(String(255), primary_key=True)
+    channel: Mapped[str] = mapped_column(String(255), primary_key=True)
+    version: Mapped[str] = mapped_column(String(64), primary_key=True)
+    type: Mapped[str] = mapped_column(String(20), nullable=False)
+    blob: Mapped[bytes] = mapped_column(LargeBinary(), nullable=False)
+
+    def __repr__(self):
+        return f"thread_id: {self.thread_id}, channel: {self.channel}, version: {self.version}"
+
+
+class CheckpointWrite(Base):
+    """Table for storing pending writes of checkpoints"""
+
+    __tablename__ = "checkpoint_write"
+
+    scope: Mapped[str] = mapped_column(String(20), primary_key=True)
+    thread_id: Mapped[str] = mapped_column(String(100), primary_key=True)
+    checkpoint_ns: Mapped[str] = mapped_column(String(255), primary_key=True)
+    checkpoint_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    task_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    idx: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    channel: Mapped[str] = mapped_column(String(255), nullable=False)
+    type: Mapped[str] = mapped_column(String(20), nullable=False)
+    blob: Mapped[bytes] = mapped_column(LargeBinary(), nullable=False)
+    task_path: Mapped[str] = mapped_column(String(255), nullable=False, default="")
+
+    def __repr__(self):
+        return f"thread_id: {self.thread_id}, task_id: {self.task_id}, idx: {self.idx}"
+
+
+class ResponseCacheEntry(Base):
+    """Table for storing cached /chat replies, shared by all workers"""
+
+    __tablename__ = "response_cache"
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    model: Mapped[str] = mapped_column(String(50), nullable=False)
+    content: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False
+    )
+    expires_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, index=True
+    )
+
+    def __repr__(self):
+        return f"key: {self.key}, model: {self.model}, expires_at: {self.expires_at}"
+
+
+class ConversationJob(Base):
+    """Table for storing background conversation jobs, shared by all workers"""
+
+    __tablename__ = "conversation_job"
+    __table_args__ = (
+        # Serves the oldest-first claim of queued jobs
+        Index("ix_conversation_job_status_created_at", "status", "created_at"),
+    )
+
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    user: Mapped[str] = mapped_column(String(), nullable=False)
+    # The ConversationStart to run, as JSON
+    spec: Mapped[str] = mapped_column(Text(), nullable=False)
+    status: Mapped[str] = mapped_column(String(20), nullable=False)
+    # Completed turns, as JSON
+    messages: Mapped[str] = mapped_column(Text(), nullable=False, default="[]")
+    error: Mapped[str] = mapped_column(Text(), nullable=True)
+    conversation_id: Mapped[int] = mapped_column(nullable=True)
+    cancel_requested: Mapped[bool] = mapped_column(
+        Boolean(), nullable=False, default=False
+    )
+    # Worker that claimed the job
+    worker: Mapped[str] = mapped_column(String(64), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False
+    )
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False
+    )
+
+    def __repr__(self):
+        return f"id: {self.id}, user: {self.user}, status: {self.status}"
+
+
+class Usage(Base):
+    """Table for storing token usage, one row per user, thread and model per flush"""
+
+    __tablename__ = "usage"
+    __table_args__ = (
+        # Serves the per-user quota sums over the current window
+        Index("ix_usage_user_period_start", "user", "period_start"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user: Mapped[str] = mapped_column(String(), nullable=False)
+    thread_id: Mapped[str] = mapped_column(String(100), nullable=False)
+    model: Mapped[str] = mapped_column(String(50), nullable=False)
+    # Start of the aggregation period the row covers
+    period_start: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False
+    )
+    calls: Mapped[int] = mapped_column(nullable=False)
+    prompt_tokens: Mapped[int] = mapped_column(nullable=False)
+    completion_tokens: Mapped[int] = mapped_column(nullable=False)
+    # Empty for models without a price in DA_LLM_PRICES
+    cost_usd: Mapped[float] = mapped_column(Float(), nullable=True)
+
+    def __repr__(self):
+        return f"user: {self.user}, model: {self.model}, calls: {self.calls}"
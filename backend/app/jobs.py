@@ -0,0 +1,558 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from collections.abc import AsyncIterator, Callable
+from contextlib import aclosing
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from sqlalchemy import and_, delete, select, update
+
+from app.db import models
+from app.log import request_id
+from app.metrics import current_endpoint
+from app.runs import RunRegistry
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = {SUCCEEDED, FAILED, CANCELLED}
+
+
+class Job:
+    """A conversation submitted to run in the background"""
+
+    def __init__(
+        self,
+        job_id: str,
+        user_id: str,
+        spec: dict,
+        status: str = QUEUED,
+        messages: list[dict] | None = None,
+        error: str | None = None,
+        conversation_id: int | None = None,
+        cancel_requested: bool = False,
+        created_at: float | None = None,
+        updated_at: float | None = None,
+        worker: str | None = None,
+    ):
+        self.id = job_id
+        self.user_id = user_id
+        # What to run, as stored by the queue; see JobManager.execute
+        self.spec = spec
+        self.status = status
+        # Completed turns as {"chatbot", "message"}
+        self.messages = messages or []
+        self.error = error
+        self.conversation_id = conversation_id
+        self.cancel_requested = cancel_requested
+        # Worker holding the job's lease while it runs (database queue)
+        self.worker = worker
+        self.created_at = created_at or time.time()
+        self.updated_at = updated_at or self.created_at
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "messages": self.messages,
+            "error": self.error,
+            "conversation_id": self.conversation_id,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class MemoryJobQueue:
+    """
+    Jobs of this process. Finished jobs are dropped `retention` seconds after
+    they were last updated.
+    """
+
+    # Jobs are only seen by the workers of this process
+    shared = False
+
+    def __init__(self, retention: float = 3600.0):
+        self.retention = retention
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._pending: deque[str] = deque()
+        self._waiters: deque[asyncio.Future] = deque()
+
+    async def put(self, job: Job) -> None:
+        self._prune()
+        self._jobs[job.id] = job
+        self._pending.append(job.id)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    async def claim(self, worker: str) -> Job:
+        """Waits for the oldest queued job and marks it running"""
+        while True:
+            if not self._pending:
+                waiter = asyncio.get_running_loop().create_future()
+                self._waiters.append(waiter)
+                await waiter
+                continue
+            job = self._jobs.get(self._pending.popleft())
+            # Cancelled (or pruned) while waiting in the queue
+            if job is not None and job.status == QUEUED:
+                job.status = RUNNING
+                job.updated_at = time.time()
+                return job
+
+    async def get(self, job_id: str) -> Job | None:
+        return self._jobs.get(job_id)
+
+    async def save(self, job: Job) -> None:
+        job.updated_at = time.time()
+        self._jobs[job.id] = job
+        self._jobs.move_to_end(job.id)
+
+    async def cancel(self, job_id: str) -> Job | None:
+        """Cancels a queued job and flags a running one"""
+        job = self._jobs.get(job_id)
+        if job is None or job.status in FINISHED:
+            return job
+        if job.status == QUEUED:
+            job.status = CANCELLED
+        job.cancel_requested = True
+        await self.save(job)
+        return job
+
+    async def cancel_requested(self, job_id: str) -> bool:
+        job = self._jobs.get(job_id)
+        return job is not None and job.cancel_requested
+
+    def _prune(self) -> None:
+        # Oldest updates first; stops at the first job still kept
+        cutoff = time.time() - self.retention
+        for job in list(self._jobs.values()):
+            if job.updated_at > cutoff:
+                break
+            if job.status in FINISHED:
+                del self._jobs[job.id]
+
+
+def _timestamp(value: datetime) -> float:
+    # SQLite hands back naive datetimes; they are stored in UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class DatabaseJobQueue:
+    """
+    Jobs in the conversation_job table, shared by all workers.
+
+    Any worker may claim a queued job, and any worker can report and cancel a
+    job: the worker running it polls the cancel flag every `poll_interval`
+    seconds. Finished jobs older than `retention` seconds are deleted every
+    `prune_every` submissions.
+
+    The worker running a job renews its lease at least every third of
+    `lease_timeout`. A running job whose lease has not been renewed for
+    `lease_timeout` seconds, because its worker crashed or was killed, is
+    marked failed by the next worker that polls the queue.
+    """
+
+    shared = True
+
+    def __init__(
+        self,
+        session_factory,
+        poll_interval: float = 1.0,
+        retention: float = 3600.0,
+        prune_every: int = 100,
+        lease_timeout: float = 60.0,
+    ):
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.prune_every = prune_every
+        self.lease_timeout = lease_timeout
+        self._puts = 0
+        self._expired_at = 0.0
+
+    @staticmethod
+    def _job(row: models.ConversationJob) -> Job:
+        return Job(
+            row.id,
+            row.user,
+            json.loads(row.spec),
+            status=row.status,
+            messages=json.loads(row.messages),
+            error=row.error,
+            conversation_id=row.conversation_id,
+            cancel_requested=row.cancel_requested,
+            created_at=_timestamp(row.created_at),
+            updated_at=_timestamp(row.updated_at),
+            worker=row.worker,
+        )
+
+    async def put(self, job: Job) -> None:
+        now = datetime.now(timezone.utc)
+        async with self.session_factory() as db, db.begin():
+            db.add(
+                models.ConversationJob(
+                    id=job.id,
+                    user=job.user_id,
+                    spec=json.dumps(job.spec),
+                    status=job.status,
+                    messages=json.dumps(job.messages),
+                    created_at=now,
+                    updated_at=now,
+                )
+            )
+            self._puts += 1
+            if self._puts % self.prune_every == 0:
+                await db.execute(
+                    delete(models.ConversationJob).where(
+                        models.ConversationJob.status.in_(FINISHED),
+                        models.ConversationJob.updated_at
+                        < now - timedelta(seconds=self.retention),
+                    )
+                )
+
+    async def claim(self, worker: str) -> Job:
+        """Polls for the oldest queued job until this worker wins one"""
+        job_table = models.ConversationJob
+        while True:
+            await self._expire_leases()
+            async with self.session_factory() as db, db.begin():
+                job_id = await db.scalar(
+                    select(job_table.id)
+                    .where(job_table.status == QUEUED)
+                    .order_by(job_table.created_at)
+                    .limit(1)
+                )
+                if job_id is not None:
+                    # Only one worker's update matches while the job is queued
+                    claimed = await db.execute(
+                        update(job_table)
+                        .where(job_table.id == job_id, job_table.status == QUEUED)
+                        .values(
+                            status=RUNNING,
+                            worker=worker,
+                            updated_at=datetime.now(timezone.utc),
+                        )
+                    )
+                    if claimed.rowcount == 1:
+                        return self._job(await db.get(job_table, job_id))
+                    continue
+            await asyncio.sleep(self.poll_interval)
+
+    async def _expire_leases(self) -> None:
+        """Fails the running jobs whose worker stopped renewing their lease"""
+        if time.monotonic() - self._expired_at < self.lease_timeout / 3:
+            return
+        self._expired_at = time.monotonic()
+        job_table = models.ConversationJob
+        now = datetime.now(timezone.utc)
+        async with self.session_factory() as db, db.begin():
+            expired = await db.execute(
+                update(job_table)
+                .where(
+                    job_table.status == RUNNING,
+                    job_table.updated_at < now - timedelta(seconds=self.lease_timeout),
+                )
+                .values(status=FAILED, error="Worker lost", updated_at=now)
+            )
+        if expired.rowcount:
+            logger.warning("Failed %d jobs of lost workers", expired.rowcount)
+
+    def _leased(self, job: Job):
+        """Condition matching the job only while `job.worker` holds its lease"""
+        job_table = models.ConversationJob
+        return and_(
+            job_table.id == job.id,
+            job_table.status == RUNNING,
+            job_table.worker == job.worker,
+        )
+
+    async def renew(self, job: Job) -> bool:
+        """Renews the lease of a running job, False if the lease was lost"""
+        async with self.session_factory() as db, db.begin():
+            renewed = await db.execute(
+                update(models.ConversationJob)
+                .where(self._leased(job))
+                .values(updated_at=datetime.now(timezone.utc))
+            )
+        return renewed.rowcount == 1
+
+    async def get(self, job_id: str) -> Job | None:
+        async with self.session_factory() as db:
+            row = await db.get(models.ConversationJob, job_id)
+            return row and self._job(row)
+
+    async def save(self, job: Job) -> None:
+        """
+        Writes the progress of a job this worker runs. Nothing is written once
+        its lease is lost, so a late worker never overwrites "Worker lost".
+        """
+        job.updated_at = time.time()
+        async with self.session_factory() as db, db.begin():
+            saved = await db.execute(
+                update(models.ConversationJob)
+                .where(self._leased(job))
+                .values(
+                    status=job.status,
+                    messages=json.dumps(job.messages),
+                    error=job.error,
+                    conversation_id=job.conversation_id,
+                    updated_at=datetime.fromtimestamp(job.updated_at, timezone.utc),
+                )
+            )
+        if saved.rowcount == 0:
+            logger.warning("Job %s lost its lease, its result is not saved", job.id)
+
+    async def cancel(self, job_id: str) -> Job | None:
+        job_table = models.ConversationJob
+        now = datetime.now(timezone.utc)
+        async with self.session_factory() as db, db.begin():
+            await db.execute(
+                update(job_table)
+                .where(job_table.id == job_id, job_table.status == QUEUED)
+                .values(status=CANCELLED, cancel_requested=True, updated_at=now)
+            )
+            await db.execute(
+                update(job_table)
+                .where(job_table.id == job_id, job_table.status == RUNNING)
+                .values(cancel_requested=True)
+            )
+        return await self.get(job_id)
+
+    async def cancel_requested(self, job_id: str) -> bool:
+        async with self.session_factory() as db:
+            return bool(
+                await db.scalar(
+                    select(models.ConversationJob.cancel_requested).where(
+                        models.ConversationJob.id == job_id
+                    )
+                )
+            )
+
+
+def create_job_queue() -> MemoryJobQueue | DatabaseJobQueue:
+    """
+    Builds the job queue selected by DA_JOB_QUEUE.
+
+    - "memory": jobs run and are reported only by this process, so it needs a
+      single worker process. The default unless DA_CHECKPOINTER is "database".
+    - "database": jobs are kept in the conversation_job table, so they are
+      picked up by whichever worker is free and can be polled or cancelled
+      through any worker. The default with the database checkpointer.
+
+    Finished jobs are kept for DA_JOB_RETENTION_SECONDS (default 3600). With
+    the database queue, DA_JOB_POLL_SECONDS (default 1) is how often workers
+    look for jobs and cancel requests, and DA_JOB_LEASE_SECONDS (default 60)
+    how long a running job may go without news from its worker.
+    """
+
+    # Several workers share a database checkpointer, so they share the jobs too
+    default = os.getenv("DA_CHECKPOINTER", "memory").lower()
+    backend = os.getenv("DA_JOB_QUEUE", default).lower()
+    retention = float(os.getenv("DA_JOB_RETENTION_SECONDS", "3600"))
+    if backend == "memory":
+        return MemoryJobQueue(retention=retention)
+
+    if backend == "database":
+        # Imported lazily so the memory backend works without DA_DB_URL
+        from app.db.database import AsyncDBSession
+
+        return DatabaseJobQueue(
+            AsyncDBSession,
+            poll_interval=float(os.getenv("DA_JOB_POLL_SECONDS", "1")),
+            retention=retention,
+            lease_timeout=float(os.getenv("DA_JOB_LEASE_SECONDS", "60")),
+        )
+
+    raise ValueError(f"Unknown DA_JOB_QUEUE backend: {backend}")
+
+
+class JobManager:
+    """
+    Runs queued jobs on `concurrency` asyncio workers of this process.
+
+    `execute(job)` returns the job's event stream. Each job is started as a
+    background run of the run registry under the job id, so any number of
+    clients can watch it through one shared event buffer, and it goes on
+    whether anyone watches or not. The job record only receives the
+    completed turns, so polling never touches the stream.
+    """
+
+    # Seconds a worker waits after failing to claim a job, doubled up to the max
+    CLAIM_BACKOFF = 0.5
+    CLAIM_BACKOFF_MAX = 30.0
+
+    def __init__(
+        self,
+        registry: RunRegistry,
+        execute: Callable[[Job], AsyncIterator[dict]],
+        queue: MemoryJobQueue | DatabaseJobQueue | None = None,
+        concurrency: int = 4,
+    ):
+        self.registry = registry
+        self.execute = execute
+        self.queue = queue or MemoryJobQueue()
+        self.concurrency = concurrency
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.running: dict[str, Job] = {}
+        self._workers: list[asyncio.Task] = []
+
+    @classmethod
+    def from_env(
+        cls, registry: RunRegistry, execute: Callable[[Job], AsyncIterator[dict]]
+    ) -> "JobManager":
+        """Reads DA_JOB_CONCURRENCY, the queue is chosen by create_job_queue"""
+        return cls(
+            registry,
+            execute,
+            queue=create_job_queue(),
+            concurrency=int(os.getenv("DA_JOB_CONCURRENCY", "4")),
+        )
+
+    def start(self) -> None:
+        """Starts the workers on the running loop, if not started yet"""
+        self._workers = [w for w in self._workers if not w.done()]
+        for _ in range(len(self._workers), self.concurrency):
+            self._workers.append(asyncio.create_task(self._work()))
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, user_id: str, spec: dict) -> Job:
+        job = Job(uuid.uuid4().hex, user_id, spec)
+        await self.queue.put(job)
+        self.start()
+        return job
+
+    async def get(self, job_id: str, user_id: str) -> Job | None:
+        """The job, if it exists and belongs to `user_id`"""
+        job = self.running.get(job_id) or await self.queue.get(job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        return job
+
+    async def cancel(self, job_id: str, user_id: str) -> Job | None:
+        if await self.get(job_id, user_id) is None:
+            return None
+        job = await self.queue.cancel(job_id)
+        # Running here: stop it now instead of at the next cancel poll
+        self.registry.cancel(job_id)
+        return self.running.get(job_id) or job
+
+    async def _work(self) -> None:
+        # Metrics of jobs are reported under the endpoint that submits them
+        current_endpoint.set("/jobs")
+        backoff = self.CLAIM_BACKOFF
+        while True:
+            try:
+                job = await self.queue.claim(self.worker_id)
+            except Exception as e:
+                # A database hiccup must not take the worker down with it
+                logger.warning(
+                    "Claiming a job failed, retrying in %.1fs: %s", backoff, e
+                )
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.CLAIM_BACKOFF_MAX)
+                continue
+            backoff = self.CLAIM_BACKOFF
+            # Logs of the job are correlated by its id instead of a request's
+            request_id.set(job.id)
+            self.running[job.id] = job
+            try:
+                await self._run(job)
+            except Exception as e:
+                logger.exception("Job failed: %s", e)
+                job.status, job.error = FAILED, str(e)
+                await self.queue.save(job)
+            finally:
+                self.running.pop(job.id, None)
+
+    async def _run(self, job: Job) -> None:
+        run = self.registry.start(
+            job.user_id, self._record(job), run_id=job.id, background=True
+        )
+        watcher = None
+        if self.queue.shared:
+            watcher = asyncio.create_task(self._watch_cancel(job))
+        try:
+            await run.task
+        except asyncio.CancelledError:
+            # The worker is stopping; the run was cancelled with it
+            job.status, job.error = FAILED, "Worker stopped"
+            await self.queue.save(job)
+            raise
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+        last = run.events[-1][1] if run.events else {}
+        if last.get("type") == "cancelled":
+            job.status = CANCELLED
+        else:
+            job.status = FAILED if job.error else SUCCEEDED
+        await self.queue.save(job)
+
+    async def _record(self, job: Job) -> AsyncIterator[dict]:
+        """Passes the job's events on, saving each completed turn"""
+        chatbot, parts = None, []
+        try:
+            async with aclosing(self.execute(job)) as events:
+                async for event in events:
+                    if event["type"] == "start":
+                        chatbot, parts = event["chatbot"], []
+                    elif event["type"] == "token":
+                        parts.append(event["content"])
+                    elif event["type"] == "end":
+                        job.messages.append(
+                            {"chatbot": chatbot, "message": "".join(parts)}
+                        )
+                        job.conversation_id = event.get("conversation_id")
+                        await self.queue.save(job)
+                    elif event["type"] == "error":
+                        job.error = event["content"]
+                    yield event
+        except Exception as e:
+            job.error = str(e)
+            yield {"type": "error", "content": str(e)}
+
+    async def _watch_cancel(self, job: Job) -> None:
+        """Polls the job's cancel flag and keeps its lease"""
+        renewed_at = time.monotonic()
+        while True:
+            await asyncio.sleep(self.queue.poll_interval)
+            try:
+                if await self.queue.cancel_requested(job.id):
+                    self.registry.cancel(job.id)
+                    return
+                if time.monotonic() - renewed_at >= self.queue.lease_timeout / 3:
+                    if not await self.queue.renew(job):
+                        # Failed as lost by another worker, stop producing it
+                        self.registry.cancel(job.id)
+                        return
+                    renewed_at = time.monotonic()
+            except Exception as e:
+                logger.warning("Polling the job failed: %s", e)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "workers": len([w for w in self._workers if not w.done()]),
+            "concurrency": self.concurrency,
+            "running": len(self.running),
+        }
@@ -0,0 +1,173 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import uuid
+import zlib
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REQUEST_ID_HEADER = "X-Request-Id"
+
+# Correlation ids of the request (or job) and conversation thread being served,
+# inherited by the tasks they start
+request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+thread_id: ContextVar[str | None] = ContextVar("thread_id", default=None)
+
+# Attributes every LogRecord has; anything else was passed with `extra`
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener: QueueListener | None = None
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The queue stays in this process: only the arguments are merged here,
+        # formatting (tracebacks included) is left to the listener thread
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+
+class CorrelationFilter(logging.Filter):
+    """Stamps records with the current request and thread ids"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        record.thread_id = thread_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps `rate` of the DEBUG records. The choice is made per thread id, so a
+    sampled conversation keeps all of its debug events.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        key = getattr(record, "thread_id", None)
+        if key is None:
+            return random.random() < self.rate
+        return zlib.crc32(key.encode()) % 10_000 < self.rate * 10_000
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the fields passed with `extra`"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(
+            (key, value)
+            for key, value in vars(record).items()
+            if key not in _RECORD_ATTRS and value is not None
+        )
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Readable lines for local development, `extra` fields appended"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = " ".join(
+            f"{key}={value}"
+            for key, value in vars(record).items()
+            if key not in _RECORD_ATTRS and value is not None
+        )
+        return f"{line} [{fields}]" if fields else line
+
+
+def configure_logging() -> None:
+    """
+    Sends the app's logs through a queue to a background thread that formats
+    and writes them, so logging never blocks the event loop.
+
+    - DA_LOG_LEVEL: level of the app loggers (default INFO).
+    - DA_LOG_FORMAT: "json" (default) or "text".
+    - DA_LOG_DEBUG_SAMPLE_RATE: share of conversations whose per-turn DEBUG
+      events are kept (default 0.1).
+    - DA_SQL_ECHO: "true" logs every SQL statement (default false).
+
+    Safe to call more than once.
+    """
+
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    if os.getenv("DA_LOG_FORMAT", "json").lower() == "text":
+        output.setFormatter(TextFormatter())
+    else:
+        output.setFormatter(JsonFormatter())
+
+    handler = _QueueHandler(queue.SimpleQueue())
+    handler.addFilter(CorrelationFilter())
+    handler.addFilter(
+        SamplingFilter(float(os.getenv("DA_LOG_DEBUG_SAMPLE_RATE", "0.1")))
+    )
+
+    app_logger = logging.getLogger("app")
+    app_logger.setLevel(os.getenv("DA_LOG_LEVEL", "INFO").upper())
+    app_logger.addHandler(handler)
+    app_logger.propagate = False
+
+    if os.getenv("DA_SQL_ECHO", "false").lower() == "true":
+        sql_logger = logging.getLogger("sqlalchemy.engine")
+        sql_logger.setLevel(logging.INFO)
+        sql_logger.addHandler(handler)
+        sql_logger.propagate = False
+
+    _listener = QueueListener(handler.queue, output)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+class RequestIdMiddleware:
+    """
+    Sets request_id from the X-Request-Id header, or a new id, and returns it
+    in the response's X-Request-Id header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        header = REQUEST_ID_HEADER.lower().encode()
+        value = dict(scope["headers"]).get(header)
+        current = value.decode("latin-1")[:64] if value else uuid.uuid4().hex
+        request_id.set(current)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", []).append(
+                    (header, current.encode("latin-1"))
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_with_id)
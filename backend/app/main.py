@@ -1,26 +1,102 @@
+import logging
 import os
 from dotenv import load_dotenv
-from fastapi import FastAPI, Request, HTTPException, status, Depends, Response
+from app.log import (
+    REQUEST_ID_HEADER,
+    RequestIdMiddleware,
+    configure_logging,
+    thread_id,
+)
+
+# Before the other app modules are imported, some of them log on import
+configure_logging()
+
+from fastapi import (
+    FastAPI,
+    Request,
+    HTTPException,
+    status,
+    Depends,
+    Response,
+    Query,
+    Header,
+)
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from starlette.middleware.sessions import SessionMiddleware
-from app.chatbot import ChatbotService
+from app.admission import AdmissionRejected, admission, estimate_tokens
+from app.chatbot import ChatbotService, model_pool
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from app.checkpointer import create_checkpointer
 from app.routers.oidc_router import oidc_router
-from app.db.database import DBSession
-from sqlalchemy.orm import Session
+from app.db.database import AsyncDBSession
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from app import schemas
 from app.db import models
-from sqlalchemy import select, update
+from app.resilience import ModelError, retry_policy
+from app.response_cache import create_response_cache
+from app.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    NEXT_CURSOR_HEADER,
+    keyset_page,
+    split_page,
+)
+from app.jobs import FINISHED, Job, JobManager
+from app.metrics import (
+    CONTENT_TYPE,
+    EndpointMiddleware,
+    metrics,
+    record_turn,
+    track_db_queries,
+)
+from app.runs import RUN_ID_HEADER, run_registry
+from app.usage import usage_tracker
+from app.sse import TokenStream, coalesce_tokens
+from sqlalchemy import delete, func, insert, select, update
 import asyncio
+import io
+import math
+import time
+from contextlib import aclosing, asynccontextmanager
 from fastapi.responses import StreamingResponse, RedirectResponse
-import json
 
 load_dotenv()
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warm_up = None
+    if os.getenv("DA_MODEL_WARMUP", "true").lower() == "true":
+        model_names = os.getenv("DA_WARMUP_MODELS") or chatbot_a.default_model_name
+        # In the background so an unreachable endpoint never delays startup
+        warm_up = asyncio.create_task(
+            model_pool.warm_up([m.strip() for m in model_names.split(",")])
+        )
+    # Picks up jobs queued through other workers
+    job_manager.start()
+    usage_tracker.start()
+    yield
+    await job_manager.stop()
+    # Writes the usage not flushed yet
+    await usage_tracker.stop()
+    if warm_up is not None:
+        warm_up.cancel()
+    await model_pool.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(SessionMiddleware, secret_key=os.getenv("DA_SESSION_SECRET"))
+# Labels the metrics recorded while serving a request with its route
+app.add_middleware(EndpointMiddleware)
+app.add_middleware(RequestIdMiddleware)
+track_db_queries()
 
 
 def get_current_user(request: Request) -> dict:
@@ -37,15 +113,25 @@ def get_user_id(user: dict = Depends(get_current_user)) -> str:
     try:
         return user["sub"]
     except KeyError as exc:
-        print("CRITICAL: 'sub' not found in user session data")
+        logger.critical("'sub' not found in user session data")
         raise HTTPException(
             status_code=404, detail="Unable to identify the user"
         ) from exc
 
 
+async def get_db():
+    async with AsyncDBSession() as db:
+        yield db
+
+
+def get_session_factory():
+    """Session factory for database work that outlives the request, like streams"""
+    return AsyncDBSession
+
+
 env = os.getenv("DA_ENVIRONMENT", "not_set")
 if env == "development":
-    print("✅ Running in DEVELOPMENT mode. MOCK login routes enabled.")
+    logger.info("Running in DEVELOPMENT mode, MOCK login routes enabled")
 
     app.add_middleware(
         CORSMiddleware,
@@ -53,8 +139,14 @@ if env == "development":
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=[
+            NEXT_CURSOR_HEADER,
+            "X-Cache",
+            RUN_ID_HEADER,
+            REQUEST_ID_HEADER,
+        ],
     )
-    print("✅ CORS enabled for development")
+    logger.info("CORS enabled for development")
 
     @app.get("/login")
     async def mock_login(request: Request):
@@ -64,19 +156,21 @@ if env == "development":
             "username": "pate",
             "name": "Patrick Bateman",
         }
-        print("Mock user logged in")
+        logger.info("Mock user logged in")
         return RedirectResponse(url="/")
 
 else:
     if env == "production":
-        print("🚀 Running in PRODUCTION mode. Using REAL OIDC authentication.")
+        logger.info("Running in PRODUCTION mode, using REAL OIDC authentication")
     else:
-        print(f"⚠️ Running in '{env}' mode. Using REAL OIDC authentication.")
+        logger.warning("Running in '%s' mode, using REAL OIDC authentication", env)
 
     app.include_router(oidc_router)
 
-chatbot_a = ChatbotService()
-chatbot_b = ChatbotService()
+# Shared by both bots: a cached reply depends only on the prompt, not the bot
+response_cache = create_response_cache()
+chatbot_a = ChatbotService(checkpointer=create_checkpointer("a"), cache=response_cache)
+chatbot_b = ChatbotService(checkpointer=create_checkpointer("b"), cache=response_cache)
 
 messages: list[str] = []
 
@@ -87,10 +181,14 @@ class Message(BaseModel):
 
 class ChatMessage(BaseModel):
     message: str
-    thread_id: str = "default"
+    # Stored with the checkpoints and usage rows, which allow 100 characters
+    thread_id: str = Field("default", max_length=100)
     system_prompt: str | None = None
     model: str | None = None
     chatbot: str = "a"
+    temperature: float | None = Field(None, ge=0, le=2)
+    # Use the response cache even when the temperature is not 0
+    force_cache: bool = False
 
 
 class ChatResponse(BaseModel):
@@ -105,10 +203,19 @@ class ConversationStart(BaseModel):
     initial_message: str
     system_prompt_a: str | None = None
     system_prompt_b: str | None = None
-    thread_id: str = "default"
+    thread_id: str = Field("default", max_length=100)
     turns: int = 6
     model: str | None = None
     history: list[dict] | None = None
+    # Save each completed turn to the database while streaming
+    persist: bool = False
+    # Saved conversation to continue (resume mode): its saved messages are used
+    # instead of `history`, and with `persist` new turns are appended to it
+    conversation_id: int | None = None
+    # Tokens are sent in one event per `flush_tokens` tokens or `flush_ms`
+    # milliseconds, whichever comes first. 1 or 0 sends every token on its own.
+    flush_tokens: int = Field(16, ge=1, le=1000)
+    flush_ms: int = Field(40, ge=0, le=1000)
 
 
 class ConversationResponse(BaseModel):
@@ -123,124 +230,652 @@ async def real_logout(request: Request):
 
 
 @app.post("/chat", response_model=ChatResponse)
-def chat_with_bot(
-    chat_msg: ChatMessage, current_user: dict = Depends(get_current_user)
+async def chat_with_bot(
+    chat_msg: ChatMessage, response: Response, user_id: str = Depends(get_user_id)
 ):
+    thread_id.set(chat_msg.thread_id)
     if chat_msg.chatbot == "b":
         chatbot = chatbot_b
     else:
         chatbot = chatbot_a
 
-    ai_response = chatbot.chat(
-        chat_msg.message,
-        chat_msg.thread_id,
-        chat_msg.system_prompt,
-        chat_msg.model,
-    )
+    try:
+        async with admission.slot(user_id, estimate_tokens(chat_msg.message)) as ticket:
+            started = time.perf_counter()
+            reply = await chatbot.chat_message(
+                chat_msg.message,
+                chat_msg.thread_id,
+                chat_msg.system_prompt,
+                chat_msg.model,
+                temperature=chat_msg.temperature,
+                force_cache=chat_msg.force_cache,
+                user_id=user_id,
+            )
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))},
+        )
+    except ModelError as e:
+        headers = None
+        if e.retry_after is not None:
+            headers = {"Retry-After": str(math.ceil(e.retry_after))}
+        raise HTTPException(
+            status_code=e.http_status,
+            detail={"code": e.code, "message": str(e)},
+            headers=headers,
+        )
+    response.headers["X-Cache"] = reply.response_metadata.get("cache", "bypass")
+    if response.headers["X-Cache"] != "hit":
+        record_turn(
+            chatbot.resolve_model(chat_msg.model),
+            ticket.wait,
+            time.perf_counter() - started,
+        )
     return ChatResponse(
         user_message=chat_msg.message,
-        ai_response=ai_response,
+        ai_response=reply.content,
         thread_id=chat_msg.thread_id,
         chatbot=chat_msg.chatbot,
     )
 
 
-async def conversation_generator(conv: ConversationStart, request: Request):
-    print(f"\n--- 🚀 STARTING TOKEN STREAM for {conv.turns} turns ---")
-    print(f"--- 📝 Thread ID: {conv.thread_id} ---")
+def history_context(history: list[dict], initial_message: str) -> str:
+    """Readable transcript of past messages followed by the new message"""
+    context = io.StringIO()
+    for m in history:
+        role = m.get("chatbot")
+        if role == "user":
+            context.write("User: ")
+        else:
+            # chatbot 'a' and 'b'
+            context.write(f"Chatbot {role.upper()}: ")
+        context.write(m.get("message", ""))
+        context.write("\n")
+
+    # Blank line between the history and the new message
+    context.write("\n")
+    context.write(initial_message)
+    return context.getvalue()
+
+
+def next_speaker(last_chatbot: str | None) -> str:
+    """The bot that answers after `last_chatbot`, chatbot A after the user"""
+    return "b" if last_chatbot == "a" else "a"
+
+
+def bot_history(rows, bot: str) -> list[BaseMessage]:
+    """
+    Rebuilds one bot's checkpoint messages from saved message rows: each of
+    its replies is preceded by the message it was answering.
+    """
+    messages = []
+    for previous, row in zip(rows, rows[1:]):
+        if row.chatbot == bot:
+            messages.append(HumanMessage(content=previous.message))
+            messages.append(AIMessage(content=row.message))
+    return messages
+
+
+async def resume_conversation(
+    conversation_id: int, user_id: str, db: AsyncSession
+) -> tuple[str, str]:
+    """
+    Makes the bots' checkpoints match a saved conversation.
+
+    The checkpoints are only rebuilt from the saved messages when their length
+    does not match, so resuming a conversation that was streamed on this
+    thread costs two small queries. Returns the thread id and the bot that
+    answers next.
+    """
+    async with db.begin():
+        conversation = (
+            await db.execute(
+                select(models.Conversation.thread_id).where(
+                    models.Conversation.id == conversation_id,
+                    models.Conversation.user == user_id,
+                )
+            )
+        ).first()
+        if conversation is None:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        thread_id = conversation.thread_id
+
+        last_order = func.max(models.Message.order)
+        counts = {
+            row.chatbot: (row.count, row.last_order)
+            for row in await db.execute(
+                select(
+                    models.Message.chatbot,
+                    func.count().label("count"),
+                    last_order.label("last_order"),
+                )
+                .where(models.Message.conversation_id == conversation_id)
+                .group_by(models.Message.chatbot)
+            )
+        }
+
+        stale = [
+            (bot, service)
+            for bot, service in (("a", chatbot_a), ("b", chatbot_b))
+            if await service.message_count(thread_id) != 2 * counts.get(bot, (0, 0))[0]
+        ]
+        if stale:
+            rows = (
+                await db.execute(
+                    select(models.Message.chatbot, models.Message.message)
+                    .where(models.Message.conversation_id == conversation_id)
+                    .order_by(models.Message.order)
+                )
+            ).all()
+            for bot, service in stale:
+                await service.seed(thread_id, bot_history(rows, bot))
+
+    last_chatbot = max(counts, key=lambda bot: counts[bot][1], default=None)
+    return thread_id, next_speaker(last_chatbot)
+
+
+async def conversation_events(
+    conv: ConversationStart,
+    request: Request | None = None,
+    conversation_id: int | None = None,
+    next_order: int = 0,
+    session_factory=None,
+    first_bot: str | None = None,
+    user_id: str = "anonymous",
+):
+    """
+    Yields the conversation's start/token/end events as dicts.
+
+    With `conversation_id` every completed turn is inserted into that
+    conversation before its end event, and end and error events carry the
+    conversation id. `first_bot` is set when resuming a saved conversation
+    whose history is already in the checkpoints; only the new message is sent.
+    With a `request` the conversation stops when its client disconnects; runs
+    started through the run registry are stopped by the registry instead.
+
+    Every turn is admitted by the admission controller. When it has to wait a
+    `queued` event is sent first, and if it is rejected the stream ends with an
+    `overloaded` error event. A model call that fails after its retries ends
+    the stream with an error event carrying the error `code`, `retryable` and
+    `retry_after`, so the failure is never passed to the other bot as a message.
+    """
+    # Runs in its own task (the run's or the batch run's), so the thread id
+    # only tags the logs of this conversation
+    thread_id.set(conv.thread_id)
+    logger.info("Conversation started", extra={"turns": conv.turns})
     # Build starting context from history if provided so model "remembers" past conversation
     current_message = conv.initial_message
     current_bot = "a"
-    if conv.history and isinstance(conv.history, list) and len(conv.history) > 0:
-        # Build a readable context string for the model from past messages
-        parts = []
-        for m in conv.history:
-            role = m.get("chatbot")
-            text = m.get("message", "")
-            if role == "user":
-                parts.append(f"User: {text}")
-            else:
-                # chatbot 'a' and 'b'
-                parts.append(f"Chatbot {role.upper()}: {text}")
-
-        context_str = "\n".join(parts)
+    if first_bot is not None:
+        current_bot = first_bot
+    elif conv.history and isinstance(conv.history, list) and len(conv.history) > 0:
         # Prepend history to the initial message so the model sees previous turns
-        current_message = context_str + "\n\n" + conv.initial_message
+        current_message = history_context(conv.history, conv.initial_message)
 
         # Choose next bot to speak based on last message
-        last = conv.history[-1].get("chatbot")
-        if last == "a":
-            current_bot = "b"
-        elif last == "b":
-            current_bot = "a"
-        else:
-            # If last was user, start with chatbot A
-            current_bot = "a"
+        current_bot = next_speaker(conv.history[-1].get("chatbot"))
 
-    # Reset to default if empty, otherwise set custom prompt
-    if conv.system_prompt_a:
-        chatbot_a.set_system_prompt(conv.system_prompt_a)
-    else:
-        chatbot_a.set_system_prompt(chatbot_a.default_system_prompt)
+    # Conversation-scoped agent pair: the services are shared, the prompts are
+    # passed per call so concurrent streams never touch each other's settings
+    agents = {
+        "a": (chatbot_a, conv.system_prompt_a),
+        "b": (chatbot_b, conv.system_prompt_b),
+    }
 
-    if conv.system_prompt_b:
-        chatbot_b.set_system_prompt(conv.system_prompt_b)
-    else:
-        chatbot_b.set_system_prompt(chatbot_b.default_system_prompt)
+    def start_turn(bot: str, message: str) -> TokenStream:
+        chatbot_instance, system_prompt = agents[bot]
+        return TokenStream(
+            chatbot_instance.stream_chat(
+                message,
+                conv.thread_id,
+                system_prompt=system_prompt,
+                model=conv.model,
+                user_id=user_id,
+            )
+        )
 
+    # Stream of the turn being sent; the next turn's request is started as
+    # soon as the current one ends, before the turn is saved and reported.
+    # The ticket is the admission of the model call behind the stream.
+    stream = None
+    ticket = None
     try:
         for i in range(conv.turns):
-            if await request.is_disconnected():
-                print("--- 🛑 Client disconnected, stopping stream. ---")
+            if request is not None and await request.is_disconnected():
+                logger.info("Client disconnected, stopping conversation")
                 break
 
-            print(f"--- Stream Turn {i+1} ---")
+            logger.debug("Turn started", extra={"turn": i + 1, "chatbot": current_bot})
+
+            if stream is None:
+                if ticket is None:
+                    ticket = admission.try_acquire(
+                        user_id, estimate_tokens(current_message)
+                    )
+                if ticket is None:
+                    yield {"type": "queued", "chatbot": current_bot}
+                    ticket = await admission.acquire(
+                        user_id, estimate_tokens(current_message)
+                    )
+                stream = start_turn(current_bot, current_message)
+
+            next_bot = "b" if current_bot == "a" else "a"
+            is_last_turn = i + 1 == conv.turns
+            if not is_last_turn:
+                # Get the next bot ready while this turn is streaming
+                next_chatbot, next_prompt = agents[next_bot]
+                next_chatbot.warm_up(conv.thread_id, next_prompt, conv.model)
+
+            yield {"type": "start", "chatbot": current_bot}
+
+            # Tokens are collected and joined once the turn is complete
+            response_parts = []
+
+            async for chunk in coalesce_tokens(
+                stream, conv.flush_tokens, conv.flush_ms / 1000
+            ):
+                yield {"type": "token", "content": chunk}
+                response_parts.append(chunk)
+
+            full_response_for_next_turn = "".join(response_parts)
+            ttft, duration = stream.ttft, stream.loop.time() - stream.started_at
+            queue_time = ticket.wait
+            record_turn(
+                agents[current_bot][0].resolve_model(conv.model),
+                queue_time,
+                duration,
+                ttft,
+                stream.tokens,
+            )
+            admission.release(ticket)
+            stream, ticket = None, None
+            if not is_last_turn:
+                # Without a free slot the next turn queues at the top of the loop
+                ticket = admission.try_acquire(
+                    user_id, estimate_tokens(full_response_for_next_turn)
+                )
+                if ticket is not None:
+                    stream = start_turn(next_bot, full_response_for_next_turn)
+
+            logger.debug(
+                "Turn done",
+                extra={
+                    "turn": i + 1,
+                    "chatbot": current_bot,
+                    "duration_s": round(duration, 3),
+                    "ttft_s": None if ttft is None else round(ttft, 3),
+                    "queue_s": round(queue_time, 3),
+                },
+            )
+            end_data = {
+                "type": "end",
+                "ttft_ms": None if ttft is None else round(ttft * 1000),
+                "duration_ms": round(duration * 1000),
+                "queue_ms": round(queue_time * 1000),
+            }
+            if conversation_id is not None:
+                async with session_factory() as db, db.begin():
+                    await insert_messages(
+                        db,
+                        message_rows(
+                            conversation_id,
+                            [
+                                {
+                                    "chatbot": current_bot,
+                                    "message": full_response_for_next_turn,
+                                }
+                            ],
+                            start=next_order,
+                        ),
+                    )
+                next_order += 1
+                end_data["conversation_id"] = conversation_id
+            yield end_data
 
-            chatbot_instance = chatbot_a if current_bot == "a" else chatbot_b
+            current_message = full_response_for_next_turn
+            current_bot = next_bot
+
+    except AdmissionRejected as e:
+        logger.warning("Turn rejected, server busy: %s", e)
+        error_data = {
+            "type": "error",
+            "code": "overloaded",
+            "content": str(e),
+            "retry_after": math.ceil(e.retry_after),
+        }
+        if conversation_id is not None:
+            error_data["conversation_id"] = conversation_id
+        yield error_data
+    except ModelError as e:
+        logger.error("Model call failed: %s", e, extra={"code": e.code})
+        error_data = {
+            "type": "error",
+            "code": e.code,
+            "content": str(e),
+            "retryable": e.retryable or e.code == "circuit_open",
+            "retry_after": None if e.retry_after is None else math.ceil(e.retry_after),
+        }
+        if conversation_id is not None:
+            error_data["conversation_id"] = conversation_id
+        yield error_data
+    except Exception as e:
+        logger.exception("Error in conversation stream: %s", e)
+        error_data = {"type": "error", "content": str(e)}
+        if conversation_id is not None:
+            error_data["conversation_id"] = conversation_id
+        yield error_data
+    finally:
+        if stream is not None:
+            # The client left while a request was already in flight
+            stream.cancel()
+        if ticket is not None:
+            admission.release(ticket)
+        logger.info("Conversation finished")
 
-            start_data = {"type": "start", "chatbot": current_bot}
-            yield f"data: {json.dumps(start_data)}\n\n"
 
-            full_response_for_next_turn = ""
+async def start_persisted_conversation(
+    conv: ConversationStart, user_id: str, db: AsyncSession
+) -> tuple[int, int]:
+    """
+    Creates the conversation (or checks the one to continue) and saves the
+    user's message. Returns the conversation id and the order of the next message.
+    """
+    async with db.begin():
+        if conv.conversation_id is None:
+            conversation_id = (
+                await db.scalars(
+                    insert(models.Conversation)
+                    .values(
+                        user=user_id,
+                        conversation_starter=conv.initial_message[:15000],
+                        thread_id=conv.thread_id,
+                        model=conv.model,
+                        system_prompt_a=conv.system_prompt_a,
+                        system_prompt_b=conv.system_prompt_b,
+                        turns=conv.turns,
+                    )
+                    .returning(models.Conversation.id)
+                )
+            ).one()
+            next_order = 0
+        else:
+            conversation_id = (
+                await db.scalars(
+                    select(models.Conversation.id).where(
+                        models.Conversation.id == conv.conversation_id,
+                        models.Conversation.user == user_id,
+                    )
+                )
+            ).first()
+            if conversation_id is None:
+                raise HTTPException(status_code=404, detail="Conversation not found")
+            last_order = await db.scalar(
+                select(func.max(models.Message.order)).where(
+                    models.Message.conversation_id == conversation_id
+                )
+            )
+            next_order = 0 if last_order is None else last_order + 1
+
+        await insert_messages(
+            db,
+            message_rows(
+                conversation_id,
+                [{"chatbot": "user", "message": conv.initial_message}],
+                start=next_order,
+            ),
+        )
 
-            async for token in chatbot_instance.stream_chat(
-                current_message,
-                conv.thread_id,
-                model=conv.model,
-            ):
-                token_data = {"type": "token", "content": token}
-                yield f"data: {json.dumps(token_data)}\n\n"
+    return conversation_id, next_order + 1
 
-                full_response_for_next_turn += token
 
-            end_data = {"type": "end"}
-            yield f"data: {json.dumps(end_data)}\n\n"
+def check_turns(conv: ConversationStart) -> None:
+    if conv.turns < 1 or conv.turns > 20:
+        raise HTTPException(status_code=400, detail="Turns must be between 1 and 20")
 
-            current_message = full_response_for_next_turn
-            current_bot = "b" if current_bot == "a" else "a"
 
-            await asyncio.sleep(0.01)
+async def prepare_conversation(
+    conv: ConversationStart, user_id: str, db: AsyncSession, session_factory
+) -> tuple[ConversationStart, dict]:
+    """
+    Validates a conversation request, resolves resume mode and saves the
+    user's message when persisting. Returns the request to run and the
+    keyword arguments for conversation_events.
+    """
+    check_turns(conv)
 
-    except Exception as e:
-        print(f"--- ❌ ERROR IN STREAM ---: {e}")
-        yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n"
-    finally:
-        print("--- 🏁 TOKEN STREAM FINISHED ---")
+    options = {"user_id": user_id}
+    if conv.conversation_id is not None:
+        # Resume mode: the saved messages replace the replayed history
+        thread_id, options["first_bot"] = await resume_conversation(
+            conv.conversation_id, user_id, db
+        )
+        conv = conv.model_copy(update={"thread_id": thread_id, "history": None})
+
+    if conv.persist:
+        conversation_id, next_order = await start_persisted_conversation(
+            conv, user_id, db
+        )
+        options.update(
+            conversation_id=conversation_id,
+            next_order=next_order,
+            session_factory=session_factory,
+        )
+    return conv, options
 
 
 @app.post("/conversation")
 async def start_conversation(
     conv: ConversationStart,
     request: Request,
-    current_user: dict = Depends(get_current_user),
+    user_id: str = Depends(get_user_id),
+    db: AsyncSession = Depends(get_db),
+    session_factory=Depends(get_session_factory),
 ):
-    if conv.turns < 1 or conv.turns > 20:
-        raise HTTPException(status_code=400, detail="Turns must be between 1 and 20")
+    conv, options = await prepare_conversation(conv, user_id, db, session_factory)
+    run = run_registry.start(user_id, conversation_events(conv, **options))
+    return StreamingResponse(
+        run_registry.stream(run),
+        media_type="text/event-stream",
+        headers={RUN_ID_HEADER: run.id},
+    )
+
+
+# Most conversations one batch stream may run side by side
+MAX_BATCH_RUNS = 8
+
+
+class ConversationBatch(BaseModel):
+    runs: list[ConversationStart] = Field(min_length=1, max_length=MAX_BATCH_RUNS)
+
+
+async def batch_events(runs: list[tuple[ConversationStart, dict]]):
+    """
+    Runs the conversations concurrently in one TaskGroup and yields their
+    events as they come, each tagged with the `run` index. A `done` event is
+    sent for each run when it has finished.
+    """
+    events: asyncio.Queue = asyncio.Queue()
+    finished = object()
+
+    async def run(run_id: int, conv: ConversationStart, options: dict):
+        try:
+            async with aclosing(conversation_events(conv, **options)) as it:
+                async for event in it:
+                    events.put_nowait({"run": run_id, **event})
+        finally:
+            events.put_nowait({"run": run_id, "type": "done"})
+
+    async def run_all():
+        try:
+            async with asyncio.TaskGroup() as group:
+                for run_id, (conv, options) in enumerate(runs):
+                    group.create_task(run(run_id, conv, options))
+        finally:
+            events.put_nowait(finished)
+
+    runner = asyncio.create_task(run_all())
+    try:
+        while (event := await events.get()) is not finished:
+            yield event
+        await runner
+    finally:
+        # The batch was cancelled: cancelling the group stops every run
+        runner.cancel()
+
+
+@app.post("/conversation/batch")
+async def start_conversation_batch(
+    batch: ConversationBatch,
+    request: Request,
+    user_id: str = Depends(get_user_id),
+    db: AsyncSession = Depends(get_db),
+    session_factory=Depends(get_session_factory),
+):
+    """Runs several conversations at once over a single SSE stream"""
+    # Every run is checked before any of them saves or seeds anything
+    for conv in batch.runs:
+        check_turns(conv)
+
+    resumed = {c.conversation_id for c in batch.runs if c.conversation_id is not None}
+    saved_threads = {}
+    if resumed:
+        async with db.begin():
+            saved_threads = dict(
+                (
+                    await db.execute(
+                        select(
+                            models.Conversation.id, models.Conversation.thread_id
+                        ).where(
+                            models.Conversation.id.in_(resumed),
+                            models.Conversation.user == user_id,
+                        )
+                    )
+                ).all()
+            )
+        if len(saved_threads) != len(resumed):
+            raise HTTPException(status_code=404, detail="Conversation not found")
+
+    # Runs sharing a thread would mix up their checkpoints
+    threads = [
+        (
+            conv.thread_id
+            if conv.conversation_id is None
+            else saved_threads[conv.conversation_id]
+        )
+        for conv in batch.runs
+    ]
+    if len(set(threads)) != len(threads):
+        raise HTTPException(
+            status_code=400, detail="Every run in a batch needs its own thread_id"
+        )
+
+    runs = [
+        await prepare_conversation(conv, user_id, db, session_factory)
+        for conv in batch.runs
+    ]
+    run = run_registry.start(user_id, batch_events(runs))
+    return StreamingResponse(
+        run_registry.stream(run),
+        media_type="text/event-stream",
+        headers={RUN_ID_HEADER: run.id},
+    )
+
+
+@app.get("/conversation/{run_id}/events")
+async def resume_conversation_stream(
+    run_id: str,
+    last_event_id: int = Query(0, ge=0),
+    last_event_id_header: int | None = Header(None, alias="Last-Event-ID"),
+    user_id: str = Depends(get_user_id),
+):
+    """
+    Reconnects to a running (or just finished) conversation, batch or job stream.
+    Events after `Last-Event-ID` are replayed from the buffer, then the live
+    stream continues.
+    """
+    run = run_registry.get(run_id, user_id)
+    if run is None:
+        job = await job_manager.get(run_id, user_id)
+        if job is not None and job.status not in FINISHED:
+            # Jobs only stream from the worker running them; poll them instead
+            raise HTTPException(
+                status_code=409, detail="Job is not running on this worker"
+            )
+        raise HTTPException(status_code=404, detail="Run not found")
+    if last_event_id_header is not None:
+        last_event_id = last_event_id_header
     return StreamingResponse(
-        conversation_generator(conv, request), media_type="text/event-stream"
+        run_registry.stream(run, last_event_id),
+        media_type="text/event-stream",
+        headers={RUN_ID_HEADER: run.id},
     )
 
 
+async def job_events(job: Job):
+    """
+    Event stream of a background job, see POST /jobs. The conversation is
+    prepared when the job runs, so its checkpoints are seeded on the worker
+    running it and its messages follow any saved since it was submitted.
+    """
+    conv = ConversationStart.model_validate(job.spec["conversation"])
+    session_factory = get_session_factory()
+    async with session_factory() as db:
+        conv, options = await prepare_conversation(
+            conv, job.user_id, db, session_factory
+        )
+    async with aclosing(conversation_events(conv, **options)) as events:
+        async for event in events:
+            yield event
+
+
+job_manager = JobManager.from_env(run_registry, job_events)
+
+
+@app.post("/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def submit_job(
+    conv: ConversationStart,
+    user_id: str = Depends(get_user_id),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Queues a conversation to run in the background and returns its id at once.
+    The job is polled with GET /jobs/{id}, streamed with
+    GET /conversation/{id}/events and cancelled with DELETE /jobs/{id}.
+    """
+    check_turns(conv)
+    if conv.conversation_id is not None:
+        owned = await db.scalar(
+            select(models.Conversation.id).where(
+                models.Conversation.id == conv.conversation_id,
+                models.Conversation.user == user_id,
+            )
+        )
+        if owned is None:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+    job = await job_manager.submit(user_id, {"conversation": conv.model_dump()})
+    return {"id": job.id, "status": job.status}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, user_id: str = Depends(get_user_id)):
+    """Status and completed turns of a job"""
+    job = await job_manager.get(job_id, user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str, user_id: str = Depends(get_user_id)):
+    """Cancels a queued job or stops a running one after its current event"""
+    job = await job_manager.cancel(job_id, user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"id": job.id, "status": job.status}
+
+
 @app.get("/messages")
 def get_messages(current_user: dict = Depends(get_current_user)):
     return {"messages": messages}
@@ -256,37 +891,73 @@ def read_root():
     return {"message": "Chatbot API is running"}
 
 
-def get_db():
-    db = DBSession()
-    try:
-        yield db
-    finally:
-        db.close()
+@app.get("/usage")
+async def get_usage(user_id: str = Depends(get_user_id)):
+    """Tokens the current user has spent in the current quota window"""
+    return await usage_tracker.user_stats(user_id)
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Stage timings of this worker in the Prometheus text format"""
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/health")
+def health():
+    """Liveness check with model pool, circuit breaker and admission queue stats"""
+    return {
+        "status": "ok",
+        "model_pool": model_pool.stats(),
+        "circuit_breakers": retry_policy.stats(),
+        "response_cache": response_cache and response_cache.stats(),
+        "admission": admission.stats(),
+        "runs": run_registry.stats(),
+        "jobs": job_manager.stats(),
+        "usage": usage_tracker.stats(),
+    }
+
+
+# Length of the conversation starter returned by listings
+STARTER_SNIPPET_LENGTH = 200
 
 
 @app.get("/get_prompts", response_model=list[schemas.Prompt])
 async def get_prompts(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
     user: str = Depends(get_user_id),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    prompts = db.scalars(
-        select(models.Prompt)
-        .where(models.Prompt.user == user)
-        .order_by(models.Prompt.created_at.desc())
-    ).all()
+    """
+    Get the prompts of the current user, newest first, one page of `limit`
+    prompts at a time; if there are more, the cursor for the next page is in
+    the X-Next-Cursor header.
+    """
+    query = keyset_page(
+        select(models.Prompt).where(models.Prompt.user == user),
+        models.Prompt,
+        user,
+        cursor,
+        limit,
+    )
+    prompts = (await db.scalars(query)).all()
 
-    return prompts
+    return split_page(prompts, limit, response)
 
 
 @app.post("/save_prompt", response_model=schemas.Prompt)
 async def save_prompt(
     data: schemas.SavePrompt,
     user: str = Depends(get_user_id),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    agent_name_exists = db.scalars(
-        select(models.Prompt).where(
-            models.Prompt.user == user, models.Prompt.agent_name == data.agent_name
+    agent_name_exists = (
+        await db.scalars(
+            select(models.Prompt).where(
+                models.Prompt.user == user, models.Prompt.agent_name == data.agent_name
+            )
         )
     ).first()
 
@@ -298,8 +969,8 @@ async def save_prompt(
 
     prompt = models.Prompt(**data.model_dump(), user=user)
     db.add(prompt)
-    db.commit()
-    db.refresh(prompt)
+    await db.commit()
+    await db.refresh(prompt)
 
     return prompt
 
@@ -309,13 +980,15 @@ async def update_prompt(
     prompt_id: int,
     data: schemas.SavePrompt,
     user: str = Depends(get_user_id),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    agent_name_exists = db.scalars(
-        select(models.Prompt).where(
-            models.Prompt.user == user,
-            models.Prompt.agent_name == data.agent_name,
-            models.Prompt.id != prompt_id,
+    agent_name_exists = (
+        await db.scalars(
+            select(models.Prompt).where(
+                models.Prompt.user == user,
+                models.Prompt.agent_name == data.agent_name,
+                models.Prompt.id != prompt_id,
+            )
         )
     ).first()
 
@@ -325,18 +998,20 @@ async def update_prompt(
             detail=f"Another agent already saved as '{data.agent_name}'",
         )
 
-    updated_prompt = db.scalars(
-        update(models.Prompt)
-        .where(models.Prompt.user == user, models.Prompt.id == prompt_id)
-        .values(**data.model_dump())
-        .returning(models.Prompt)
+    updated_prompt = (
+        await db.scalars(
+            update(models.Prompt)
+            .where(models.Prompt.user == user, models.Prompt.id == prompt_id)
+            .values(**data.model_dump())
+            .returning(models.Prompt)
+        )
     ).first()
 
     if not updated_prompt:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Prompt not found"
         )
-    db.commit()
+    await db.commit()
 
     return updated_prompt
 
@@ -345,11 +1020,13 @@ async def update_prompt(
 async def delete_prompt(
     prompt_id: int,
     user: str = Depends(get_user_id),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    prompt = db.scalars(
-        select(models.Prompt).where(
-            models.Prompt.user == user, models.Prompt.id == prompt_id
+    prompt = (
+        await db.scalars(
+            select(models.Prompt).where(
+                models.Prompt.user == user, models.Prompt.id == prompt_id
+            )
         )
     ).first()
 
@@ -358,8 +1035,8 @@ async def delete_prompt(
             status_code=status.HTTP_404_NOT_FOUND, detail="Prompt not found"
         )
 
-    db.delete(prompt)
-    db.commit()
+    await db.delete(prompt)
+    await db.commit()
 
     return {"message": "Prompt deleted successfully"}
 
@@ -370,80 +1047,140 @@ def download_chat(thread_id: str, current_user: dict = Depends(get_current_user)
     Download bots conversation in .txt file format
     """
 
-    history_text_A = chatbot_a.get_conversation_history(thread_id)
-    print(history_text_A)
-
     headers = {
         "Content-Disposition": f"attachment; filename=conversation_{thread_id}.txt"
     }
 
-    return Response(content=history_text_A, media_type="text/plain", headers=headers)
+    # Streamed message by message instead of building the whole file in memory
+    return StreamingResponse(
+        chatbot_a.iter_conversation_history(thread_id),
+        media_type="text/plain",
+        headers=headers,
+    )
+
+
+def user_conversation_query(conversation_id: int, user_id: str):
+    """Select one of the user's conversations with its messages eagerly loaded"""
+    return (
+        select(models.Conversation)
+        .options(selectinload(models.Conversation.messages))
+        .where(
+            models.Conversation.id == conversation_id,
+            models.Conversation.user == user_id,
+        )
+    )
+
+
+def message_rows(
+    conversation_id: int, messages: list[dict], start: int = 0
+) -> list[dict]:
+    """Column values for the messages of a conversation, ordered from `start`"""
+    return [
+        {
+            "conversation_id": conversation_id,
+            "chatbot": msg.get("chatbot", "unknown"),
+            "message": msg.get("message", ""),
+            "order": idx,
+        }
+        for idx, msg in enumerate(messages, start=start)
+    ]
+
+
+async def insert_messages(db: AsyncSession, rows: list[dict]) -> list[models.Message]:
+    """Insert messages with one multi-row INSERT ... RETURNING"""
+    if not rows:
+        return []
+    # RETURNING rows are not guaranteed to come back in parameter order, and
+    # asking SQLAlchemy to keep the order falls back to one INSERT per row
+    inserted = await db.scalars(insert(models.Message).returning(models.Message), rows)
+    return sorted(inserted, key=lambda message: message.order)
+
+
+def conversation_fields(data: schemas.SaveConversation) -> dict:
+    return {
+        "conversation_starter": data.conversation_starter,
+        "thread_id": data.thread_id,
+        "model": data.model,
+        "system_prompt_a": data.system_prompt_a,
+        "system_prompt_b": data.system_prompt_b,
+        "turns": data.turns,
+    }
 
 
 @app.post("/conversations", response_model=schemas.ConversationSchema)
 async def save_conversation(
     data: schemas.SaveConversation,
     user_id: str = Depends(get_user_id),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    """Save a conversation with all its messages"""
-    conversation = models.Conversation(
-        user=user_id,
-        conversation_starter=data.conversation_starter,
-        thread_id=data.thread_id,
-        model=data.model,
-        system_prompt_a=data.system_prompt_a,
-        system_prompt_b=data.system_prompt_b,
-        turns=data.turns,
-    )
-    db.add(conversation)
-    db.flush()
-
-    # Add messages
-    for idx, msg in enumerate(data.messages):
-        message = models.Message(
-            conversation_id=conversation.id,
-            chatbot=msg.get("chatbot", "unknown"),
-            message=msg.get("message", ""),
-            order=idx,
+    """Save a conversation with all its messages (two INSERTs)"""
+    async with db.begin():
+        conversation = (
+            await db.scalars(
+                insert(models.Conversation)
+                .values(user=user_id, **conversation_fields(data))
+                .returning(models.Conversation)
+            )
+        ).one()
+        messages = await insert_messages(
+            db, message_rows(conversation.id, data.messages)
         )
-        db.add(message)
-
-    db.commit()
-    db.refresh(conversation)
+        # Attach the inserted rows without loading them again
+        set_committed_value(conversation, "messages", messages)
 
     return conversation
 
 
-@app.get("/conversations", response_model=list[schemas.ConversationSchema])
+@app.get("/conversations", response_model=list[schemas.ConversationSummary])
 async def get_conversations(
-    user_id: str = Depends(get_user_id), db: Session = Depends(get_db)
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    user_id: str = Depends(get_user_id),
+    db: AsyncSession = Depends(get_db),
 ):
-    """Get all conversations for the current user"""
-    conversations = (
-        db.query(models.Conversation)
-        .filter(models.Conversation.user == user_id)
-        .order_by(models.Conversation.created_at.desc())
-        .all()
+    """
+    Get the conversations of the current user, newest first, in one query.
+
+    Only a summary is returned: a snippet of the starter and the message count
+    instead of the prompts and messages. Paginated like /get_prompts.
+    """
+    message_count = (
+        select(func.count(models.Message.id))
+        .where(models.Message.conversation_id == models.Conversation.id)
+        .scalar_subquery()
+    )
+    query = keyset_page(
+        select(
+            models.Conversation.id,
+            func.substr(
+                models.Conversation.conversation_starter, 1, STARTER_SNIPPET_LENGTH
+            ).label("conversation_starter"),
+            models.Conversation.model,
+            models.Conversation.turns,
+            message_count.label("message_count"),
+            models.Conversation.created_at,
+        ).where(models.Conversation.user == user_id),
+        models.Conversation,
+        user_id,
+        cursor,
+        limit,
     )
-    return conversations
+    conversations = (await db.execute(query)).all()
+
+    return split_page(conversations, limit, response)
 
 
 @app.get("/conversations/{conversation_id}", response_model=schemas.ConversationSchema)
 async def get_conversation(
     conversation_id: int,
     user_id: str = Depends(get_user_id),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """Get a specific conversation with all messages"""
     conversation = (
-        db.query(models.Conversation)
-        .filter(
-            models.Conversation.id == conversation_id,
-            models.Conversation.user == user_id,
-        )
-        .first()
-    )
+        await db.scalars(user_conversation_query(conversation_id, user_id))
+    ).first()
 
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
@@ -455,75 +1192,88 @@ async def get_conversation(
 async def delete_conversation(
     conversation_id: int,
     user_id: str = Depends(get_user_id),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    """Delete a conversation"""
-    conversation = (
-        db.query(models.Conversation)
-        .filter(
-            models.Conversation.id == conversation_id,
-            models.Conversation.user == user_id,
-        )
-        .first()
+    """Delete a conversation and its messages without loading them"""
+    owned = select(models.Conversation.id).where(
+        models.Conversation.id == conversation_id,
+        models.Conversation.user == user_id,
     )
-
-    if not conversation:
-        raise HTTPException(status_code=404, detail="Conversation not found")
-
-    db.delete(conversation)
-    db.commit()
+    async with db.begin():
+        await db.execute(
+            delete(models.Message).where(models.Message.conversation_id.in_(owned))
+        )
+        deleted = await db.execute(
+            delete(models.Conversation).where(
+                models.Conversation.id == conversation_id,
+                models.Conversation.user == user_id,
+            )
+        )
+        if deleted.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Conversation not found")
 
     return {"message": "Conversation deleted successfully"}
 
 
 @app.put("/conversations/{conversation_id}", response_model=schemas.ConversationSchema)
-def update_conversation(
+async def update_conversation(
     conversation_id: int,
     data: schemas.SaveConversation,
     user_id: str = Depends(get_user_id),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    """Update an existing conversation and replace its messages.
+    """Update an existing conversation and its messages.
 
-    Use a transaction context so any error during the update or message
-    replacement will roll back automatically.
+    Messages are matched by `order`: changed ones are updated, new ones are
+    inserted in one statement and ones past the new end are deleted, so
+    appending turns to a saved conversation does not rewrite it. Everything
+    runs in one transaction and is rolled back on error.
     """
-    with db.begin():
+    async with db.begin():
         conversation = (
-            db.query(models.Conversation)
-            .filter(
-                models.Conversation.id == conversation_id,
-                models.Conversation.user == user_id,
+            await db.scalars(
+                update(models.Conversation)
+                .where(
+                    models.Conversation.id == conversation_id,
+                    models.Conversation.user == user_id,
+                )
+                .values(**conversation_fields(data))
+                .returning(models.Conversation)
             )
-            .first()
-        )
+        ).first()
 
         if not conversation:
             raise HTTPException(status_code=404, detail="Conversation not found")
 
-        # Update fields
-        conversation.conversation_starter = data.conversation_starter
-        conversation.thread_id = data.thread_id
-        conversation.model = data.model
-        conversation.system_prompt_a = data.system_prompt_a
-        conversation.system_prompt_b = data.system_prompt_b
-        conversation.turns = data.turns
-
-        # Remove existing messages and add new ones within the transaction
-        db.query(models.Message).filter(
-            models.Message.conversation_id == conversation.id
-        ).delete(synchronize_session=False)
-
-        for idx, msg in enumerate(data.messages):
-            message = models.Message(
-                conversation_id=conversation.id,
-                chatbot=msg.get("chatbot", "unknown"),
-                message=msg.get("message", ""),
-                order=idx,
+        existing = {
+            message.order: message
+            for message in await db.scalars(
+                select(models.Message).where(
+                    models.Message.conversation_id == conversation_id
+                )
+            )
+        }
+        rows = message_rows(conversation_id, data.messages)
+
+        kept, new_rows = [], []
+        for row in rows:
+            message = existing.pop(row["order"], None)
+            if message is None:
+                new_rows.append(row)
+                continue
+            # Only rows that actually differ are written when the session flushes
+            message.chatbot = row["chatbot"]
+            message.message = row["message"]
+            kept.append(message)
+
+        if existing:
+            await db.execute(
+                delete(models.Message).where(
+                    models.Message.id.in_([m.id for m in existing.values()])
+                )
             )
-            db.add(message)
 
-    # Transaction is committed (or rolled back) by the context manager
-    db.refresh(conversation)
+        added = await insert_messages(db, new_rows)
+        set_committed_value(conversation, "messages", kept + added)
 
     return conversation
@@ -0,0 +1,177 @@
+import bisect
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.routing import Match
+
+# Route template of the request being served ("/conversations/{conversation_id}"),
+# inherited by the tasks it starts. Set by EndpointMiddleware.
+current_endpoint: ContextVar[str] = ContextVar("current_endpoint", default="other")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    """
+    Histogram in the Prometheus text format. The `endpoint` label, when the
+    histogram has one, defaults to the current endpoint.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = ("model", "endpoint"),
+        buckets: tuple[float, ...] = SECONDS_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [count per bucket (the last one is +Inf), sum]
+        self._series: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        if "endpoint" in self.labelnames and "endpoint" not in labels:
+            labels["endpoint"] = current_endpoint.get()
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for key, (counts, total) in self._series.items():
+            labels = ",".join(
+                f'{name}="{_escape(value)}"'
+                for name, value in zip(self.labelnames, key)
+            )
+            sep = "," if labels else ""
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}'
+                )
+            labels = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Metrics of this process, rendered for GET /metrics"""
+
+    def __init__(self):
+        self._metrics: list[Histogram] = []
+
+    def histogram(self, name: str, documentation: str, **kwargs) -> Histogram:
+        metric = Histogram(name, documentation, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for m in self._metrics for line in m.render()) + "\n"
+
+
+metrics = MetricsRegistry()
+
+queue_wait = metrics.histogram(
+    "da_queue_wait_seconds", "Time model calls waited for admission"
+)
+prompt_build = metrics.histogram(
+    "da_prompt_build_seconds",
+    "Time to trim the thread and build the prompt of a model call",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+time_to_first_token = metrics.histogram(
+    "da_time_to_first_token_seconds", "Time from a model request to its first token"
+)
+token_rate = metrics.histogram(
+    "da_tokens_per_second",
+    "Tokens per second streamed after the first token",
+    buckets=(1, 5, 10, 20, 40, 60, 80, 100, 150, 200, 400),
+)
+turn_duration = metrics.histogram(
+    "da_turn_duration_seconds", "Duration of a model turn, queue wait excluded"
+)
+db_query_time = metrics.histogram(
+    "da_db_query_seconds", "Duration of database queries", labelnames=("endpoint",)
+)
+sse_bytes = metrics.histogram(
+    "da_sse_bytes",
+    "Bytes written to one server-sent event stream",
+    labelnames=("endpoint",),
+    buckets=(1e3, 4e3, 16e3, 64e3, 256e3, 1e6, 4e6, 16e6),
+)
+
+
+def record_turn(
+    model: str,
+    queue_time: float,
+    duration: float,
+    ttft: float | None = None,
+    tokens: int = 0,
+) -> None:
+    """Records the timings of one model turn, `tokens` counting non-empty chunks"""
+    queue_wait.observe(queue_time, model=model)
+    turn_duration.observe(duration, model=model)
+    if ttft is None:
+        return
+    time_to_first_token.observe(ttft, model=model)
+    if tokens > 1 and duration > ttft:
+        token_rate.observe((tokens - 1) / (duration - ttft), model=model)
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started_at"].pop()
+    db_query_time.observe(time.perf_counter() - started)
+
+
+def _on_error(context):
+    # Failed queries never reach after_cursor_execute
+    if context.connection is not None:
+        started = context.connection.info.get("query_started_at")
+        if started:
+            started.pop()
+
+
+def track_db_queries() -> None:
+    """Times the queries of every SQLAlchemy engine, async ones included"""
+    if not event.contains(Engine, "before_cursor_execute", _before_execute):
+        event.listen(Engine, "before_cursor_execute", _before_execute)
+        event.listen(Engine, "after_cursor_execute", _after_execute)
+        event.listen(Engine, "handle_error", _on_error)
+
+
+class EndpointMiddleware:
+    """Sets current_endpoint to the route template the request matches"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            for route in scope["app"].router.routes:
+                match, _ = route.matches(scope)
+                if match == Match.FULL:
+                    current_endpoint.set(route.path)
+                    break
+        await self.app(scope, receive, send)
@@ -0,0 +1,66 @@
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException, Response
+from sqlalchemy import Select, func, select, tuple_
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# Page size of the listings when no `limit` is given, and the largest allowed
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    payload = json.dumps({"created_at": created_at.isoformat(), "id": row_id})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(payload["created_at"]), int(payload["id"])
+    except (ValueError, KeyError, TypeError) as exc:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from exc
+
+
+def keyset_page(query: Select, model, user: str, cursor: str | None, limit: int | None):
+    """
+    Applies newest-first keyset pagination on (created_at, id) to `query`,
+    which lists the rows of `user`.
+
+    The position is looked up from the cursor row itself so the comparison
+    uses the exact stored timestamp; the timestamp in the cursor is only used
+    if that row has been deleted in the meantime or is not the user's, so
+    other users' rows never position a page. One extra row is fetched to know
+    whether there is a next page.
+    """
+
+    query = query.order_by(model.created_at.desc(), model.id.desc())
+
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        anchor = (
+            select(model.created_at)
+            .where(model.id == row_id, model.user == user)
+            .scalar_subquery()
+        )
+        query = query.where(
+            tuple_(model.created_at, model.id)
+            < tuple_(func.coalesce(anchor, created_at), row_id)
+        )
+
+    if limit is not None:
+        query = query.limit(limit + 1)
+
+    return query
+
+
+def split_page(rows: list, limit: int | None, response: Response) -> list:
+    """Drops the look-ahead row and sets the next cursor header if needed"""
+    if limit is None or len(rows) <= limit:
+        return rows
+
+    rows = rows[:limit]
+    last = rows[-1]
+    response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last.created_at, last.id)
+    return rows
@@ -0,0 +1,280 @@
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+import httpx
+import openai
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Error codes that are worth another attempt
+RETRYABLE = {"rate_limited", "timeout", "unavailable", "server_error"}
+
+# Codes of requests the endpoint answered and refused; the model itself is up
+REFUSED = {"bad_request", "context_length", "content_filter"}
+
+# Status returned by /chat for each error code
+HTTP_STATUS = {
+    "rate_limited": 429,
+    "circuit_open": 503,
+    "unavailable": 503,
+    "timeout": 504,
+    "bad_request": 400,
+    "context_length": 400,
+    "content_filter": 400,
+    "quota_exceeded": 429,
+}
+
+
+class ModelError(Exception):
+    """A classified failure of a model call"""
+
+    def __init__(self, code: str, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.code = code
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.code in RETRYABLE
+
+    @property
+    def http_status(self) -> int:
+        return HTTP_STATUS.get(self.code, 502)
+
+
+def _retry_after(headers: httpx.Headers | None) -> float | None:
+    """Seconds from the Retry-After (or Azure's retry-after-ms) header"""
+    if not headers:
+        return None
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify(exc: BaseException) -> ModelError:
+    """Maps an exception from the OpenAI client (or httpx) to a ModelError"""
+    if isinstance(exc, ModelError):
+        return exc
+
+    message = str(exc)
+    if isinstance(exc, (openai.APITimeoutError, httpx.TimeoutException)):
+        return ModelError("timeout", message)
+    if isinstance(exc, (openai.APIConnectionError, httpx.TransportError)):
+        return ModelError("unavailable", message)
+    if isinstance(exc, openai.APIStatusError):
+        status = exc.status_code
+        retry_after = _retry_after(exc.response.headers)
+        error_code = getattr(exc, "code", None)
+        if status == 429:
+            return ModelError("rate_limited", message, retry_after)
+        if status in (408, 409) or status >= 500:
+            return ModelError("server_error", message, retry_after)
+        if error_code == "context_length_exceeded":
+            return ModelError("context_length", message)
+        if error_code == "content_filter":
+            return ModelError("content_filter", message)
+        if status in (401, 403):
+            return ModelError("auth", message)
+        return ModelError("bad_request", message)
+    return ModelError("unknown", message)
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a model after `failure_threshold` failures in a row.
+
+    After `reset_timeout` seconds one probe call is let through; its success
+    closes the circuit and its failure opens it again. A probe that has not
+    reported back after `probe_timeout` seconds is given up and another one is
+    let through.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        probe_timeout: float = 120.0,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = probe_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        # When the current probe call was let through
+        self._probe_started: float | None = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    @property
+    def _probing(self) -> bool:
+        return (
+            self._probe_started is not None
+            and time.monotonic() - self._probe_started < self.probe_timeout
+        )
+
+    def check(self, model_name: str) -> bool:
+        """
+        Raises ModelError("circuit_open") when the call may not be made.
+        Returns True when the call is the probe of a half-open circuit.
+        """
+
+        state = self.state
+        if state == "closed":
+            return False
+        if state == "half_open" and not self._probing:
+            self._probe_started = time.monotonic()
+            return True
+
+        remaining = (
+            self.opened_at + self.reset_timeout - time.monotonic()
+            if state == "open"
+            else 1.0
+        )
+        raise ModelError(
+            "circuit_open",
+            f"{model_name} is failing, calls are paused",
+            retry_after=max(remaining, 1.0),
+        )
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probe_started = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._probe_started = None
+
+    def record_other(self) -> None:
+        """A failure that says nothing about the model's health"""
+        self._probe_started = None
+
+
+class RetryPolicy:
+    """
+    Retries transient model failures with jittered exponential backoff and
+    keeps a circuit breaker per model.
+
+    A delay from the Retry-After header is honored; when the server asks for a
+    longer wait than `max_delay` the call fails right away with that
+    `retry_after` instead of holding the request open.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        probe_timeout: float = 120.0,
+    ):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = probe_timeout
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        """
+        Reads DA_LLM_MAX_ATTEMPTS, DA_LLM_BACKOFF_BASE_SECONDS,
+        DA_LLM_BACKOFF_MAX_SECONDS, DA_LLM_BREAKER_FAILURES,
+        DA_LLM_BREAKER_RESET_SECONDS and DA_LLM_BREAKER_PROBE_SECONDS.
+        """
+
+        return cls(
+            max_attempts=int(os.getenv("DA_LLM_MAX_ATTEMPTS", "3")),
+            base_delay=float(os.getenv("DA_LLM_BACKOFF_BASE_SECONDS", "0.5")),
+            max_delay=float(os.getenv("DA_LLM_BACKOFF_MAX_SECONDS", "8")),
+            failure_threshold=int(os.getenv("DA_LLM_BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.getenv("DA_LLM_BREAKER_RESET_SECONDS", "30")),
+            probe_timeout=float(os.getenv("DA_LLM_BREAKER_PROBE_SECONDS", "120")),
+        )
+
+    def breaker(self, model_name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(model_name)
+        if breaker is None:
+            breaker = self._breakers.setdefault(
+                model_name,
+                CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout, self.probe_timeout
+                ),
+            )
+        return breaker
+
+    def check(self, model_name: str) -> bool:
+        return self.breaker(model_name).check(model_name)
+
+    def succeeded(self, model_name: str) -> None:
+        self.breaker(model_name).record_success()
+
+    def abandoned(self, model_name: str, probe: bool) -> None:
+        """An attempt was cancelled; frees the circuit's probe if it was one"""
+        if probe:
+            self.breaker(model_name).record_other()
+
+    def failed(
+        self, model_name: str, exc: BaseException, attempt: int
+    ) -> tuple[ModelError, float | None]:
+        """
+        Classifies a failed attempt (numbered from 0) and records it. Returns
+        the error and the delay before the next attempt, None to give up.
+        """
+
+        error = classify(exc)
+        breaker = self.breaker(model_name)
+        if error.code in REFUSED:
+            breaker.record_success()
+            return error, None
+        if error.code == "auth":
+            # A bad key fails every call, not worth retrying but worth pausing
+            breaker.record_failure()
+            return error, None
+        if not error.retryable:
+            breaker.record_other()
+            return error, None
+
+        breaker.record_failure()
+        if attempt + 1 >= self.max_attempts:
+            return error, None
+        if error.retry_after is not None:
+            if error.retry_after > self.max_delay:
+                return error, None
+            return error, error.retry_after
+        # Full jitter keeps retrying clients from hitting the endpoint together
+        return error, random.uniform(
+            0, min(self.max_delay, self.base_delay * 2**attempt)
+        )
+
+    def stats(self) -> dict[str, dict]:
+        return {
+            model_name: {"state": breaker.state, "failures": breaker.failures}
+            for model_name, breaker in self._breakers.items()
+        }
+
+
+retry_policy = RetryPolicy.from_env()
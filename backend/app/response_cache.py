@@ -0,0 +1,195 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from collections.abc import Sequence
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from langchain_core.messages import BaseMessage
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.db import models
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(
+    messages: Sequence[BaseMessage], model_name: str, temperature: float
+) -> str:
+    """Hash of the prepared prompt, the model and the temperature"""
+    payload = json.dumps(
+        [model_name, temperature, [(m.type, m.content) for m in messages]],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Cache of model replies keyed by `cache_key`.
+
+    Replies are kept in a per-process LRU of `max_entries` for `ttl` seconds.
+    With a `session_factory` they are also stored in the response_cache table,
+    shared by all workers; expired rows and rows beyond `max_rows` are pruned
+    every `prune_every` writes. Failures of the shared tier are only reported,
+    the call then goes to the model as usual.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl: float = 3600.0,
+        session_factory=None,
+        max_rows: int = 100_000,
+        prune_every: int = 100,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.session_factory = session_factory
+        self.max_rows = max_rows
+        self.prune_every = prune_every
+        # key -> (expiry as unix time, reply)
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._writes = 0
+        self.counters = {"hits": 0, "misses": 0, "shared_hits": 0}
+
+    async def get(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, content = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return content
+            del self._entries[key]
+
+        content = await self._get_shared(key)
+        if content is None:
+            self.counters["misses"] += 1
+            return None
+        self.counters["hits"] += 1
+        self.counters["shared_hits"] += 1
+        self._remember(key, content, time.time() + self.ttl)
+        return content
+
+    async def set(self, key: str, content: str, model_name: str) -> None:
+        expires_at = time.time() + self.ttl
+        self._remember(key, content, expires_at)
+        await self._set_shared(key, content, model_name, expires_at)
+
+    def _remember(self, key: str, content: str, expires_at: float) -> None:
+        self._entries[key] = (expires_at, content)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    # -- shared tier -----------------------------------------------------------
+
+    def _insert(self, dialect: str):
+        if dialect == "postgresql":
+            return postgresql.insert(models.ResponseCacheEntry)
+        if dialect == "sqlite":
+            return sqlite.insert(models.ResponseCacheEntry)
+        raise NotImplementedError(f"Unsupported database dialect: {dialect}")
+
+    async def _get_shared(self, key: str) -> str | None:
+        if self.session_factory is None:
+            return None
+        try:
+            async with self.session_factory() as db:
+                return await db.scalar(
+                    select(models.ResponseCacheEntry.content).where(
+                        models.ResponseCacheEntry.key == key,
+                        models.ResponseCacheEntry.expires_at
+                        > datetime.now(timezone.utc),
+                    )
+                )
+        except Exception as e:
+            logger.warning("Shared cache read failed: %s", e)
+            return None
+
+    async def _set_shared(
+        self, key: str, content: str, model_name: str, expires_at: float
+    ) -> None:
+        if self.session_factory is None:
+            return
+        now = datetime.now(timezone.utc)
+        values = {
+            "key": key,
+            "model": model_name,
+            "content": content,
+            "created_at": now,
+            "expires_at": now + timedelta(seconds=expires_at - time.time()),
+        }
+        try:
+            async with self.session_factory() as db, db.begin():
+                stmt = self._insert(db.bind.dialect.name).values(**values)
+                await db.execute(
+                    stmt.on_conflict_do_update(
+                        index_elements=["key"],
+                        set_={
+                            "content": stmt.excluded.content,
+                            "created_at": stmt.excluded.created_at,
+                            "expires_at": stmt.excluded.expires_at,
+                        },
+                    )
+                )
+                self._writes += 1
+                if self._writes % self.prune_every == 0:
+                    await self._prune(db, now)
+        except Exception as e:
+            logger.warning("Shared cache write failed: %s", e)
+
+    async def _prune(self, db, now: datetime) -> None:
+        entry = models.ResponseCacheEntry
+        await db.execute(delete(entry).where(entry.expires_at <= now))
+        excess = await db.scalar(select(func.count()).select_from(entry))
+        excess -= self.max_rows
+        if excess > 0:
+            oldest = select(entry.key).order_by(entry.expires_at).limit(excess)
+            await db.execute(delete(entry).where(entry.key.in_(oldest)))
+
+    def stats(self) -> dict[str, int]:
+        return {"entries": len(self._entries), **self.counters}
+
+
+def create_response_cache() -> ResponseCache | None:
+    """
+    Builds the /chat response cache selected by DA_RESPONSE_CACHE.
+
+    - "off" (default): no cache.
+    - "memory": per-process LRU of DA_RESPONSE_CACHE_SIZE replies (default 1000).
+    - "database": the LRU backed by the response_cache table, shared by all
+      workers and capped at DA_RESPONSE_CACHE_MAX_ROWS rows (default 100000).
+
+    Replies expire after DA_RESPONSE_CACHE_TTL_SECONDS (default 3600).
+    """
+
+    backend = os.getenv("DA_RESPONSE_CACHE", "off").lower()
+    if backend == "off":
+        return None
+
+    settings = {
+        "max_entries": int(os.getenv("DA_RESPONSE_CACHE_SIZE", "1000")),
+        "ttl": float(os.getenv("DA_RESPONSE_CACHE_TTL_SECONDS", "3600")),
+    }
+    if backend == "memory":
+        return ResponseCache(**settings)
+
+    if backend == "database":
+        # Imported lazily so the other backends work without DA_DB_URL
+        from app.db.database import AsyncDBSession
+
+        return ResponseCache(
+            session_factory=AsyncDBSession,
+            max_rows=int(os.getenv("DA_RESPONSE_CACHE_MAX_ROWS", "100000")),
+            **settings,
+        )
+
+    raise ValueError(f"Unknown DA_RESPONSE_CACHE backend: {backend}")
@@ -1,8 +1,11 @@
+import logging
 from fastapi import APIRouter, Request
 from authlib.integrations.starlette_client import OAuth
 from fastapi.responses import RedirectResponse
 import os
 
+logger = logging.getLogger(__name__)
+
 oidc_router = APIRouter()
 
 DA_OIDC_BASE_URL = os.getenv("DA_OIDC_BASE_URL")
@@ -46,5 +49,5 @@ async def auth_callback(request: Request):
 
     except Exception as e:
         # Catch the login errors.
-        print(f"OIDC callback error: {e}")
+        logger.exception("OIDC callback error: %s", e)
         return RedirectResponse(url=frontend_url)
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import os
+import uuid
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import aclosing
+from dotenv import load_dotenv
+
+from app.metrics import sse_bytes
+from app.sse import sse_event
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RUN_ID_HEADER = "X-Run-Id"
+
+
+class Run:
+    """
+    Events of one conversation run, numbered from 1.
+
+    The latest `max_events` events are kept in a ring buffer so a client that
+    reconnects can be sent the events it missed.
+    """
+
+    def __init__(
+        self,
+        run_id: str,
+        user_id: str,
+        max_events: int = 2000,
+        background: bool = False,
+    ):
+        self.id = run_id
+        self.user_id = user_id
+        # Background runs (jobs) go on without listeners
+        self.background = background
+        self.events: deque[tuple[int, dict]] = deque(maxlen=max_events)
+        self.last_id = 0
+        self.done = False
+        self.subscribers = 0
+        # Bumped whenever the last subscriber leaves or a new one arrives
+        self.detachments = 0
+        self.task: asyncio.Task | None = None
+        self._waiters: list[asyncio.Future] = []
+
+    def publish(self, event: dict) -> None:
+        self.last_id += 1
+        self.events.append((self.last_id, event))
+        self._wake()
+
+    def finish(self) -> None:
+        self.done = True
+        self._wake()
+
+    def _wake(self) -> None:
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+    async def subscribe(
+        self, last_event_id: int = 0
+    ) -> AsyncIterator[tuple[int | None, dict]]:
+        """
+        Yields (id, event) for the events after `last_event_id`, first from the
+        buffer and then live until the run is done. When some of them have
+        already been dropped from the buffer a `gap` event (without an id)
+        tells how many.
+        """
+
+        position = last_event_id
+        while True:
+            if self.events and self.events[0][0] > position + 1:
+                first = self.events[0][0]
+                yield None, {"type": "gap", "missed": first - position - 1}
+                position = first - 1
+            # Snapshot, the buffer may change while the caller sends an event
+            for event_id, event in list(self.events):
+                if event_id > position:
+                    position = event_id
+                    yield event_id, event
+            if self.done and position >= self.last_id:
+                return
+            if position < self.last_id:
+                continue
+
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+
+
+class RunRegistry:
+    """
+    Conversation runs of this process, detached from the requests watching them.
+
+    A run is produced by a background task and streamed to any number of
+    subscribers. When the last subscriber leaves, the run keeps generating for
+    `grace_period` seconds so a reconnecting client can resume it; after that
+    it is cancelled. Finished runs stay available for the same period.
+    Background runs are never cancelled for lack of listeners and stay
+    available for `retention` seconds.
+    """
+
+    def __init__(
+        self,
+        grace_period: float = 30.0,
+        max_events: int = 2000,
+        retention: float = 3600.0,
+    ):
+        self.grace_period = grace_period
+        self.max_events = max_events
+        self.retention = retention
+        self._runs: dict[str, Run] = {}
+
+    @classmethod
+    def from_env(cls) -> "RunRegistry":
+        """Reads DA_RUN_GRACE_SECONDS, DA_RUN_MAX_EVENTS and DA_JOB_RETENTION_SECONDS"""
+        return cls(
+            grace_period=float(os.getenv("DA_RUN_GRACE_SECONDS", "30")),
+            max_events=int(os.getenv("DA_RUN_MAX_EVENTS", "2000")),
+            retention=float(os.getenv("DA_JOB_RETENTION_SECONDS", "3600")),
+        )
+
+    def start(
+        self,
+        user_id: str,
+        events: AsyncIterator[dict],
+        run_id: str | None = None,
+        background: bool = False,
+    ) -> Run:
+        run = Run(run_id or uuid.uuid4().hex, user_id, self.max_events, background)
+        self._runs[run.id] = run
+        run.task = asyncio.create_task(self._produce(run, events))
+        if not background:
+            # Cancelled unless someone subscribes within the grace period
+            self._detach(run)
+        return run
+
+    def cancel(self, run_id: str) -> bool:
+        """Cancels a run of this process, False if it is not running here"""
+        run = self._runs.get(run_id)
+        if run is None or run.done:
+            return False
+        run.task.cancel()
+        return True
+
+    def get(self, run_id: str, user_id: str) -> Run | None:
+        """The run, if it exists and belongs to `user_id`"""
+        run = self._runs.get(run_id)
+        if run is None or run.user_id != user_id:
+            return None
+        return run
+
+    async def _produce(self, run: Run, events: AsyncIterator[dict]) -> None:
+        try:
+            async with aclosing(events) as it:
+                async for event in it:
+                    run.publish(event)
+        except asyncio.CancelledError:
+            run.publish({"type": "cancelled"})
+        finally:
+            run.finish()
+            asyncio.get_running_loop().call_later(
+                self.retention if run.background else self.grace_period,
+                self._runs.pop,
+                run.id,
+                None,
+            )
+
+    def _detach(self, run: Run) -> None:
+        run.detachments += 1
+        asyncio.get_running_loop().call_later(
+            self.grace_period, self._expire, run, run.detachments
+        )
+
+    def _expire(self, run: Run, detachment: int) -> None:
+        # Someone subscribed (and maybe left again) since this timer was set
+        if run.detachments != detachment or run.subscribers or run.done:
+            return
+        logger.info("Run has no listeners, cancelling it", extra={"run_id": run.id})
+        run.task.cancel()
+
+    async def stream(self, run: Run, last_event_id: int = 0) -> AsyncIterator[str]:
+        """Server-sent events of the run, with ids for Last-Event-ID"""
+        run.subscribers += 1
+        run.detachments += 1
+        sent = 0
+        try:
+            async with aclosing(run.subscribe(last_event_id)) as events:
+                async for event_id, event in events:
+                    frame = sse_event(event, event_id)
+                    sent += len(frame.encode())
+                    yield frame
+        finally:
+            sse_bytes.observe(sent)
+            run.subscribers -= 1
+            if run.subscribers == 0 and not run.done and not run.background:
+                self._detach(run)
+
+    def stats(self) -> dict[str, int]:
+        runs = list(self._runs.values())
+        return {
+            "runs": len(runs),
+            "active": sum(1 for run in runs if not run.done),
+            "detached": sum(1 for run in runs if not run.done and not run.subscribers),
+        }
+
+
+run_registry = RunRegistry.from_env()
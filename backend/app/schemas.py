@@ -42,6 +42,20 @@ class MessageSchema(BaseModel):
         from_attributes = True
 
 
+class ConversationSummary(BaseModel):
+    """Conversation listing entry, conversation_starter is only a snippet"""
+
+    id: int
+    conversation_starter: str
+    model: str | None
+    turns: int
+    message_count: int
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
 class ConversationSchema(BaseModel):
     id: int
     user: str
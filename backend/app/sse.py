@@ -0,0 +1,120 @@
+import asyncio
+import json
+from collections.abc import AsyncIterator
+
+# Built once instead of per event, compact separators keep the frames small
+_encode = json.JSONEncoder(
+    ensure_ascii=False, check_circular=False, separators=(",", ":")
+).encode
+
+_DONE = object()
+
+
+def sse_event(data: dict, event_id: int | None = None) -> str:
+    """Formats one server-sent event, with an id for Last-Event-ID if given"""
+    if event_id is None:
+        return f"data: {_encode(data)}\n\n"
+    return f"id: {event_id}\ndata: {_encode(data)}\n\n"
+
+
+class TokenStream:
+    """
+    Reads a token iterator in a background task that starts immediately.
+
+    Creating the stream sends the model request right away, before anyone
+    consumes it. Records when the stream started, when the first token
+    arrived and how many tokens came for time-to-first-token and token rate
+    reporting. Empty chunks, like the role chunk models send first and the
+    finish and usage chunks they send last, carry no text and are dropped.
+    """
+
+    def __init__(self, tokens: AsyncIterator[str]):
+        self.loop = asyncio.get_running_loop()
+        self.started_at = self.loop.time()
+        self.first_token_at: float | None = None
+        self.tokens = 0
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._pump(tokens))
+
+    async def _pump(self, tokens: AsyncIterator[str]) -> None:
+        try:
+            async for token in tokens:
+                if not token:
+                    continue
+                if self.first_token_at is None:
+                    self.first_token_at = self.loop.time()
+                self.tokens += 1
+                self.queue.put_nowait(token)
+        finally:
+            self.queue.put_nowait(_DONE)
+
+    @property
+    def ttft(self) -> float | None:
+        """Seconds from the start of the stream to its first token"""
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+    def cancel(self) -> None:
+        self.task.cancel()
+
+
+async def coalesce_tokens(
+    tokens: AsyncIterator[str] | TokenStream, max_tokens: int, max_delay: float
+) -> AsyncIterator[str]:
+    """
+    Joins streamed tokens into chunks so that each chunk needs only one event.
+
+    A chunk is emitted when it holds `max_tokens` tokens or when its first
+    token has waited `max_delay` seconds, whichever comes first. With
+    `max_tokens` 1 or `max_delay` 0 tokens are passed through unchanged.
+
+    The source is read by a TokenStream task so a slow model never delays an
+    overdue chunk. Errors from the source are raised after the tokens received
+    before them have been emitted.
+    """
+
+    stream = tokens if isinstance(tokens, TokenStream) else TokenStream(tokens)
+    loop, queue = stream.loop, stream.queue
+    batching = max_tokens > 1 and max_delay > 0
+    buffer: list[str] = []
+    deadline = 0.0
+    try:
+        while True:
+            if buffer and loop.time() >= deadline:
+                yield "".join(buffer)
+                buffer.clear()
+
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                if not buffer:
+                    item = await queue.get()
+                else:
+                    try:
+                        item = await asyncio.wait_for(
+                            queue.get(), deadline - loop.time()
+                        )
+                    except asyncio.TimeoutError:
+                        continue
+
+            if item is _DONE:
+                break
+            if not batching:
+                yield item
+                continue
+
+            if not buffer:
+                deadline = loop.time() + max_delay
+            buffer.append(item)
+
+            if len(buffer) >= max_tokens:
+                yield "".join(buffer)
+                buffer.clear()
+
+        if buffer:
+            yield "".join(buffer)
+        # Re-raises an error from the source, if there was one
+        await stream.task
+    finally:
+        stream.cancel()
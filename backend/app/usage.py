@@ -0,0 +1,288 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import DataError, IntegrityError
+
+from app.db import models
+from app.resilience import ModelError
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class UsageTracker:
+    """
+    Token usage of model calls per user, thread and model.
+
+    Calls are aggregated in memory per model and per user. With a
+    `session_factory` the totals per user, thread and model are also written
+    to the usage table in one batch every `flush_interval` seconds.
+
+    With `quota_tokens` a user may spend that many tokens (prompt and
+    completion) per `quota_window` seconds, counted from the start of the
+    window; further calls fail with the quota_exceeded ModelError until the
+    next window. With the table, the user's spending through other workers is
+    included, read at most once per `flush_interval`.
+
+    `prices` maps a model to its USD price per million prompt and completion
+    tokens; the cost of other models is left empty.
+    """
+
+    def __init__(
+        self,
+        session_factory=None,
+        flush_interval: float = 10.0,
+        quota_tokens: int | None = None,
+        quota_window: float = 86400.0,
+        prices: dict[str, tuple[float, float]] | None = None,
+    ):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.quota_tokens = quota_tokens
+        self.quota_window = quota_window
+        self.prices = prices or {}
+        # model -> [calls, prompt tokens, completion tokens] since startup
+        self.totals: dict[str, list[int]] = defaultdict(lambda: [0, 0, 0])
+        # Not yet flushed, by (user, thread, model)
+        self._pending: dict[tuple[str, str, str], list[int]] = defaultdict(
+            lambda: [0, 0, 0]
+        )
+        self._pending_since = time.time()
+        # Tokens of each user in the current quota window
+        self._window = self._window_start()
+        self._used: dict[str, int] = defaultdict(int)
+        # user -> when the other workers' spending was last read
+        self._synced_at: dict[str, float] = {}
+        self._flusher: asyncio.Task | None = None
+        self.counters = {"calls": 0, "flushes": 0, "rejected": 0, "dropped": 0}
+
+    @classmethod
+    def from_env(cls) -> "UsageTracker":
+        """
+        Reads DA_USAGE_STORE ("memory" or "database"), DA_USAGE_FLUSH_SECONDS,
+        DA_USAGE_QUOTA_TOKENS, DA_USAGE_QUOTA_WINDOW_SECONDS and DA_LLM_PRICES
+        (JSON, e.g. {"gpt-4o": [2.5, 10]}).
+        """
+
+        session_factory = None
+        store = os.getenv("DA_USAGE_STORE", "memory").lower()
+        if store == "database":
+            # Imported lazily so the memory store works without DA_DB_URL
+            from app.db.database import AsyncDBSession
+
+            session_factory = AsyncDBSession
+        elif store != "memory":
+            raise ValueError(f"Unknown DA_USAGE_STORE: {store}")
+
+        quota = os.getenv("DA_USAGE_QUOTA_TOKENS")
+        return cls(
+            session_factory=session_factory,
+            flush_interval=float(os.getenv("DA_USAGE_FLUSH_SECONDS", "10")),
+            quota_tokens=int(quota) if quota else None,
+            quota_window=float(os.getenv("DA_USAGE_QUOTA_WINDOW_SECONDS", "86400")),
+            prices={
+                model: tuple(price)
+                for model, price in json.loads(os.getenv("DA_LLM_PRICES", "{}")).items()
+            },
+        )
+
+    def _window_start(self) -> float:
+        now = time.time()
+        return now - now % self.quota_window
+
+    def _roll_window(self) -> None:
+        window = self._window_start()
+        if window != self._window:
+            self._window = window
+            self._used.clear()
+            self._synced_at.clear()
+
+    def record(
+        self,
+        user_id: str,
+        thread_id: str,
+        model_name: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+    ) -> None:
+        aggregates = [self.totals[model_name]]
+        if self.session_factory is not None:
+            aggregates.append(self._pending[(user_id, thread_id, model_name)])
+        for totals in aggregates:
+            totals[0] += 1
+            totals[1] += prompt_tokens
+            totals[2] += completion_tokens
+        self._roll_window()
+        self._used[user_id] += prompt_tokens + completion_tokens
+        self.counters["calls"] += 1
+
+    async def check(self, user_id: str) -> None:
+        """Raises ModelError("quota_exceeded") when the user's quota is spent"""
+        if self.quota_tokens is None:
+            return
+        self._roll_window()
+        await self._sync(user_id)
+        if self._used[user_id] >= self.quota_tokens:
+            self.counters["rejected"] += 1
+            retry_after = self._window + self.quota_window - time.time()
+            raise ModelError(
+                "quota_exceeded",
+                f"Token quota of {self.quota_tokens} used up",
+                retry_after,
+            )
+
+    async def _sync(self, user_id: str) -> None:
+        """Reads the user's flushed spending in this window from the table"""
+        if self.session_factory is None:
+            return
+        synced_at = self._synced_at.get(user_id)
+        if synced_at is not None and time.time() - synced_at < self.flush_interval:
+            return
+        usage = models.Usage
+        try:
+            async with self.session_factory() as db:
+                flushed = await db.scalar(
+                    select(
+                        func.coalesce(
+                            func.sum(usage.prompt_tokens + usage.completion_tokens), 0
+                        )
+                    ).where(
+                        usage.user == user_id,
+                        usage.period_start
+                        >= datetime.fromtimestamp(self._window, timezone.utc),
+                    )
+                )
+        except Exception as e:
+            logger.warning("Reading usage failed: %s", e)
+            return
+        unflushed = sum(
+            prompt + completion
+            for (user, _, _), (_, prompt, completion) in self._pending.items()
+            if user == user_id
+        )
+        self._used[user_id] = flushed + unflushed
+        self._synced_at[user_id] = time.time()
+
+    def cost(self, model_name: str, prompt_tokens: int, completion_tokens: int):
+        price = self.prices.get(model_name)
+        if price is None:
+            return None
+        return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+
+    async def _insert(self, rows: list[dict]) -> None:
+        async with self.session_factory() as db, db.begin():
+            await db.execute(insert(models.Usage), rows)
+
+    async def flush(self) -> int:
+        """
+        Writes the pending totals in one batch, returns the number of rows.
+
+        When the database refuses the batch because of its data, the rows are
+        written one by one and the refused ones are dropped, so one bad row
+        cannot hold back everyone's usage. Rows that fail for other reasons,
+        such as the database being unreachable, are kept for the next flush.
+        """
+        if self.session_factory is None or not self._pending:
+            return 0
+        pending, self._pending = self._pending, defaultdict(lambda: [0, 0, 0])
+        period_start = datetime.fromtimestamp(self._pending_since, timezone.utc)
+        self._pending_since = time.time()
+        rows = {
+            (user, thread, model_name): {
+                "user": user,
+                "thread_id": thread,
+                "model": model_name,
+                "period_start": period_start,
+                "calls": calls,
+                "prompt_tokens": prompt,
+                "completion_tokens": completion,
+                "cost_usd": self.cost(model_name, prompt, completion),
+            }
+            for (user, thread, model_name), (
+                calls,
+                prompt,
+                completion,
+            ) in pending.items()
+        }
+        try:
+            await self._insert(list(rows.values()))
+        except (DataError, IntegrityError) as e:
+            logger.warning("Writing usage in one batch failed, writing each row: %s", e)
+            written = 0
+            for key, row in rows.items():
+                try:
+                    await self._insert([row])
+                    written += 1
+                except (DataError, IntegrityError) as e:
+                    self.counters["dropped"] += 1
+                    logger.error(
+                        "Dropping usage the database refuses: %s",
+                        e,
+                        extra={"user": key[0], "model": key[2]},
+                    )
+                except Exception as e:
+                    logger.warning("Writing usage failed, keeping it: %s", e)
+                    self._requeue(key, pending[key])
+            self.counters["flushes"] += 1
+            return written
+        except Exception as e:
+            logger.warning("Writing usage failed, keeping it for the next flush: %s", e)
+            for key, totals in pending.items():
+                self._requeue(key, totals)
+            return 0
+        self.counters["flushes"] += 1
+        return len(rows)
+
+    def _requeue(self, key: tuple[str, str, str], totals: list[int]) -> None:
+        kept = self._pending[key]
+        for i, value in enumerate(totals):
+            kept[i] += value
+
+    def start(self) -> None:
+        """Starts the periodic flush on the running loop"""
+        if self.session_factory is not None and self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def user_stats(self, user_id: str) -> dict:
+        """Spending of the user in the current quota window"""
+        self._roll_window()
+        await self._sync(user_id)
+        return {
+            "tokens": self._used.get(user_id, 0),
+            "quota": self.quota_tokens,
+            "window_started_at": self._window,
+            "window_seconds": self.quota_window,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            **self.counters,
+            "models": {
+                model_name: dict(
+                    zip(("calls", "prompt_tokens", "completion_tokens"), t)
+                )
+                for model_name, t in self.totals.items()
+            },
+        }
+
+
+usage_tracker = UsageTracker.from_env()
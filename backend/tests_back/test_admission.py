@@ -0,0 +1,142 @@
+import os
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+os.environ.setdefault("DA_DB_URL", "sqlite:///:memory:")
+os.environ.setdefault("DA_OPENAI_API_KEY", "test-key-123")
+
+from app import main
+from app.admission import AdmissionController, AdmissionRejected
+
+
+@pytest.mark.asyncio
+async def test_calls_over_the_limit_wait_for_a_release():
+    controller = AdmissionController(max_concurrency=1)
+    first = await controller.acquire("u1")
+
+    waiter = asyncio.create_task(controller.acquire("u2"))
+    await asyncio.sleep(0.01)
+    assert not waiter.done()
+    assert controller.stats()["waiting"] == 1
+
+    controller.release(first)
+    second = await waiter
+
+    assert second.wait > 0
+    assert controller.stats()["active"] == 1
+    assert controller.stats()["queued"] == 1
+
+
+@pytest.mark.asyncio
+async def test_waiting_users_are_served_round_robin():
+    """A user with many queued calls does not starve the others"""
+    controller = AdmissionController(max_concurrency=1, max_per_user=10)
+    holder = await controller.acquire("busy")
+    order = []
+
+    async def call(user):
+        async with controller.slot(user):
+            order.append(user)
+            await asyncio.sleep(0)
+
+    tasks = [asyncio.create_task(call("busy")) for _ in range(3)]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(call("other")))
+    await asyncio.sleep(0)
+
+    controller.release(holder)
+    await asyncio.gather(*tasks)
+
+    assert order == ["busy", "other", "busy", "busy"]
+
+
+@pytest.mark.asyncio
+async def test_per_user_limit_does_not_block_other_users():
+    controller = AdmissionController(max_concurrency=10, max_per_user=1)
+    await controller.acquire("u1")
+
+    assert controller.try_acquire("u1") is None
+    assert controller.try_acquire("u2") is not None
+
+
+@pytest.mark.asyncio
+async def test_token_budget_is_enforced_per_minute(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.admission.time.monotonic", lambda: now[0])
+    controller = AdmissionController(tokens_per_minute_per_user=1000)
+
+    controller.release(controller.try_acquire("u1", 800))
+    assert controller.try_acquire("u1", 300) is None
+    assert controller.try_acquire("u2", 300) is not None
+
+    now[0] += 61
+    assert controller.try_acquire("u1", 300) is not None
+
+
+@pytest.mark.asyncio
+async def test_user_token_windows_are_kept_only_while_needed(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.admission.time.monotonic", lambda: now[0])
+    controller = AdmissionController(tokens_per_minute_per_user=1000)
+    unlimited = AdmissionController()
+
+    for user in ("u1", "u2"):
+        controller.release(controller.try_acquire(user, 100))
+        unlimited.release(unlimited.try_acquire(user, 100))
+    busy = controller.try_acquire("u3", 100)
+    assert unlimited._user_windows == {}
+    assert set(controller._user_windows) == {"u1", "u2", "u3"}
+
+    now[0] += 61
+    controller.release(controller.try_acquire("u1", 100))
+
+    # u2 is idle with an empty window; u1 just spent tokens and u3 is active
+    assert set(controller._user_windows) == {"u1", "u3"}
+    controller.release(busy)
+
+
+@pytest.mark.asyncio
+async def test_queue_timeout_is_rejected():
+    controller = AdmissionController(max_concurrency=1, max_queue_time=0.01)
+    await controller.acquire("u1")
+
+    with pytest.raises(AdmissionRejected) as e:
+        await controller.acquire("u2")
+
+    assert e.value.retry_after >= 1
+    assert controller.stats()["rejected"] == 1
+    assert controller.stats()["waiting"] == 0
+
+
+@pytest.mark.asyncio
+async def test_conversation_reports_queueing_and_overload(monkeypatch):
+    """Backpressure is sent as events, not as a failed turn"""
+
+    async def stream(message, thread_id, system_prompt=None, model=None, **options):
+        yield "hi"
+
+    monkeypatch.setattr(main.chatbot_a, "stream_chat", stream)
+    monkeypatch.setattr(main.chatbot_b, "stream_chat", stream)
+    controller = AdmissionController(max_concurrency=1, max_queue_time=0.05)
+    monkeypatch.setattr(main, "admission", controller)
+    request = MagicMock()
+    request.is_disconnected = AsyncMock(return_value=False)
+    conv = main.ConversationStart(initial_message="hi", turns=2)
+
+    # Freed while the first turn is queued
+    holder = await controller.acquire("someone else")
+    asyncio.get_running_loop().call_later(0.01, controller.release, holder)
+    events = [e async for e in main.conversation_events(conv, request, user_id="u1")]
+    assert [e["type"] for e in events][:2] == ["queued", "start"]
+    ends = [e for e in events if e["type"] == "end"]
+    assert len(ends) == 2
+    assert ends[0]["queue_ms"] >= 5
+
+    # Never freed
+    await controller.acquire("someone else")
+    events = [e async for e in main.conversation_events(conv, request, user_id="u1")]
+    assert [e["type"] for e in events] == ["queued", "error"]
+    assert events[-1]["code"] == "overloaded"
+    assert events[-1]["retry_after"] >= 1
+    assert controller.stats()["active"] == 1
@@ -1,12 +1,18 @@
+import asyncio
+import json
 import os
 import sys
 
-from app.chatbot import ChatbotService
+import httpx
+
+from app.chatbot import ChatbotService, ModelPool
+from app.resilience import ModelError, RetryPolicy
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
 from langchain_core.messages import AIMessage
 
 import pytest
 import pytest_asyncio
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 
 @pytest.fixture
@@ -37,6 +43,7 @@ def chatbot_service(mock_env, mock_chat_model):
     service = ChatbotService(system_prompt="Fake prompt.")
 
     service.app = MagicMock()
+    service.app.ainvoke = AsyncMock()
     return service
 
 
@@ -46,109 +53,170 @@ def chatbot_service(mock_env, mock_chat_model):
 def test_chatbot_initialization(chatbot_service):
     """Test service creating"""
     assert chatbot_service is not None
-    assert chatbot_service.current_system_prompt == "Fake prompt."
-    assert chatbot_service.model is not None
+    assert chatbot_service.default_system_prompt == "Fake prompt."
+    assert chatbot_service.default_model_name in chatbot_service.allowed_models
+
+
+def test_build_config_uses_per_call_prompt_and_model(chatbot_service):
+    """Test that prompt and model are carried in the invocation config"""
+    config = chatbot_service.build_config(
+        "thread-1", system_prompt="Custom prompt", model="gpt-4o-mini"
+    )
+
+    assert config["configurable"]["thread_id"] == "thread-1"
+    assert config["configurable"]["system_prompt"] == "Custom prompt"
+    assert config["configurable"]["model"] == "gpt-4o-mini"
+
+
+def test_build_config_rejects_unsupported_model(chatbot_service):
+    """Test model validation"""
+    with pytest.raises(ValueError):
+        chatbot_service.build_config("thread-1", model="not-a-model")
+
+
+@pytest.mark.asyncio
+async def test_call_model_reads_prompt_and_model_from_config(mock_env):
+    """Test that the graph node takes its settings from the invocation config"""
+    models = MagicMock()
+    models.get.return_value.ainvoke = AsyncMock(
+        return_value=AIMessage(content="Configured")
+    )
+    service = ChatbotService(system_prompt="Fake prompt.", models=models)
+
+    response = await service.chat("Hi", thread_id="node-1", system_prompt="Node prompt")
+
+    assert response == "Configured"
+    models.get.assert_called_with(service.default_model_name)
+    prompt = models.get.return_value.ainvoke.call_args[0][0]
+    assert prompt.messages[0].content == "Node prompt"
+
 
+@pytest.mark.asyncio
+async def test_system_message_is_rendered_once_per_prompt(mock_env):
+    """Saved prompts are reused as they are, even with braces in them"""
+    models = MagicMock()
+    models.get.return_value.ainvoke = AsyncMock(return_value=AIMessage(content="ok"))
+    service = ChatbotService(models=models)
+    saved_prompt = "Answer as {persona} would"
+
+    await service.chat("One", thread_id="p-1", system_prompt=saved_prompt)
+    await service.chat("Two", thread_id="p-2", system_prompt=saved_prompt)
 
-def test_set_system_prompt(chatbot_service):
-    """Test promp creating"""
-    chatbot_service.set_system_prompt("Fake prompt.")
-    assert chatbot_service.current_system_prompt == "Fake prompt."
+    first, second = [c[0][0] for c in models.get.return_value.ainvoke.call_args_list]
+    assert first.messages[0].content == saved_prompt
+    assert first.messages[0] is second.messages[0]
 
 
-def test_chat_method(chatbot_service, mock_chat_model):
+@pytest.mark.asyncio
+async def test_chat_method(chatbot_service, mock_chat_model):
     """Test chatting"""
     mock_ai_message = AIMessage(content="Fake response")
-    chatbot_service.app.invoke.return_value = {"messages": [mock_ai_message]}
+    chatbot_service.app.ainvoke.return_value = {"messages": [mock_ai_message]}
 
-    response = chatbot_service.chat("Hello, who you are?", thread_id="test-thread-1")
+    response = await chatbot_service.chat(
+        "Hello, who you are?", thread_id="test-thread-1"
+    )
 
     assert response == "Fake response"
 
-    chatbot_service.app.invoke.assert_called_once()
+    chatbot_service.app.ainvoke.assert_called_once()
 
 
-def test_chat_with_different_thread_ids(chatbot_service):
+@pytest.mark.asyncio
+async def test_chat_with_different_thread_ids(chatbot_service):
     """Test that different thread_ids work correctly"""
     mock_ai_message = AIMessage(content="Thread response")
-    chatbot_service.app.invoke.return_value = {"messages": [mock_ai_message]}
+    chatbot_service.app.ainvoke.return_value = {"messages": [mock_ai_message]}
 
-    response1 = chatbot_service.chat("Message 1", thread_id="thread-1")
-    response2 = chatbot_service.chat("Message 2", thread_id="thread-2")
+    response1 = await chatbot_service.chat("Message 1", thread_id="thread-1")
+    response2 = await chatbot_service.chat("Message 2", thread_id="thread-2")
 
     assert response1 == "Thread response"
     assert response2 == "Thread response"
-    assert chatbot_service.app.invoke.call_count == 2
+    assert chatbot_service.app.ainvoke.call_count == 2
 
 
-def test_chat_with_empty_message(chatbot_service):
+@pytest.mark.asyncio
+async def test_chat_with_empty_message(chatbot_service):
     """Test with empty message"""
     mock_ai_message = AIMessage(content="Response to empty")
-    chatbot_service.app.invoke.return_value = {"messages": [mock_ai_message]}
+    chatbot_service.app.ainvoke.return_value = {"messages": [mock_ai_message]}
 
-    response = chatbot_service.chat("", thread_id="test-thread")
+    response = await chatbot_service.chat("", thread_id="test-thread")
 
     assert response == "Response to empty"
 
 
-def test_chat_with_custom_system_prompt(chatbot_service):
+@pytest.mark.asyncio
+async def test_chat_with_custom_system_prompt(chatbot_service):
     """Test with custom system prompt"""
     mock_ai_message = AIMessage(content="Custom prompt response")
-    chatbot_service.app.invoke.return_value = {"messages": [mock_ai_message]}
+    chatbot_service.app.ainvoke.return_value = {"messages": [mock_ai_message]}
 
-    response = chatbot_service.chat(
+    response = await chatbot_service.chat(
         "Test message", thread_id="test-thread", system_prompt="New custom prompt"
     )
 
     assert response == "Custom prompt response"
-    assert chatbot_service.current_system_prompt == "New custom prompt"
+    config = chatbot_service.app.ainvoke.call_args[0][1]
+    assert config["configurable"]["system_prompt"] == "New custom prompt"
+    assert chatbot_service.default_system_prompt == "Fake prompt."
 
 
-def test_chat_error_handling(chatbot_service):
-    """Test error handling"""
-    chatbot_service.app.invoke.side_effect = Exception("API error")
+@pytest.mark.asyncio
+async def test_chat_error_handling(chatbot_service):
+    """Errors are raised as ModelError, never returned as the reply"""
+    chatbot_service.app.ainvoke.side_effect = Exception("API error")
 
-    response = chatbot_service.chat("Test message", thread_id="test-thread")
+    with pytest.raises(ModelError, match="API error") as e:
+        await chatbot_service.chat("Test message", thread_id="test-thread")
 
-    assert "Error:" in response
-    assert "API error" in response
+    assert e.value.code == "unknown"
+    chatbot_service.app.ainvoke.assert_called_once()
 
 
-def test_default_thread_id(chatbot_service):
+@pytest.mark.asyncio
+async def test_default_thread_id(chatbot_service):
     """Test default thread_id value"""
     mock_ai_message = AIMessage(content="Default thread")
-    chatbot_service.app.invoke.return_value = {"messages": [mock_ai_message]}
+    chatbot_service.app.ainvoke.return_value = {"messages": [mock_ai_message]}
 
-    response = chatbot_service.chat("Test without thread_id")
+    response = await chatbot_service.chat("Test without thread_id")
 
-    chatbot_service.app.invoke.assert_called_once()
-    call_args = chatbot_service.app.invoke.call_args
+    chatbot_service.app.ainvoke.assert_called_once()
+    call_args = chatbot_service.app.ainvoke.call_args
     assert call_args[0][1]["configurable"]["thread_id"] == "default"
 
 
-def test_system_prompt_updates(chatbot_service):
-    """Test that system prompt updates correctly"""
-    assert chatbot_service.current_system_prompt == "Fake prompt."
+@pytest.mark.asyncio
+async def test_concurrent_calls_keep_their_own_settings(chatbot_service):
+    """Test that calls with different prompts and models do not leak into each other"""
+    chatbot_service.app.ainvoke.return_value = {"messages": [AIMessage(content="ok")]}
 
-    chatbot_service.set_system_prompt("Updated prompt")
-    assert chatbot_service.current_system_prompt == "Updated prompt"
+    await chatbot_service.chat("One", system_prompt="Prompt one", model="gpt-4o")
+    await chatbot_service.chat("Two", system_prompt="Prompt two", model="gpt-5")
 
-    chatbot_service.set_system_prompt("Another prompt")
-    assert chatbot_service.current_system_prompt == "Another prompt"
+    first, second = [c[0][1] for c in chatbot_service.app.ainvoke.call_args_list]
+    assert first["configurable"]["system_prompt"] == "Prompt one"
+    assert first["configurable"]["model"] == "gpt-4o"
+    assert second["configurable"]["system_prompt"] == "Prompt two"
+    assert second["configurable"]["model"] == "gpt-5"
 
 
-def test_chat_ignores_empty_system_prompt(chatbot_service):
-    """Test that empty system prompt doesn't update"""
-    original_prompt = chatbot_service.current_system_prompt
+@pytest.mark.asyncio
+async def test_chat_ignores_empty_system_prompt(chatbot_service):
+    """Test that empty system prompt falls back to the default"""
     mock_ai_message = AIMessage(content="Response")
-    chatbot_service.app.invoke.return_value = {"messages": [mock_ai_message]}
+    chatbot_service.app.ainvoke.return_value = {"messages": [mock_ai_message]}
 
-    chatbot_service.chat("Test", system_prompt="   ")
+    await chatbot_service.chat("Test", system_prompt="   ")
 
-    assert chatbot_service.current_system_prompt == original_prompt
+    config = chatbot_service.app.ainvoke.call_args[0][1]
+    assert config["configurable"]["system_prompt"] == "Fake prompt."
 
 
-def test_multiple_messages_in_conversation(chatbot_service):
+@pytest.mark.asyncio
+async def test_multiple_messages_in_conversation(chatbot_service):
     """Test multiple messages in same thread"""
     mock_responses = [
         AIMessage(content="First response"),
@@ -156,20 +224,20 @@ def test_multiple_messages_in_conversation(chatbot_service):
         AIMessage(content="Third response"),
     ]
 
-    chatbot_service.app.invoke.side_effect = [
+    chatbot_service.app.ainvoke.side_effect = [
         {"messages": [mock_responses[0]]},
         {"messages": [mock_responses[1]]},
         {"messages": [mock_responses[2]]},
     ]
 
-    response1 = chatbot_service.chat("Message 1", thread_id="conversation-1")
-    response2 = chatbot_service.chat("Message 2", thread_id="conversation-1")
-    response3 = chatbot_service.chat("Message 3", thread_id="conversation-1")
+    response1 = await chatbot_service.chat("Message 1", thread_id="conversation-1")
+    response2 = await chatbot_service.chat("Message 2", thread_id="conversation-1")
+    response3 = await chatbot_service.chat("Message 3", thread_id="conversation-1")
 
     assert response1 == "First response"
     assert response2 == "Second response"
     assert response3 == "Third response"
-    assert chatbot_service.app.invoke.call_count == 3
+    assert chatbot_service.app.ainvoke.call_count == 3
 
 
 @pytest.mark.asyncio
@@ -206,9 +274,290 @@ async def test_stream_chat_error_handling(chatbot_service):
     chatbot_service.app.astream = mock_astream_error
 
     chunks = []
-    async for chunk in chatbot_service.stream_chat("Test"):
+    with pytest.raises(ModelError, match="Stream error"):
+        async for chunk in chatbot_service.stream_chat("Test"):
+            chunks.append(chunk)
+
+    assert chunks == []
+
+
+@pytest.mark.asyncio
+async def test_stream_chat_streams_tokens_from_async_model(mock_env):
+    """Test that the async model node streams tokens through the real graph"""
+    models = MagicMock()
+    models.get.return_value = GenericFakeChatModel(
+        messages=iter([AIMessage(content="Hello async world")])
+    )
+    service = ChatbotService(system_prompt="Fake prompt.", models=models)
+
+    chunks = []
+    async for chunk in service.stream_chat("Hi", thread_id="async-stream"):
         chunks.append(chunk)
 
-    assert len(chunks) == 1
-    assert "Error:" in chunks[0]
-    assert "Stream error" in chunks[0]
+    assert len(chunks) > 1
+    assert "".join(chunks) == "Hello async world"
+
+
+def test_model_pool_reuses_clients_and_one_connection_pool(mock_env):
+    """Clients are shared per model, all on one httpx client"""
+    pool = ModelPool()
+
+    gpt4o = pool.get("gpt-4o")
+    assert pool.get("gpt-4o") is gpt4o
+    assert pool.get("gpt-5").root_async_client._client is pool.http_client
+    assert gpt4o.root_async_client._client is pool.http_client
+    assert pool.stats()["clients"] == 2
+
+
+@pytest.mark.asyncio
+async def test_model_pool_warm_up_opens_a_connection(mock_env):
+    requests = []
+
+    def handler(request):
+        requests.append(request.url.path)
+        return httpx.Response(200, json={"object": "list", "data": []})
+
+    pool = ModelPool(
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    )
+
+    await pool.warm_up(["gpt-4o"])
+
+    assert requests == ["/openai/v1/models"]
+    assert pool.stats()["clients"] == 1
+    await pool.aclose()
+
+
+@pytest.mark.asyncio
+async def test_warm_up_opens_a_spare_connection(mock_env):
+    requests = []
+
+    def handler(request):
+        requests.append((request.method, request.url.path))
+        return httpx.Response(200)
+
+    pool = ModelPool(
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    )
+    service = ChatbotService(models=pool)
+
+    service.warm_up("thread")
+    # Already on its way, not opened twice
+    service.warm_up("thread")
+    await pool._preconnect
+
+    assert requests == [("HEAD", "/openai/v1")]
+    await pool.aclose()
+
+    # Disabled, nothing is sent
+    pool = ModelPool(
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        preconnect=False,
+    )
+    pool.preconnect()
+    assert pool._preconnect is None
+    await pool.aclose()
+
+
+def _azure_service(handler, **retry):
+    """Service on the real graph and ChatOpenAI client with a mocked endpoint"""
+    pool = ModelPool(
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    )
+    policy = RetryPolicy(base_delay=0, **retry)
+    return ChatbotService(models=pool, retry=policy), policy
+
+
+def _completion(content):
+    return {
+        "id": "chatcmpl-1",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-4o",
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+    }
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_call_is_retried_after_retry_after(mock_env):
+    statuses = [429, 200]
+
+    def handler(request):
+        status = statuses.pop(0)
+        if status == 429:
+            return httpx.Response(429, headers={"retry-after-ms": "10"}, json={})
+        return httpx.Response(200, json=_completion("pong"))
+
+    service, policy = _azure_service(handler)
+
+    assert await service.chat("ping", thread_id="retry") == "pong"
+    assert statuses == []
+    # The retry resumed the failed run instead of adding the message again
+    assert await service.message_count("retry") == 2
+    assert policy.stats()["gpt-4o"] == {"state": "closed", "failures": 0}
+
+
+@pytest.mark.asyncio
+async def test_bad_request_is_not_retried(mock_env):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(
+            400,
+            json={"error": {"message": "too long", "code": "context_length_exceeded"}},
+        )
+
+    service, _ = _azure_service(handler)
+
+    with pytest.raises(ModelError) as e:
+        await service.chat("ping")
+
+    assert e.value.code == "context_length"
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_auth_errors_open_the_circuit(mock_env):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(401, json={"error": {"message": "bad key"}})
+
+    service, policy = _azure_service(handler, failure_threshold=2)
+
+    for _ in range(2):
+        with pytest.raises(ModelError) as e:
+            await service.chat("ping")
+        assert e.value.code == "auth"
+    with pytest.raises(ModelError) as e:
+        await service.chat("ping")
+
+    assert e.value.code == "circuit_open"
+    # Not retried, and not sent once the circuit is open
+    assert len(calls) == 2
+
+
+def test_retry_policy_needs_an_attempt():
+    with pytest.raises(ValueError):
+        RetryPolicy(max_attempts=0)
+
+
+@pytest.mark.asyncio
+async def test_circuit_opens_after_repeated_failures(mock_env):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503, json={})
+
+    service, policy = _azure_service(handler, max_attempts=2, failure_threshold=2)
+
+    with pytest.raises(ModelError) as e:
+        await service.chat("ping")
+    assert e.value.code == "server_error"
+
+    with pytest.raises(ModelError) as e:
+        await service.chat("ping again")
+    assert e.value.code == "circuit_open"
+    assert e.value.retry_after > 0
+    assert len(calls) == 2
+    assert policy.stats()["gpt-4o"]["state"] == "open"
+
+
+@pytest.mark.asyncio
+async def test_stream_is_not_retried_after_tokens_were_sent(chatbot_service):
+    attempts = []
+
+    async def failing_astream(*args, **kwargs):
+        attempts.append(args[0])
+        yield AIMessage(content="Hel"), {}
+        raise httpx.ReadError("connection lost")
+
+    chatbot_service.app.astream = failing_astream
+    chatbot_service.retry = RetryPolicy(base_delay=0)
+
+    chunks = []
+    with pytest.raises(ModelError) as e:
+        async for chunk in chatbot_service.stream_chat("Test"):
+            chunks.append(chunk)
+
+    assert e.value.code == "unavailable"
+    assert chunks == ["Hel"]
+    assert len(attempts) == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_probe_lets_the_next_call_probe(chatbot_service):
+    policy = RetryPolicy(failure_threshold=1, reset_timeout=0)
+    chatbot_service.retry = policy
+    breaker = policy.breaker("gpt-4o")
+    breaker.record_failure()
+    started = asyncio.Event()
+
+    async def hanging_ainvoke(*args, **kwargs):
+        started.set()
+        await asyncio.sleep(60)
+
+    chatbot_service.app.ainvoke = hanging_ainvoke
+    probe = asyncio.create_task(chatbot_service.chat("ping", model="gpt-4o"))
+    await started.wait()
+    with pytest.raises(ModelError) as e:
+        breaker.check("gpt-4o")
+    assert e.value.code == "circuit_open"
+
+    probe.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await probe
+
+    chatbot_service.app.ainvoke = AsyncMock(
+        return_value={"messages": [AIMessage(content="pong")]}
+    )
+    assert await chatbot_service.chat("ping", model="gpt-4o") == "pong"
+    assert breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_closed_stream_probe_and_lost_probe_are_released(chatbot_service):
+    policy = RetryPolicy(failure_threshold=1, reset_timeout=0, probe_timeout=60)
+    chatbot_service.retry = policy
+    breaker = policy.breaker("gpt-4o")
+    breaker.record_failure()
+
+    async def astream(*args, **kwargs):
+        yield AIMessage(content="Hel"), {}
+        yield AIMessage(content="lo"), {}
+
+    chatbot_service.app.astream = astream
+    stream = chatbot_service.stream_chat("ping", model="gpt-4o")
+    assert await stream.__anext__() == "Hel"
+    await stream.aclose()
+    assert breaker.check("gpt-4o") is True
+
+    # A probe that never reports back expires
+    breaker.probe_timeout = 0
+    assert breaker.check("gpt-4o") is True
+
+
+@pytest.mark.asyncio
+async def test_temperature_is_sent_per_call_without_new_clients(mock_env):
+    temperatures = []
+
+    def handler(request):
+        temperatures.append(json.loads(request.content)["temperature"])
+        return httpx.Response(200, json=_completion("pong"))
+
+    service, _ = _azure_service(handler)
+
+    for i, temperature in enumerate((0.1, 0.11, 0.111, None)):
+        await service.chat_message("ping", f"t{i}", temperature=temperature)
+
+    assert temperatures == [0.1, 0.11, 0.111, 1.0]
+    assert service.models.stats()["clients"] == 1
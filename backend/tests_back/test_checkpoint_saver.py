@@ -0,0 +1,116 @@
+import os
+from datetime import timedelta
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from sqlalchemy import create_engine, update
+
+from app.chatbot import ChatbotService
+from app.db import models
+from app.db.checkpoint_saver import SQLCheckpointSaver
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """Database file shared by every saver in a test"""
+    test_engine = create_engine(f"sqlite:///{tmp_path / 'checkpoints.db'}")
+    models.Base.metadata.create_all(bind=test_engine)
+    return test_engine
+
+
+@pytest.fixture
+def fake_models():
+    models_pool = MagicMock()
+    models_pool.get.return_value.ainvoke = AsyncMock(
+        side_effect=lambda prompt: AIMessage(
+            content=f"reply to {prompt.messages[-1].content}"
+        )
+    )
+    return models_pool
+
+
+def make_service(engine, fake_models, scope="a"):
+    return ChatbotService(
+        models=fake_models, checkpointer=SQLCheckpointSaver(engine, scope=scope)
+    )
+
+
+@pytest.mark.asyncio
+async def test_thread_state_is_shared_between_workers(engine, fake_models, mocker):
+    """A follow-up on another worker sees the messages stored by the first one"""
+    mocker.patch.dict(os.environ, {"DA_OPENAI_API_KEY": "test-key"})
+    worker_1 = make_service(engine, fake_models)
+    worker_2 = make_service(engine, fake_models)
+
+    await worker_1.chat("first", thread_id="shared-thread")
+    await worker_2.chat("second", thread_id="shared-thread")
+
+    state = worker_1.app.get_state({"configurable": {"thread_id": "shared-thread"}})
+    contents = [m.content for m in state.values["messages"]]
+    assert contents == ["first", "reply to first", "second", "reply to second"]
+    assert "Bot B:\nfirst" in worker_2.get_conversation_history("shared-thread")
+
+
+@pytest.mark.asyncio
+async def test_scopes_do_not_see_each_other(engine, fake_models):
+    """Chatbot A and chatbot B keep separate histories for the same thread id"""
+    bot_a = make_service(engine, fake_models, scope="a")
+    bot_b = make_service(engine, fake_models, scope="b")
+
+    await bot_a.chat("only for a", thread_id="same-id")
+
+    assert bot_b.get_conversation_history("same-id") == ""
+    assert "only for a" in bot_a.get_conversation_history("same-id")
+
+
+@pytest.mark.asyncio
+async def test_list_returns_history_newest_first(engine, fake_models):
+    """Checkpoint history can be listed and limited"""
+    service = make_service(engine, fake_models)
+    await service.chat("one", thread_id="history")
+    await service.chat("two", thread_id="history")
+
+    config = {"configurable": {"thread_id": "history"}}
+    checkpoints = list(service.memory.list(config))
+    ids = [c.config["configurable"]["checkpoint_id"] for c in checkpoints]
+
+    assert len(checkpoints) > 2
+    assert ids == sorted(ids, reverse=True)
+    assert len(list(service.memory.list(config, limit=2))) == 2
+
+
+@pytest.mark.asyncio
+async def test_prune_deletes_only_expired_threads(engine, fake_models):
+    """Threads idle for longer than the TTL are removed"""
+    service = make_service(engine, fake_models)
+    await service.chat("old", thread_id="old-thread")
+    await service.chat("new", thread_id="new-thread")
+
+    with engine.begin() as conn:
+        conn.execute(
+            update(models.Checkpoint)
+            .where(models.Checkpoint.thread_id == "old-thread")
+            .values(created_at=models.Checkpoint.created_at - timedelta(days=10))
+        )
+
+    deleted = service.memory.prune(timedelta(days=1))
+
+    assert deleted == 1
+    assert service.get_conversation_history("old-thread") == ""
+    assert "new" in service.get_conversation_history("new-thread")
+
+
+@pytest.mark.asyncio
+async def test_async_stream_uses_saver(engine, fake_models):
+    """The async graph path reads and writes through the saver"""
+    service = make_service(engine, fake_models)
+
+    await service.app.ainvoke(
+        {"messages": [HumanMessage(content="async hello")]},
+        service.build_config("async-thread"),
+    )
+
+    history = service.get_conversation_history("async-thread")
+    assert "async hello" in history
+    assert "reply to async hello" in history
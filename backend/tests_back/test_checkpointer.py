@@ -0,0 +1,110 @@
+import time
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from app.chatbot import ChatbotService
+from app.checkpointer import BoundedMemorySaver, create_checkpointer
+
+
+@pytest.fixture
+def fake_models():
+    models_pool = MagicMock()
+    models_pool.get.return_value.ainvoke = AsyncMock(
+        side_effect=lambda prompt: AIMessage(
+            content=f"reply to {prompt.messages[-1].content}"
+        )
+    )
+    return models_pool
+
+
+def make_service(fake_models, **limits):
+    return ChatbotService(models=fake_models, checkpointer=BoundedMemorySaver(**limits))
+
+
+@pytest.mark.asyncio
+async def test_history_is_capped_per_thread(fake_models):
+    """Old checkpoints are dropped but the latest state stays complete"""
+    service = make_service(fake_models, max_checkpoints_per_thread=3)
+
+    for i in range(5):
+        await service.chat(f"message {i}", thread_id="capped")
+
+    config = {"configurable": {"thread_id": "capped"}}
+    assert len(list(service.memory.list(config))) == 3
+    assert service.memory.counters["trimmed_checkpoints"] > 0
+
+    messages = service.app.get_state(config).values["messages"]
+    assert len(messages) == 10
+    assert messages[-1].content == "reply to message 4"
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_thread_is_evicted(fake_models):
+    """Going over max_threads evicts the thread that was used longest ago"""
+    service = make_service(fake_models, max_threads=2)
+
+    await service.chat("one", thread_id="t1")
+    await service.chat("two", thread_id="t2")
+    service.get_conversation_history("t1")  # t1 is now more recent than t2
+    await service.chat("three", thread_id="t3")
+
+    assert service.get_conversation_history("t2") == ""
+    assert "one" in service.get_conversation_history("t1")
+    assert "three" in service.get_conversation_history("t3")
+    assert service.memory.stats()["evicted_lru"] == 1
+    assert service.memory.stats()["threads"] == 2
+
+
+@pytest.mark.asyncio
+async def test_idle_threads_expire(fake_models):
+    """Threads older than the TTL are evicted on the next write"""
+    service = make_service(fake_models, ttl=0.05)
+
+    await service.chat("old", thread_id="idle")
+    time.sleep(0.1)
+    await service.chat("new", thread_id="active")
+
+    assert service.get_conversation_history("idle") == ""
+    assert service.memory.stats()["evicted_ttl"] == 1
+
+
+@pytest.mark.asyncio
+async def test_byte_budget_is_enforced(fake_models):
+    """Threads are evicted until the stored size fits the budget"""
+    service = make_service(fake_models, max_bytes=20000)
+
+    for i in range(10):
+        await service.chat("x" * 500, thread_id=f"thread-{i}")
+
+    stats = service.memory.stats()
+    assert stats["evicted_bytes"] > 0
+    assert stats["bytes"] <= 20000
+    assert "x" * 500 in service.get_conversation_history("thread-9")
+
+
+@pytest.mark.asyncio
+async def test_delete_thread_releases_bytes(fake_models):
+    """Deleting every thread brings the accounted size back to zero"""
+    service = make_service(fake_models)
+    await service.chat("hello", thread_id="a")
+    await service.chat("hello", thread_id="b")
+
+    service.memory.delete_thread("a")
+    service.memory.delete_thread("b")
+
+    assert service.memory.stats()["bytes"] == 0
+    assert service.memory.stats()["threads"] == 0
+
+
+def test_memory_backend_is_bounded_by_default(mocker):
+    """The default checkpointer reads its limits from the environment"""
+    mocker.patch.dict(
+        "os.environ", {"DA_CHECKPOINTER": "memory", "DA_MEMORY_MAX_THREADS": "7"}
+    )
+
+    checkpointer = create_checkpointer("a")
+
+    assert isinstance(checkpointer, BoundedMemorySaver)
+    assert checkpointer.max_threads == 7
@@ -0,0 +1,148 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langgraph.constants import TAG_NOSTREAM
+
+from app.admission import AdmissionController
+from app.chatbot import ChatbotService
+from app.checkpointer import BoundedMemorySaver
+from app.context import (
+    MODEL_CONTEXT_TOKENS,
+    RESERVED_OUTPUT_TOKENS,
+    ContextManager,
+    token_counter,
+)
+from app.usage import UsageTracker
+
+
+def _thread(n_pairs, size=2000):
+    messages = []
+    for i in range(n_pairs):
+        messages.append(HumanMessage(content=f"question {i} " + "q" * size))
+        messages.append(AIMessage(content=f"answer {i} " + "a" * size))
+    return messages
+
+
+@pytest.fixture
+def summary_models():
+    models = MagicMock()
+    models.get.return_value.ainvoke = AsyncMock(
+        side_effect=lambda messages, config: AIMessage(content="the summary")
+    )
+    return models
+
+
+@pytest.mark.asyncio
+async def test_short_history_is_sent_unchanged():
+    messages = _thread(3, size=10)
+    context = ContextManager(MagicMock(), max_tokens=4000)
+
+    assert await context.prepare(messages, "gpt-4o", "t", "prompt") is messages
+
+
+@pytest.mark.asyncio
+async def test_long_history_is_trimmed_to_budget():
+    """Only the latest messages that fit the budget are sent"""
+    messages = _thread(40)
+    context = ContextManager(MagicMock(), max_tokens=4000)
+
+    kept = await context.prepare(messages, "gpt-4o", "t", "prompt")
+
+    count = token_counter("gpt-4o")
+    assert 0 < len(kept) < len(messages)
+    assert kept == messages[-len(kept) :]
+    assert isinstance(kept[0], HumanMessage)
+    assert count([SystemMessage(content="prompt"), *kept]) <= 4000
+
+
+@pytest.mark.asyncio
+async def test_oversized_latest_message_is_cut_not_dropped():
+    messages = [HumanMessage(content="line\n" * 20000)]
+    context = ContextManager(MagicMock(), max_tokens=2000)
+
+    kept = await context.prepare(messages, "gpt-4o", "t", "prompt")
+
+    assert len(kept) == 1
+    assert 0 < len(kept[0].content) < len(messages[0].content)
+
+
+@pytest.mark.asyncio
+async def test_summaries_are_cached_and_rolled_forward(summary_models):
+    context = ContextManager(summary_models, max_tokens=4000, summarize=True)
+    summarize = summary_models.get.return_value.ainvoke
+    messages = _thread(40)
+
+    first = await context.prepare(messages, "gpt-4o", "t", "prompt")
+    again = await context.prepare(messages, "gpt-4o", "t", "prompt")
+
+    assert summarize.await_count == 1
+    assert first == again
+    assert isinstance(first[0], SystemMessage)
+    assert "the summary" in first[0].content
+    # The summary call must not be streamed to the client
+    assert summarize.await_args.kwargs["config"]["tags"] == [TAG_NOSTREAM]
+
+    messages += _thread(2)
+    await context.prepare(messages, "gpt-4o", "t", "prompt")
+
+    assert summarize.await_count == 2
+    rolled_prompt = summarize.await_args.args[0][1].content
+    assert rolled_prompt.startswith("Earlier summary:\nthe summary")
+    assert "question 0 " not in rolled_prompt
+
+
+def test_budget_defaults_to_the_model_window_and_can_only_be_lowered():
+    window = MODEL_CONTEXT_TOKENS["gpt-4.1"] - RESERVED_OUTPUT_TOKENS
+
+    assert ContextManager(MagicMock()).budget("gpt-4.1") == window
+    assert ContextManager(MagicMock(), max_tokens=10**9).budget("gpt-4.1") == window
+    assert ContextManager(MagicMock(), max_tokens=8000).budget("gpt-4.1") == 8000
+
+
+@pytest.mark.asyncio
+async def test_summary_calls_are_accounted_to_the_user():
+    models = MagicMock()
+    models.get.return_value.ainvoke = AsyncMock(
+        return_value=AIMessage(
+            content="the summary",
+            usage_metadata={
+                "input_tokens": 900,
+                "output_tokens": 100,
+                "total_tokens": 1000,
+            },
+        )
+    )
+    usage, admission = UsageTracker(), AdmissionController()
+    context = ContextManager(
+        models, max_tokens=4000, summarize=True, usage=usage, admission=admission
+    )
+
+    await context.prepare(_thread(40), "gpt-4o", "t", "prompt", user_id="u1")
+
+    assert usage.totals["gpt-4o-mini"] == [1, 900, 100]
+    assert (await usage.user_stats("u1"))["tokens"] == 1000
+    assert admission._window.total == 1000
+
+
+@pytest.mark.asyncio
+async def test_model_prompt_stays_bounded_in_long_threads():
+    """The request size stops growing while the checkpoint keeps everything"""
+    models = MagicMock()
+    models.get.return_value.ainvoke = AsyncMock(
+        side_effect=lambda prompt: AIMessage(content="r" * 2000)
+    )
+    service = ChatbotService(
+        models=models,
+        checkpointer=BoundedMemorySaver(),
+        context=ContextManager(models, max_tokens=6000),
+    )
+
+    for i in range(15):
+        await service.chat("m" * 2000, thread_id="long")
+
+    prompt = models.get.return_value.ainvoke.await_args.args[0]
+    state = service.app.get_state({"configurable": {"thread_id": "long"}})
+    assert len(state.values["messages"]) == 30
+    assert len(prompt.messages) < 20
+    assert token_counter("gpt-4o")(prompt.messages) <= 6000
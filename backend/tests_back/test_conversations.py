@@ -1,7 +1,10 @@
 import os
 import asyncio
+import json
 import pytest
+from unittest.mock import AsyncMock, MagicMock
 from fastapi.testclient import TestClient
+from langchain_core.messages import AIMessage
 
 os.environ.setdefault("DA_DB_URL", "sqlite:///:memory:")
 os.environ.setdefault("DA_ENVIRONMENT", "testing")
@@ -23,7 +26,7 @@ def test_client_app():
 
 
 def _make_async_stream(tokens):
-    async def _stream(message, thread_id, model=None):
+    async def _stream(message, thread_id, system_prompt=None, model=None, **options):
         for t in tokens:
             await asyncio.sleep(0)
             yield t
@@ -33,17 +36,16 @@ def _make_async_stream(tokens):
 
 def test_chat_endpoint_with_a_and_b(test_client_app, monkeypatch):
     """POST /chat returns responses from the selected chatbot."""
-    # Mock chatbot_a.chat and chatbot_b.chat
-    monkeypatch.setattr(
-        main.chatbot_a,
-        "chat",
-        lambda message, thread_id, system_prompt, model: "AI-A: pong",
-    )
-    monkeypatch.setattr(
-        main.chatbot_b,
-        "chat",
-        lambda message, thread_id, system_prompt, model: "AI-B: pong",
-    )
+
+    # Mock chatbot_a.chat_message and chatbot_b.chat_message
+    async def chat_a(message, thread_id, system_prompt, model, **options):
+        return AIMessage(content="AI-A: pong")
+
+    async def chat_b(message, thread_id, system_prompt, model, **options):
+        return AIMessage(content="AI-B: pong")
+
+    monkeypatch.setattr(main.chatbot_a, "chat_message", chat_a)
+    monkeypatch.setattr(main.chatbot_b, "chat_message", chat_b)
 
     payload_a = {"message": "ping", "thread_id": "t1", "chatbot": "a"}
     r = test_client_app.post("/chat", json=payload_a)
@@ -51,6 +53,7 @@ def test_chat_endpoint_with_a_and_b(test_client_app, monkeypatch):
     j = r.json()
     assert j["user_message"] == "ping"
     assert j["ai_response"] == "AI-A: pong"
+    assert r.headers["X-Cache"] == "bypass"
 
     payload_b = {"message": "ping", "thread_id": "t1", "chatbot": "b"}
     r = test_client_app.post("/chat", json=payload_b)
@@ -63,7 +66,9 @@ def test_download_chat(test_client_app, monkeypatch):
     """GET /download-chat returns a text attachment with conversation history."""
     # Mock conversation history
     monkeypatch.setattr(
-        main.chatbot_a, "get_conversation_history", lambda thread_id: "Bot A:\nHello\n"
+        main.chatbot_a,
+        "iter_conversation_history",
+        lambda thread_id: iter(["Bot A:\nHello\n"]),
     )
 
     r = test_client_app.get("/download-chat/t123")
@@ -100,28 +105,93 @@ def test_conversation_streaming(test_client_app, monkeypatch):
     assert found_token, "No token events received in stream"
 
 
+@pytest.mark.asyncio
+async def test_next_turn_starts_before_end_event_is_consumed(monkeypatch):
+    """The next bot's request is in flight while the client handles `end`"""
+    log = []
+
+    def fake_stream(bot):
+        async def _stream(
+            message, thread_id, system_prompt=None, model=None, **options
+        ):
+            log.append(f"request {bot}")
+            await asyncio.sleep(0.01)
+            yield f"{bot} says hi"
+
+        return _stream
+
+    monkeypatch.setattr(main.chatbot_a, "stream_chat", fake_stream("a"))
+    monkeypatch.setattr(main.chatbot_b, "stream_chat", fake_stream("b"))
+    request = MagicMock()
+    request.is_disconnected = AsyncMock(return_value=False)
+
+    conv = main.ConversationStart(initial_message="hi", turns=3)
+    ends = []
+    async for event in main.conversation_events(conv, request):
+        if event["type"] == "end":
+            ends.append(event)
+            # A slow client: the next request must not wait for it
+            await asyncio.sleep(0.005)
+            log.append("client done")
+
+    assert log == [
+        "request a",
+        "request b",
+        "client done",
+        "request a",
+        "client done",
+        "client done",
+    ]
+    assert all(e["ttft_ms"] >= 5 for e in ends)
+    assert all(e["duration_ms"] >= e["ttft_ms"] for e in ends)
+
+
+@pytest.mark.asyncio
+async def test_failed_turn_ends_stream_with_error_event(monkeypatch):
+    """A model failure is reported, not passed to the other bot as a message"""
+    from app.resilience import ModelError
+
+    async def failing_stream(
+        message, thread_id, system_prompt=None, model=None, **options
+    ):
+        raise ModelError("rate_limited", "Too many requests", retry_after=12.5)
+        yield
+
+    stream_b = MagicMock()
+    monkeypatch.setattr(main.chatbot_a, "stream_chat", failing_stream)
+    monkeypatch.setattr(main.chatbot_b, "stream_chat", stream_b)
+    request = MagicMock()
+    request.is_disconnected = AsyncMock(return_value=False)
+
+    conv = main.ConversationStart(initial_message="hi", turns=3)
+    events = [e async for e in main.conversation_events(conv, request)]
+
+    assert [e["type"] for e in events] == ["start", "error"]
+    assert events[-1]["code"] == "rate_limited"
+    assert events[-1]["retryable"] is True
+    assert events[-1]["retry_after"] == 13
+    stream_b.assert_not_called()
+
+
 # -- Database-backed tests and fixtures ---------------------------------------
 
 
 @pytest.fixture
-def test_db(mocker):
+def test_db(mocker, tmp_path):
     """Create test database"""
     # Mock the DA_DB_URL environment variable
     mocker.patch.dict(os.environ, {"DA_DB_URL": "sqlite:///:memory:"})
 
     from app.db.models import Base
     from sqlalchemy import create_engine
-    from sqlalchemy.orm import sessionmaker
-    from sqlalchemy.pool import StaticPool
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 
-    test_engine = create_engine(
-        "sqlite:///:memory:",
-        connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
-    )
-    Base.metadata.create_all(bind=test_engine)
-    TestingSessionLocal = sessionmaker(
-        autocommit=False, autoflush=False, bind=test_engine
+    db_file = tmp_path / "test.db"
+    Base.metadata.create_all(bind=create_engine(f"sqlite:///{db_file}"))
+
+    test_engine = create_async_engine(f"sqlite+aiosqlite:///{db_file}")
+    TestingSessionLocal = async_sessionmaker(
+        autoflush=False, bind=test_engine, expire_on_commit=False
     )
     return TestingSessionLocal
 
@@ -137,19 +207,17 @@ def test_client(test_db, mocker):
             "OPENAI_API_KEY": "test-key-123",
         },
     )
-    from app.main import app, get_db, get_user_id
+    from app.main import app, get_db, get_session_factory, get_user_id
 
-    def override_get_db():
-        db = test_db()
-        try:
+    async def override_get_db():
+        async with test_db() as db:
             yield db
-        finally:
-            db.close()
 
     def override_get_user_id():
         return "test_user_123"
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_session_factory] = lambda: test_db
     app.dependency_overrides[get_user_id] = override_get_user_id
 
     client = TestClient(app)
@@ -283,7 +351,7 @@ def test_conversation_validation_turns(test_client, turns, expected_status):
     assert response.status_code == expected_status
 
 
-def test_delete_conversation(test_client):
+def test_delete_conversation(test_client, test_db):
     """Test deleting a conversation"""
     conv_data = {
         "conversation_starter": "To be deleted",
@@ -299,10 +367,18 @@ def test_delete_conversation(test_client):
     assert create_response.status_code == 200
     conversation_id = create_response.json()["id"]
 
-    delete_response = test_client.delete(f"/conversations/{conversation_id}")
+    owner = test_client.app.dependency_overrides[main.get_user_id]
+    test_client.app.dependency_overrides[main.get_user_id] = lambda: "someone_else"
+    assert test_client.delete(f"/conversations/{conversation_id}").status_code == 404
+    test_client.app.dependency_overrides[main.get_user_id] = owner
+
+    deleted, queries = _count_queries(
+        test_db, lambda: test_client.delete(f"/conversations/{conversation_id}")
+    )
 
-    assert delete_response.status_code == 200
-    assert delete_response.json()["message"] == "Conversation deleted successfully"
+    assert deleted["message"] == "Conversation deleted successfully"
+    # Two bulk deletes, the messages are never loaded
+    assert queries == 2
 
     get_response = test_client.get(f"/conversations/{conversation_id}")
     assert get_response.status_code == 404
@@ -315,3 +391,540 @@ def test_delete_nonexistent_conversation(test_client):
     assert response.status_code == 404
     data = response.json()
     assert "detail" in data
+
+
+def test_update_conversation_replaces_messages(test_client):
+    """Test updating a conversation and replacing its messages"""
+    conv_data = {
+        "conversation_starter": "Original",
+        "thread_id": "thread-update",
+        "turns": 2,
+        "messages": [
+            {"chatbot": "user", "message": "Original"},
+            {"chatbot": "a", "message": "Old answer"},
+        ],
+    }
+    conversation_id = test_client.post("/conversations", json=conv_data).json()["id"]
+
+    conv_data["turns"] = 3
+    conv_data["messages"] = [
+        {"chatbot": "user", "message": "Original"},
+        {"chatbot": "a", "message": "New answer"},
+        {"chatbot": "b", "message": "Follow-up"},
+    ]
+    response = test_client.put(f"/conversations/{conversation_id}", json=conv_data)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["turns"] == 3
+    assert [m["message"] for m in data["messages"]] == [
+        "Original",
+        "New answer",
+        "Follow-up",
+    ]
+
+    fetched = test_client.get(f"/conversations/{conversation_id}").json()
+    assert [m["order"] for m in fetched["messages"]] == [0, 1, 2]
+    assert fetched["messages"][1]["message"] == "New answer"
+
+
+def test_update_nonexistent_conversation(test_client):
+    """Test updating a conversation that does not exist"""
+    data = {
+        "conversation_starter": "Missing",
+        "thread_id": "thread-missing",
+        "messages": [{"chatbot": "user", "message": "Missing"}],
+    }
+
+    response = test_client.put("/conversations/99999", json=data)
+
+    assert response.status_code == 404
+
+
+def _count_queries(test_db, send):
+    """Runs `send` and returns its response and the number of SQL statements"""
+    from sqlalchemy import event
+
+    statements = []
+    engine = test_db.kw["bind"].sync_engine
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        response = send()
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    assert response.status_code == 200
+    return response.json(), len(statements)
+
+
+def _count_list_queries(test_client, test_db):
+    return _count_queries(test_db, lambda: test_client.get("/conversations"))
+
+
+def test_list_conversations_query_count_is_constant(test_client, test_db):
+    """Listing conversations does not issue one query per conversation"""
+
+    def save(i):
+        test_client.post(
+            "/conversations",
+            json={
+                "conversation_starter": f"Question {i}",
+                "thread_id": f"thread-n1-{i}",
+                "messages": [
+                    {"chatbot": "user", "message": f"Question {i}"},
+                    {"chatbot": "a", "message": f"Answer {i}"},
+                ],
+            },
+        )
+
+    save(0)
+    conversations, queries_for_one = _count_list_queries(test_client, test_db)
+    assert len(conversations) == 1
+
+    for i in range(1, 10):
+        save(i)
+    conversations, queries_for_ten = _count_list_queries(test_client, test_db)
+
+    assert len(conversations) == 10
+    assert queries_for_ten == queries_for_one == 1
+    assert "messages" not in conversations[0]
+
+
+def test_list_conversations_is_paginated(test_client):
+    """Pages follow the cursor header without gaps or duplicates"""
+    for i in range(5):
+        test_client.post(
+            "/conversations",
+            json={
+                "conversation_starter": f"Question {i} " + "x" * 300,
+                "thread_id": f"thread-page-{i}",
+                "turns": 2,
+                "messages": [
+                    {"chatbot": "user", "message": f"Question {i}"},
+                    {"chatbot": "a", "message": f"Answer {i}"},
+                ],
+            },
+        )
+
+    first = test_client.get("/conversations", params={"limit": 2})
+    second = test_client.get(
+        "/conversations",
+        params={"limit": 2, "cursor": first.headers["X-Next-Cursor"]},
+    )
+    third = test_client.get(
+        "/conversations",
+        params={"limit": 2, "cursor": second.headers["X-Next-Cursor"]},
+    )
+
+    pages = [first.json(), second.json(), third.json()]
+    ids = [c["id"] for page in pages for c in page]
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert ids == sorted(ids, reverse=True)
+    assert len(set(ids)) == 5
+    assert "X-Next-Cursor" not in third.headers
+
+    summary = pages[0][0]
+    assert summary["conversation_starter"].startswith("Question 4")
+    assert len(summary["conversation_starter"]) == 200
+    assert summary["message_count"] == 2
+    assert summary["turns"] == 2
+    assert "system_prompt_a" not in summary
+
+
+def test_list_conversations_rejects_invalid_cursor(test_client):
+    response = test_client.get("/conversations", params={"cursor": "not-a-cursor"})
+
+    assert response.status_code == 400
+
+
+def test_cursor_of_another_users_row_does_not_position_the_page(test_client):
+    """Only the user's own rows are looked up as the cursor position"""
+    from datetime import datetime, timedelta, timezone
+
+    from app.pagination import encode_cursor
+
+    owner = test_client.app.dependency_overrides[main.get_user_id]
+    test_client.app.dependency_overrides[main.get_user_id] = lambda: "someone_else"
+    other = test_client.post(
+        "/conversations",
+        json={
+            "conversation_starter": "Theirs",
+            "thread_id": "thread-theirs",
+            "messages": [{"chatbot": "user", "message": "Theirs"}],
+        },
+    ).json()
+    test_client.app.dependency_overrides[main.get_user_id] = owner
+    mine = test_client.post(
+        "/conversations",
+        json={
+            "conversation_starter": "Mine",
+            "thread_id": "thread-mine",
+            "messages": [{"chatbot": "user", "message": "Mine"}],
+        },
+    ).json()
+
+    # Their row would put the position at their timestamp, before mine
+    later = datetime.now(timezone.utc) + timedelta(days=1)
+    cursor = encode_cursor(later, other["id"])
+    page = test_client.get("/conversations", params={"cursor": cursor}).json()
+
+    assert [c["id"] for c in page] == [mine["id"]]
+
+
+def _conversation_with(n_messages):
+    return {
+        "conversation_starter": "Round trips",
+        "thread_id": "thread-round-trips",
+        "turns": 20,
+        "messages": [
+            {"chatbot": "ab"[i % 2], "message": f"Message {i} " + "x" * 2000}
+            for i in range(n_messages)
+        ],
+    }
+
+
+def test_save_round_trips_do_not_grow_with_messages(test_client, test_db):
+    """Saving issues the same statements for 2 messages as for a 20-turn chat"""
+    small, small_queries = _count_queries(
+        test_db, lambda: test_client.post("/conversations", json=_conversation_with(2))
+    )
+    large, large_queries = _count_queries(
+        test_db, lambda: test_client.post("/conversations", json=_conversation_with(40))
+    )
+
+    assert len(small["messages"]) == 2
+    assert [m["order"] for m in large["messages"]] == list(range(40))
+    assert all(m["created_at"] for m in large["messages"])
+    # INSERT conversation + one multi-row INSERT for the messages
+    assert small_queries == large_queries == 2
+
+
+def test_update_only_writes_changed_messages(test_client, test_db):
+    """Appending turns inserts only the new messages"""
+    data = _conversation_with(10)
+    conversation_id = test_client.post("/conversations", json=data).json()["id"]
+
+    data["messages"] += _conversation_with(20)["messages"][10:]
+    updated, queries = _count_queries(
+        test_db,
+        lambda: test_client.put(f"/conversations/{conversation_id}", json=data),
+    )
+
+    assert [m["order"] for m in updated["messages"]] == list(range(20))
+    # UPDATE conversation + SELECT messages + one INSERT for the new messages
+    assert queries == 3
+
+
+def test_update_removes_messages_past_the_new_end(test_client):
+    data = _conversation_with(5)
+    conversation_id = test_client.post("/conversations", json=data).json()["id"]
+
+    data["messages"] = data["messages"][:2]
+    data["messages"][1] = {"chatbot": "b", "message": "Edited"}
+    response = test_client.put(f"/conversations/{conversation_id}", json=data)
+
+    fetched = test_client.get(f"/conversations/{conversation_id}").json()
+    assert response.json()["messages"] == fetched["messages"]
+    assert [m["message"] for m in fetched["messages"]][1:] == ["Edited"]
+    assert len(fetched["messages"]) == 2
+
+
+def _stream_events(response):
+    return [
+        json.loads(line[len("data: ") :])
+        for line in response.iter_lines()
+        if line.startswith("data: ")
+    ]
+
+
+def test_persisted_stream_saves_each_turn(test_client, monkeypatch):
+    """With persist=true the streamed turns are saved without a second upload"""
+    monkeypatch.setattr(main.chatbot_a, "stream_chat", _make_async_stream(["A1", "A2"]))
+    monkeypatch.setattr(main.chatbot_b, "stream_chat", _make_async_stream(["B1"]))
+
+    payload = {
+        "initial_message": "start",
+        "turns": 3,
+        "thread_id": "persisted",
+        "model": "gpt-4o",
+        "persist": True,
+    }
+    events = _stream_events(test_client.post("/conversation", json=payload))
+
+    ends = [e for e in events if e["type"] == "end"]
+    conversation_id = ends[-1]["conversation_id"]
+    assert len(ends) == 3
+
+    saved = test_client.get(f"/conversations/{conversation_id}").json()
+    assert saved["conversation_starter"] == "start"
+    assert saved["turns"] == 3
+    assert [(m["chatbot"], m["message"]) for m in saved["messages"]] == [
+        ("user", "start"),
+        ("a", "A1A2"),
+        ("b", "B1"),
+        ("a", "A1A2"),
+    ]
+
+    # Continuing the same conversation appends after the saved messages
+    payload.update(initial_message="again", turns=1, conversation_id=conversation_id)
+    events = _stream_events(test_client.post("/conversation", json=payload))
+
+    assert events[-1]["type"] == "end"
+    assert events[-1]["conversation_id"] == conversation_id
+    saved = test_client.get(f"/conversations/{conversation_id}").json()
+    assert [m["order"] for m in saved["messages"]] == list(range(6))
+    assert saved["messages"][4]["message"] == "again"
+
+
+def test_persisted_stream_unknown_conversation(test_client):
+    payload = {"initial_message": "x", "persist": True, "conversation_id": 99999}
+
+    response = test_client.post("/conversation", json=payload)
+
+    assert response.status_code == 404
+
+
+def test_resume_seeds_checkpoints_once(test_client, monkeypatch):
+    """Resuming sends only the new message and rebuilds checkpoints only once"""
+    saved = test_client.post(
+        "/conversations",
+        json={
+            "conversation_starter": "hello",
+            "thread_id": "resume-thread",
+            "messages": [
+                {"chatbot": "user", "message": "hello"},
+                {"chatbot": "a", "message": "a1"},
+                {"chatbot": "b", "message": "b1"},
+            ],
+        },
+    ).json()
+
+    sent = []
+
+    async def fake_stream(
+        message, thread_id, system_prompt=None, model=None, **options
+    ):
+        sent.append((message, thread_id))
+        yield "reply"
+
+    monkeypatch.setattr(main.chatbot_a, "stream_chat", fake_stream)
+    monkeypatch.setattr(main.chatbot_b, "stream_chat", fake_stream)
+    seed = AsyncMock(wraps=main.chatbot_a.seed)
+    monkeypatch.setattr(main.chatbot_a, "seed", seed)
+
+    payload = {
+        "initial_message": "continue",
+        "turns": 1,
+        "conversation_id": saved["id"],
+        "history": [{"chatbot": "user", "message": "ignored " * 100}],
+    }
+    events = _stream_events(test_client.post("/conversation", json=payload))
+
+    assert [e["type"] for e in events] == ["start", "token", "end"]
+    # Chatbot B spoke last, so chatbot A answers the new message
+    assert events[0]["chatbot"] == "a"
+    assert sent == [("continue", "resume-thread")]
+
+    config = {"configurable": {"thread_id": "resume-thread"}}
+    state_a = main.chatbot_a.app.get_state(config).values["messages"]
+    state_b = main.chatbot_b.app.get_state(config).values["messages"]
+    assert [m.content for m in state_a] == ["hello", "a1"]
+    assert [m.content for m in state_b] == ["a1", "b1"]
+
+    # The checkpoints now match the saved messages, nothing is rebuilt
+    _stream_events(test_client.post("/conversation", json=payload))
+    assert seed.await_count == 1
+
+
+def test_job_is_prepared_when_it_runs(test_client, test_db, monkeypatch):
+    """A queued job seeds its checkpoints and orders its messages at run time"""
+    from app.jobs import JobManager
+
+    saved = test_client.post(
+        "/conversations",
+        json={
+            "conversation_starter": "hello",
+            "thread_id": "job-thread",
+            "messages": [
+                {"chatbot": "user", "message": "hello"},
+                {"chatbot": "a", "message": "a1"},
+                {"chatbot": "b", "message": "b1"},
+            ],
+        },
+    ).json()
+    monkeypatch.setattr(main.chatbot_a, "stream_chat", _make_async_stream(["A"]))
+    monkeypatch.setattr(main.chatbot_b, "stream_chat", _make_async_stream(["B"]))
+    # Workers are not started, the job stays queued until it is run below
+    manager = JobManager(main.run_registry, main.job_events)
+    monkeypatch.setattr(manager, "start", lambda: None)
+    monkeypatch.setattr(main, "job_manager", manager)
+    monkeypatch.setattr(main, "get_session_factory", lambda: test_db)
+    seed = AsyncMock(wraps=main.chatbot_b.seed)
+    monkeypatch.setattr(main.chatbot_b, "seed", seed)
+
+    payload = {
+        "initial_message": "from job",
+        "turns": 1,
+        "conversation_id": saved["id"],
+        "persist": True,
+    }
+    job_id = test_client.post("/jobs", json=payload).json()["id"]
+    missing = {**payload, "conversation_id": 99999}
+    assert test_client.post("/jobs", json=missing).status_code == 404
+    assert seed.await_count == 0
+
+    # An interactive turn is saved while the job is queued
+    interactive = {**payload, "initial_message": "interactive"}
+    _stream_events(test_client.post("/conversation", json=interactive))
+    # The checkpoints of the worker running the job start empty
+    asyncio.run(main.chatbot_b.seed("job-thread", []))
+    seed.reset_mock()
+
+    async def run_job():
+        job = await manager.get(job_id, "test_user_123")
+        return [e async for e in main.job_events(job)]
+
+    events = asyncio.run(run_job())
+
+    # Chatbot A answered the interactive message, so B answers the job's
+    assert events[0] == {"type": "start", "chatbot": "b"}
+    assert seed.await_count == 1
+    messages = test_client.get(f"/conversations/{saved['id']}").json()["messages"]
+    assert [(m["order"], m["chatbot"]) for m in messages] == [
+        (0, "user"),
+        (1, "a"),
+        (2, "b"),
+        (3, "user"),
+        (4, "a"),
+        (5, "user"),
+        (6, "b"),
+    ]
+
+
+def test_batch_runs_conversations_concurrently(test_client, monkeypatch):
+    """Runs share one stream, tagged by run, and overlap in time"""
+
+    async def slow_stream(
+        message, thread_id, system_prompt=None, model=None, **options
+    ):
+        await asyncio.sleep(0.05)
+        yield f"{system_prompt} on {thread_id}"
+
+    monkeypatch.setattr(main.chatbot_a, "stream_chat", slow_stream)
+    monkeypatch.setattr(main.chatbot_b, "stream_chat", slow_stream)
+
+    runs = [
+        {
+            "initial_message": "start",
+            "turns": 2,
+            "thread_id": f"batch-{i}",
+            "system_prompt_a": f"variant {i}",
+            "persist": i == 1,
+        }
+        for i in range(3)
+    ]
+    events = _stream_events(
+        test_client.post("/conversation/batch", json={"runs": runs})
+    )
+
+    for i in range(3):
+        run_events = [e for e in events if e["run"] == i]
+        assert [e["type"] for e in run_events] == [
+            "start",
+            "token",
+            "end",
+            "start",
+            "token",
+            "end",
+            "done",
+        ]
+        assert run_events[1]["content"] == f"variant {i} on batch-{i}"
+    # Every run started before any of them finished its first turn
+    first_end = next(n for n, e in enumerate(events) if e["type"] == "end")
+    assert {e["run"] for e in events[:first_end] if e["type"] == "start"} == {0, 1, 2}
+
+    persisted = [e for e in events if e["run"] == 1 and e["type"] == "end"]
+    saved = test_client.get(f"/conversations/{persisted[-1]['conversation_id']}")
+    assert len(saved.json()["messages"]) == 3
+
+
+def test_thread_ids_longer_than_the_columns_are_rejected(test_client):
+    thread_id = "t" * 101
+
+    chat = test_client.post("/chat", json={"message": "hi", "thread_id": thread_id})
+    conversation = test_client.post(
+        "/conversation", json={"initial_message": "hi", "thread_id": thread_id}
+    )
+
+    assert chat.status_code == 422
+    assert conversation.status_code == 422
+
+
+def test_batch_rejects_runs_sharing_a_thread(test_client):
+    run = {"initial_message": "start", "thread_id": "same", "persist": True}
+
+    response = test_client.post("/conversation/batch", json={"runs": [run, run]})
+
+    assert response.status_code == 400
+    assert test_client.get("/conversations").json() == []
+
+
+def test_batch_is_validated_before_any_run_is_saved(test_client):
+    def save(thread_id):
+        data = {
+            "conversation_starter": "Test",
+            "thread_id": thread_id,
+            "turns": 2,
+            "messages": [{"chatbot": "user", "message": "Test"}],
+        }
+        return test_client.post("/conversations", json=data).json()["id"]
+
+    first, second = save("shared"), save("shared")
+    new_run = {"initial_message": "start", "thread_id": "new", "persist": True}
+
+    unknown = {"initial_message": "start", "conversation_id": 999, "persist": True}
+    response = test_client.post(
+        "/conversation/batch", json={"runs": [new_run, unknown]}
+    )
+    assert response.status_code == 404
+
+    # Different conversations saved on one thread share its checkpoints
+    resumed = [
+        {"initial_message": "go on", "conversation_id": id_, "persist": True}
+        for id_ in (first, second)
+    ]
+    response = test_client.post(
+        "/conversation/batch", json={"runs": [new_run, *resumed]}
+    )
+    assert response.status_code == 400
+
+    conversations = test_client.get("/conversations").json()
+    assert sorted(c["id"] for c in conversations) == sorted([first, second])
+    for conversation_id in (first, second):
+        saved = test_client.get(f"/conversations/{conversation_id}").json()
+        assert len(saved["messages"]) == 1
+
+
+def test_conversation_stream_can_be_resumed_with_last_event_id(
+    test_client, monkeypatch
+):
+    monkeypatch.setattr(main.chatbot_a, "stream_chat", _make_async_stream(["A1"]))
+    monkeypatch.setattr(main.chatbot_b, "stream_chat", _make_async_stream(["B1"]))
+
+    payload = {"initial_message": "start", "turns": 2, "thread_id": "resumable"}
+    response = test_client.post("/conversation", json=payload)
+    run_id = response.headers["X-Run-Id"]
+    ids = [line for line in response.iter_lines() if line.startswith("id: ")]
+    assert ids == [f"id: {i}" for i in range(1, 7)]
+
+    replay = test_client.get(
+        f"/conversation/{run_id}/events", headers={"Last-Event-ID": "4"}
+    )
+    assert [e["type"] for e in _stream_events(replay)] == ["token", "end"]
+    assert _stream_events(replay)[0]["content"] == "B1"
+
+    assert test_client.get("/conversation/unknown/events").status_code == 404
@@ -0,0 +1,288 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytest_asyncio
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.db import models as db_models
+from app.jobs import (
+    FINISHED,
+    DatabaseJobQueue,
+    Job,
+    JobManager,
+    MemoryJobQueue,
+    create_job_queue,
+)
+from app.runs import RunRegistry
+
+
+def _conversation(turns, delay=0.0, active=None):
+    """Executor of fake jobs: `turns` turns of two tokens each"""
+
+    async def events(job):
+        if active is not None:
+            active.append(job.id)
+        try:
+            for i in range(turns):
+                yield {"type": "start", "chatbot": "ab"[i % 2]}
+                for token in (f"{job.spec['name']}{i}", "!"):
+                    await asyncio.sleep(delay)
+                    yield {"type": "token", "content": token}
+                yield {"type": "end"}
+        finally:
+            if active is not None:
+                active.remove(job.id)
+
+    return events
+
+
+async def _wait_for(condition, timeout=5.0):
+    """Awaits `condition()` until it returns a true value, fails on timeout"""
+    deadline = time.monotonic() + timeout
+    while not (result := await condition()):
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+    return result
+
+
+async def _finished(manager, job, user_id="u1"):
+    async def finished():
+        current = await manager.get(job.id, user_id)
+        return current if current.status in FINISHED else None
+
+    return await _wait_for(finished)
+
+
+@pytest_asyncio.fixture
+async def session_factory(tmp_path):
+    db_file = tmp_path / "jobs.db"
+    db_models.Base.metadata.create_all(bind=create_engine(f"sqlite:///{db_file}"))
+    # Several workers poll the same file: wait for locks instead of failing
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{db_file}", connect_args={"timeout": 30}
+    )
+    async with engine.begin() as conn:
+        await conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+    yield async_sessionmaker(bind=engine, expire_on_commit=False)
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_job_runs_in_background_and_records_turns():
+    manager = JobManager(RunRegistry(), _conversation(2))
+
+    job = await manager.submit("u1", {"name": "x"})
+    assert job.status == "queued"
+
+    job = await _finished(manager, job)
+    assert job.status == "succeeded"
+    assert job.messages == [
+        {"chatbot": "a", "message": "x0!"},
+        {"chatbot": "b", "message": "x1!"},
+    ]
+    assert await manager.get(job.id, "u2") is None
+    await manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_jobs_are_limited_to_worker_concurrency():
+    active, peak = [], 0
+    manager = JobManager(
+        RunRegistry(), _conversation(1, delay=0.01, active=active), concurrency=2
+    )
+
+    jobs = [await manager.submit("u1", {"name": str(i)}) for i in range(5)]
+    deadline = time.monotonic() + 5
+    while any(j.status in ("queued", "running") for j in jobs):
+        assert time.monotonic() < deadline, "timed out"
+        peak = max(peak, len(active))
+        jobs = [await manager.get(j.id, "u1") for j in jobs]
+        await asyncio.sleep(0.005)
+
+    assert peak == 2
+    assert all(j.status == "succeeded" for j in jobs)
+    await manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_cancel_stops_running_job_and_skips_queued_one():
+    registry = RunRegistry()
+    manager = JobManager(registry, _conversation(50, delay=0.01), concurrency=1)
+    running = await manager.submit("u1", {"name": "r"})
+    queued = await manager.submit("u1", {"name": "q"})
+    await asyncio.sleep(0.05)
+
+    assert (await manager.cancel(queued.id, "u1")).status == "cancelled"
+    await manager.cancel(running.id, "u1")
+
+    running = await _finished(manager, running)
+    assert running.status == "cancelled"
+    assert 0 < len(running.messages) < 50
+    assert registry.get(running.id, "u1").events[-1][1] == {"type": "cancelled"}
+    assert not manager.running
+    assert await manager.cancel(running.id, "u2") is None
+    await manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_database_queue_shares_jobs_between_workers(session_factory):
+    """A job submitted through one worker is run by another"""
+    submitter = JobManager(
+        RunRegistry(), _conversation(1), DatabaseJobQueue(session_factory), 0
+    )
+    runner = JobManager(
+        RunRegistry(),
+        _conversation(1),
+        DatabaseJobQueue(session_factory, poll_interval=0.05),
+    )
+
+    job = await submitter.submit("u1", {"name": "shared"})
+    runner.start()
+
+    job = await _finished(submitter, job)
+    assert job.status == "succeeded"
+    assert job.messages == [{"chatbot": "a", "message": "shared0!"}]
+    await runner.stop()
+
+
+@pytest.mark.asyncio
+async def test_database_queue_cancel_reaches_the_running_worker(session_factory):
+    submitter = JobManager(
+        RunRegistry(), _conversation(1), DatabaseJobQueue(session_factory), 0
+    )
+    runner = JobManager(
+        RunRegistry(),
+        _conversation(50, delay=0.01),
+        DatabaseJobQueue(session_factory, poll_interval=0.05),
+    )
+    runner.start()
+    job = await submitter.submit("u1", {"name": "far"})
+
+    async def started():
+        return (await submitter.get(job.id, "u1")).status != "queued"
+
+    await _wait_for(started)
+
+    await submitter.cancel(job.id, "u1")
+
+    assert (await _finished(submitter, job)).status == "cancelled"
+    await runner.stop()
+
+
+@pytest.mark.asyncio
+async def test_worker_survives_claim_errors_and_lost_jobs_expire(session_factory):
+    queue = DatabaseJobQueue(session_factory, poll_interval=0.05, lease_timeout=1)
+    # A job left running by a worker that was killed a while ago
+    lost = Job("lost", "u1", {"name": "lost"})
+    await queue.put(lost)
+    async with session_factory() as db, db.begin():
+        row = await db.get(db_models.ConversationJob, "lost")
+        row.status = "running"
+        row.updated_at = datetime.now(timezone.utc) - timedelta(seconds=10)
+
+    claim, failures = queue.claim, []
+
+    async def flaky_claim(worker):
+        if not failures:
+            failures.append(worker)
+            raise OSError("database is locked")
+        return await claim(worker)
+
+    queue.claim = flaky_claim
+    manager = JobManager(RunRegistry(), _conversation(1), queue, concurrency=1)
+    manager.CLAIM_BACKOFF = 0.01
+    job = await manager.submit("u1", {"name": "after"})
+
+    assert (await _finished(manager, job)).status == "succeeded"
+    assert failures
+    lost = await manager.get("lost", "u1")
+    assert (lost.status, lost.error) == ("failed", "Worker lost")
+    await manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_late_worker_does_not_overwrite_a_lost_job(session_factory):
+    queue = DatabaseJobQueue(session_factory, lease_timeout=1)
+    await queue.put(Job("slow", "u1", {"name": "slow"}))
+    job = await queue.claim("worker-1")
+
+    # The worker stalls past its lease and the job is failed as lost
+    async with session_factory() as db, db.begin():
+        row = await db.get(db_models.ConversationJob, "slow")
+        row.updated_at = datetime.now(timezone.utc) - timedelta(seconds=10)
+    queue._expired_at = 0.0
+    await queue._expire_leases()
+
+    assert not await queue.renew(job)
+    job.status, job.messages = "succeeded", [{"chatbot": "a", "message": "late"}]
+    await queue.save(job)
+
+    saved = await queue.get("slow")
+    assert (saved.status, saved.error, saved.messages) == ("failed", "Worker lost", [])
+
+
+def test_database_checkpointer_defaults_to_database_queue(monkeypatch):
+    monkeypatch.setenv("DA_DB_URL", "sqlite:///:memory:")
+    monkeypatch.delenv("DA_JOB_QUEUE", raising=False)
+    monkeypatch.setenv("DA_CHECKPOINTER", "memory")
+    assert isinstance(create_job_queue(), MemoryJobQueue)
+
+    monkeypatch.setenv("DA_CHECKPOINTER", "database")
+    assert isinstance(create_job_queue(), DatabaseJobQueue)
+
+    monkeypatch.setenv("DA_JOB_QUEUE", "memory")
+    assert isinstance(create_job_queue(), MemoryJobQueue)
+
+
+def test_jobs_endpoints(mocker, monkeypatch):
+    mocker.patch.dict(
+        os.environ,
+        {
+            "DA_DB_URL": "sqlite:///:memory:",
+            "DA_OPENAI_API_KEY": "test-key",
+            "DA_MODEL_WARMUP": "false",
+        },
+    )
+    from app import main
+
+    async def stream_chat(message, thread_id, **kwargs):
+        yield "hello"
+
+    monkeypatch.setattr(main.chatbot_a, "stream_chat", stream_chat)
+    monkeypatch.setattr(main.chatbot_b, "stream_chat", stream_chat)
+    monkeypatch.setattr(
+        main, "job_manager", JobManager(main.run_registry, main.job_events)
+    )
+    main.app.dependency_overrides[main.get_user_id] = lambda: "u1"
+
+    # One client for all requests so the jobs run on a single event loop
+    with TestClient(main.app) as client:
+        payload = {"initial_message": "hi", "turns": 2, "thread_id": "job"}
+        response = client.post("/jobs", json=payload)
+        assert response.status_code == 202
+        job_id = response.json()["id"]
+
+        def poll(*statuses):
+            deadline = time.monotonic() + 5
+            while (job := client.get(f"/jobs/{job_id}").json())["status"] in statuses:
+                assert time.monotonic() < deadline, "timed out"
+                time.sleep(0.01)
+            return job
+
+        poll("queued")
+        stream = client.get(f"/conversation/{job_id}/events")
+        assert '"type":"end"' in stream.text
+
+        job = poll("queued", "running")
+        assert job["status"] == "succeeded"
+        assert [m["chatbot"] for m in job["messages"]] == ["a", "b"]
+        assert client.get("/jobs/unknown").status_code == 404
+        assert client.delete("/jobs/unknown").status_code == 404
+        assert client.post("/jobs", json={**payload, "turns": 0}).status_code == 400
+
+    main.app.dependency_overrides.clear()
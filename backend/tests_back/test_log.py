@@ -0,0 +1,70 @@
+import os
+import json
+import logging
+
+from fastapi.testclient import TestClient
+
+os.environ.setdefault("DA_DB_URL", "sqlite:///:memory:")
+os.environ.setdefault("DA_OPENAI_API_KEY", "test-key-123")
+
+from app import main
+from app.log import (
+    CorrelationFilter,
+    JsonFormatter,
+    SamplingFilter,
+    request_id,
+    thread_id,
+)
+
+
+def _record(level=logging.INFO, **extra):
+    record = logging.makeLogRecord(
+        {"name": "app.test", "levelno": level, "levelname": "X", "msg": "m %s"}
+    )
+    record.args = ("arg",)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_lines_carry_correlation_ids_and_extra_fields():
+    tokens = request_id.set("req-1"), thread_id.set("thread-1")
+    try:
+        record = _record(turn=2)
+        CorrelationFilter().filter(record)
+    finally:
+        request_id.reset(tokens[0])
+        thread_id.reset(tokens[1])
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["message"] == "m arg"
+    assert entry["logger"] == "app.test"
+    assert entry["request_id"] == "req-1"
+    assert entry["thread_id"] == "thread-1"
+    assert entry["turn"] == 2
+
+
+def test_debug_records_are_sampled_per_thread():
+    sampling = SamplingFilter(0.5)
+    threads = [f"thread-{i}" for i in range(200)]
+
+    kept = {t for t in threads if sampling.filter(_record(logging.DEBUG, thread_id=t))}
+
+    assert 50 < len(kept) < 150
+    # The same conversation is always kept or always dropped
+    assert all(
+        sampling.filter(_record(logging.DEBUG, thread_id=t)) == (t in kept)
+        for t in threads
+    )
+    assert sampling.filter(_record(logging.INFO, thread_id=threads[0]))
+    assert not SamplingFilter(0).filter(_record(logging.DEBUG, thread_id="t"))
+
+
+def test_request_id_is_echoed_or_generated():
+    client = TestClient(main.app)
+
+    given = client.get("/", headers={"X-Request-Id": "abc123"})
+    generated = client.get("/")
+
+    assert given.headers["X-Request-Id"] == "abc123"
+    assert len(generated.headers["X-Request-Id"]) == 32
@@ -29,3 +29,11 @@ def test_me(test_client):
     assert r.status_code == 200
     body = r.json()
     assert body["sub"] == "test-user"
+
+
+def test_health_reports_model_pool(test_client):
+    r = test_client.get("/health")
+
+    assert r.status_code == 200
+    assert r.json()["status"] == "ok"
+    assert "clients" in r.json()["model_pool"]
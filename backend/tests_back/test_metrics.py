@@ -0,0 +1,117 @@
+import os
+import asyncio
+import re
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+os.environ.setdefault("DA_DB_URL", "sqlite:///:memory:")
+os.environ.setdefault("DA_OPENAI_API_KEY", "test-key-123")
+
+from app import main
+from app.metrics import Histogram, current_endpoint, db_query_time, track_db_queries
+
+
+def _count(body, name, labels):
+    match = re.search(rf"^{name}_count{{{re.escape(labels)}}} (\d+)$", body, re.M)
+    return int(match.group(1)) if match else 0
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 3):
+        histogram.observe(value, model='gpt-"4o"', endpoint="/chat")
+
+    assert histogram.render() == [
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{model="gpt-\\"4o\\"",endpoint="/chat",le="0.1"} 1',
+        'latency_seconds_bucket{model="gpt-\\"4o\\"",endpoint="/chat",le="1"} 3',
+        'latency_seconds_bucket{model="gpt-\\"4o\\"",endpoint="/chat",le="+Inf"} 4',
+        'latency_seconds_sum{model="gpt-\\"4o\\"",endpoint="/chat"} 4.05',
+        'latency_seconds_count{model="gpt-\\"4o\\"",endpoint="/chat"} 4',
+    ]
+
+
+def test_db_queries_are_timed_per_endpoint():
+    track_db_queries()
+    engine = create_engine("sqlite://")
+    token = current_endpoint.set("/test-endpoint")
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            with pytest.raises(Exception):
+                conn.execute(text("SELECT * FROM missing"))
+            conn.execute(text("SELECT 2"))
+    finally:
+        current_endpoint.reset(token)
+
+    series = db_query_time._series[("/test-endpoint",)]
+    assert sum(series[0]) == 2
+
+
+def test_conversation_stages_are_exposed_on_metrics(monkeypatch):
+    async def stream_chat(
+        message, thread_id, system_prompt=None, model=None, **options
+    ):
+        for token in ("to", "ken", "s"):
+            await asyncio.sleep(0.001)
+            yield token
+
+    monkeypatch.setattr(main.chatbot_a, "stream_chat", stream_chat)
+    monkeypatch.setattr(main.chatbot_b, "stream_chat", stream_chat)
+    main.app.dependency_overrides[main.get_user_id] = lambda: "u1"
+    client = TestClient(main.app)
+    model = main.chatbot_a.default_model_name
+    labels = f'model="{model}",endpoint="/conversation"'
+    before = _count(client.get("/metrics").text, "da_turn_duration_seconds", labels)
+
+    payload = {"initial_message": "hi", "turns": 2, "thread_id": "metrics"}
+    client.post("/conversation", json=payload).read()
+    response = client.get("/metrics")
+    main.app.dependency_overrides.clear()
+
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert _count(body, "da_turn_duration_seconds", labels) == before + 2
+    assert _count(body, "da_queue_wait_seconds", labels) >= 2
+    assert _count(body, "da_time_to_first_token_seconds", labels) >= 2
+    assert _count(body, "da_tokens_per_second", labels) >= 2
+    assert _count(body, "da_sse_bytes", 'endpoint="/conversation"') >= 1
+
+
+def test_turn_metrics_ignore_empty_chunks(monkeypatch):
+    """Empty role, finish and usage chunks are not tokens"""
+    from app import metrics
+
+    async def stream_chat(
+        message, thread_id, system_prompt=None, model=None, **options
+    ):
+        yield ""
+        await asyncio.sleep(0.05)
+        yield "Hi"
+        await asyncio.sleep(0.05)
+        yield " there"
+        yield ""
+        yield ""
+
+    ttft = Histogram("ttft", "TTFT", labelnames=("model",))
+    rate = Histogram("rate", "Rate", labelnames=("model",))
+    monkeypatch.setattr(metrics, "time_to_first_token", ttft)
+    monkeypatch.setattr(metrics, "token_rate", rate)
+    monkeypatch.setattr(main.chatbot_a, "stream_chat", stream_chat)
+
+    async def consume():
+        conv = main.ConversationStart(initial_message="hi", turns=1)
+        return [e async for e in main.conversation_events(conv)]
+
+    events = asyncio.run(consume())
+
+    assert [e["content"] for e in events if e["type"] == "token"] == ["Hi", " there"]
+    (ttft_series,) = ttft._series.values()
+    (rate_series,) = rate._series.values()
+    # Measured to "Hi", not to the empty role chunk
+    assert ttft_series[1] >= 0.05
+    # One token after the first in at least 0.05 seconds
+    assert 0 < rate_series[1] <= 20
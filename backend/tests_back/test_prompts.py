@@ -3,23 +3,20 @@ import pytest
 
 
 @pytest.fixture
-def test_db(mocker):
+def test_db(mocker, tmp_path):
     """Create test database (local fixture)."""
     mocker.patch.dict(os.environ, {"DA_DB_URL": "sqlite:///:memory:"})
 
     from app.db.models import Base
     from sqlalchemy import create_engine
-    from sqlalchemy.orm import sessionmaker
-    from sqlalchemy.pool import StaticPool
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 
-    test_engine = create_engine(
-        "sqlite:///:memory:",
-        connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
-    )
-    Base.metadata.create_all(bind=test_engine)
-    TestingSessionLocal = sessionmaker(
-        autocommit=False, autoflush=False, bind=test_engine
+    db_file = tmp_path / "test.db"
+    Base.metadata.create_all(bind=create_engine(f"sqlite:///{db_file}"))
+
+    test_engine = create_async_engine(f"sqlite+aiosqlite:///{db_file}")
+    TestingSessionLocal = async_sessionmaker(
+        autoflush=False, bind=test_engine, expire_on_commit=False
     )
     return TestingSessionLocal
 
@@ -38,12 +35,9 @@ def test_client(test_db, mocker):
     from fastapi.testclient import TestClient
     from app.main import app, get_db, get_user_id
 
-    def override_get_db():
-        db = test_db()
-        try:
+    async def override_get_db():
+        async with test_db() as db:
             yield db
-        finally:
-            db.close()
 
     def override_get_user_id():
         return "test_user_123"
@@ -71,6 +65,39 @@ def test_save_and_get_prompts(test_client):
     assert any(p["agent_name"] == "agent1" for p in prompts)
 
 
+def test_get_prompts_is_paginated(test_client):
+    """/get_prompts returns one page at a time when a limit is given"""
+    for i in range(3):
+        test_client.post(
+            "/save_prompt", json={"agent_name": f"agent{i}", "prompt": f"prompt {i}"}
+        )
+
+    first = test_client.get("/get_prompts", params={"limit": 2})
+    second = test_client.get(
+        "/get_prompts", params={"limit": 2, "cursor": first.headers["X-Next-Cursor"]}
+    )
+
+    names = [p["agent_name"] for p in first.json() + second.json()]
+    assert names == ["agent2", "agent1", "agent0"]
+    assert "X-Next-Cursor" not in second.headers
+    assert len(test_client.get("/get_prompts").json()) == 3
+
+
+def test_get_prompts_is_paginated_by_default(test_client):
+    from app.pagination import DEFAULT_PAGE_SIZE
+
+    for i in range(DEFAULT_PAGE_SIZE + 1):
+        test_client.post(
+            "/save_prompt", json={"agent_name": f"agent{i}", "prompt": f"prompt {i}"}
+        )
+
+    response = test_client.get("/get_prompts")
+
+    assert len(response.json()) == DEFAULT_PAGE_SIZE
+    assert "X-Next-Cursor" in response.headers
+    assert test_client.get("/get_prompts", params={"limit": 101}).status_code == 422
+
+
 def test_save_long_prompt(test_client):
     prompt_text = """You are Olga Zemp, a 56-year-old woman with elevated blood pressure, high cholesterol, and prediabetes seeking guidance on weight management and overall health.
 Persona: 
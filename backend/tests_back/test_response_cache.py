@@ -0,0 +1,114 @@
+import os
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from langchain_core.messages import AIMessage
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.chatbot import ChatbotService
+from app.db import models as db_models
+from app.response_cache import ResponseCache
+
+
+@pytest.fixture
+def models(mocker):
+    mocker.patch.dict(os.environ, {"DA_OPENAI_API_KEY": "test-key"})
+    models = MagicMock()
+    models.get.return_value.ainvoke = AsyncMock(
+        side_effect=lambda prompt, **options: AIMessage(content="cached answer")
+    )
+    return models
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    db_file = tmp_path / "cache.db"
+    db_models.Base.metadata.create_all(bind=create_engine(f"sqlite:///{db_file}"))
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_file}")
+    return async_sessionmaker(bind=engine, expire_on_commit=False)
+
+
+@pytest.mark.asyncio
+async def test_deterministic_chat_is_served_from_cache(models):
+    service = ChatbotService(models=models, cache=ResponseCache())
+
+    first = await service.chat_message("ping", "t1", model="gpt-4o", temperature=0)
+    second = await service.chat_message("ping", "t2", model="gpt-4o", temperature=0)
+
+    assert first.response_metadata["cache"] == "miss"
+    assert second.response_metadata["cache"] == "hit"
+    assert second.content == "cached answer"
+    assert models.get.return_value.ainvoke.await_count == 1
+    # A cached reply is still part of the thread
+    assert await service.message_count("t2") == 2
+
+
+@pytest.mark.asyncio
+async def test_key_covers_prompt_model_and_temperature(models):
+    service = ChatbotService(models=models, cache=ResponseCache())
+
+    await service.chat_message("ping", "t1", model="gpt-4o", temperature=0)
+    await service.chat_message("ping", "t2", model="gpt-4o-mini", temperature=0)
+    await service.chat_message("ping", "t3", system_prompt="Other", temperature=0)
+    await service.chat_message("pong", "t4", model="gpt-4o", temperature=0)
+
+    assert models.get.return_value.ainvoke.await_count == 4
+
+
+@pytest.mark.asyncio
+async def test_cache_is_bypassed_unless_deterministic_or_forced(models):
+    service = ChatbotService(models=models, cache=ResponseCache())
+
+    bypassed = [await service.chat_message("ping", f"t{i}") for i in range(2)]
+    assert all("cache" not in r.response_metadata for r in bypassed)
+    assert models.get.return_value.ainvoke.await_count == 2
+
+    await service.chat_message("ping", "t3", force_cache=True)
+    forced = await service.chat_message("ping", "t4", force_cache=True)
+    assert forced.response_metadata["cache"] == "hit"
+    assert models.get.return_value.ainvoke.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_lru_evicts_oldest_and_expires_entries():
+    cache = ResponseCache(max_entries=2)
+    for key in "abc":
+        await cache.set(key, key.upper(), "gpt-4o")
+
+    assert await cache.get("a") is None
+    assert await cache.get("c") == "C"
+
+    expired = ResponseCache(ttl=0)
+    await expired.set("a", "A", "gpt-4o")
+    assert await expired.get("a") is None
+    assert expired.stats()["entries"] == 0
+
+
+@pytest.mark.asyncio
+async def test_shared_tier_is_seen_by_other_workers(session_factory):
+    writer = ResponseCache(session_factory=session_factory)
+    reader = ResponseCache(session_factory=session_factory)
+
+    await writer.set("key", "from another worker", "gpt-4o")
+    await writer.set("key", "replaced", "gpt-4o")
+
+    assert await reader.get("key") == "replaced"
+    assert reader.stats()["shared_hits"] == 1
+    assert await reader.get("missing") is None
+
+
+@pytest.mark.asyncio
+async def test_shared_tier_is_pruned_to_max_rows(session_factory):
+    cache = ResponseCache(session_factory=session_factory, max_rows=2, prune_every=1)
+    for key in "abcd":
+        await cache.set(key, key, "gpt-4o")
+
+    async with session_factory() as db:
+        keys = await db.scalars(select(db_models.ResponseCacheEntry.key))
+        count = await db.scalar(
+            select(func.count()).select_from(db_models.ResponseCacheEntry)
+        )
+
+    assert count == 2
+    assert set(keys) == {"c", "d"}
@@ -0,0 +1,89 @@
+import asyncio
+from contextlib import aclosing
+
+import pytest
+
+from app.runs import RunRegistry
+
+
+async def _events(count, delay=0.0, produced=None):
+    for i in range(count):
+        await asyncio.sleep(delay)
+        if produced is not None:
+            produced.append(i)
+        yield {"type": "token", "content": str(i)}
+
+
+async def _read(registry, run, last_event_id=0, limit=None):
+    frames = []
+    async with aclosing(registry.stream(run, last_event_id)) as stream:
+        async for frame in stream:
+            frames.append(frame)
+            if len(frames) == limit:
+                break
+    return frames
+
+
+@pytest.mark.asyncio
+async def test_events_carry_increasing_ids_and_replay_after_last_id():
+    registry = RunRegistry()
+    run = registry.start("u1", _events(4))
+
+    frames = await _read(registry, run)
+    assert frames[0] == 'id: 1\ndata: {"type":"token","content":"0"}\n\n'
+    assert [f.split("\n")[0] for f in frames] == [f"id: {i}" for i in range(1, 5)]
+
+    replay = await _read(registry, run, last_event_id=2)
+    assert replay == frames[2:]
+
+
+@pytest.mark.asyncio
+async def test_run_keeps_generating_while_detached_and_resumes():
+    """A dropped client reconnects without the model calls running again"""
+    registry = RunRegistry(grace_period=5)
+    produced = []
+    run = registry.start("u1", _events(6, delay=0.01, produced=produced))
+
+    first = await _read(registry, run, limit=2)
+    assert run.subscribers == 0
+    await asyncio.sleep(0.03)
+    assert not run.task.done()
+
+    rest = await _read(registry, run, last_event_id=2)
+    assert [f.split("\n")[0] for f in first + rest] == [f"id: {i}" for i in range(1, 7)]
+    assert produced == list(range(6))
+
+
+@pytest.mark.asyncio
+async def test_run_without_listeners_is_cancelled_after_grace_period():
+    registry = RunRegistry(grace_period=0.02)
+    run = registry.start("u1", _events(100, delay=0.01))
+
+    await _read(registry, run, limit=1)
+    await asyncio.sleep(0.1)
+
+    assert run.done
+    assert run.events[-1][1] == {"type": "cancelled"}
+    assert run.last_id < 100
+
+
+@pytest.mark.asyncio
+async def test_events_dropped_from_the_buffer_are_reported_as_a_gap():
+    registry = RunRegistry(max_events=3)
+    run = registry.start("u1", _events(6))
+    await run.task
+
+    frames = await _read(registry, run)
+
+    assert frames[0] == 'data: {"type":"gap","missed":3}\n\n'
+    assert [f.split("\n")[0] for f in frames[1:]] == ["id: 4", "id: 5", "id: 6"]
+
+
+@pytest.mark.asyncio
+async def test_runs_are_private_to_their_user():
+    registry = RunRegistry()
+    run = registry.start("u1", _events(1))
+
+    assert registry.get(run.id, "u1") is run
+    assert registry.get(run.id, "u2") is None
+    await run.task
@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+import pytest
+
+from app.sse import TokenStream, coalesce_tokens, sse_event
+
+
+async def _tokens(items, delay=0.0):
+    for item in items:
+        await asyncio.sleep(delay)
+        yield item
+
+
+async def _collect(tokens, max_tokens, max_delay):
+    return [chunk async for chunk in coalesce_tokens(tokens, max_tokens, max_delay)]
+
+
+def test_sse_event_is_compact_json():
+    frame = sse_event({"type": "token", "content": "hyvä"})
+
+    assert frame == 'data: {"type":"token","content":"hyvä"}\n\n'
+    assert json.loads(frame[len("data: ") :]) == {"type": "token", "content": "hyvä"}
+
+
+@pytest.mark.asyncio
+async def test_tokens_are_batched_by_count():
+    chunks = await _collect(_tokens(list("abcdefg")), max_tokens=3, max_delay=10)
+
+    assert chunks == ["abc", "def", "g"]
+
+
+@pytest.mark.asyncio
+async def test_slow_tokens_are_flushed_by_time():
+    """A chunk is sent when its first token is older than max_delay"""
+    chunks = await _collect(
+        _tokens(list("abcd"), delay=0.03), max_tokens=100, max_delay=0.01
+    )
+
+    assert "".join(chunks) == "abcd"
+    assert len(chunks) == 4
+
+
+@pytest.mark.asyncio
+async def test_batching_can_be_disabled():
+    chunks = await _collect(_tokens(list("abc")), max_tokens=1, max_delay=10)
+
+    assert chunks == ["a", "b", "c"]
+
+
+@pytest.mark.asyncio
+async def test_source_errors_are_raised_after_received_tokens():
+    async def failing():
+        yield "a"
+        yield "b"
+        raise RuntimeError("model failed")
+
+    received = []
+    with pytest.raises(RuntimeError, match="model failed"):
+        async for chunk in coalesce_tokens(failing(), max_tokens=10, max_delay=10):
+            received.append(chunk)
+
+    assert received == ["ab"]
+
+
+@pytest.mark.asyncio
+async def test_empty_chunks_are_not_counted_or_sent():
+    """Role, finish and usage chunks are empty and carry no tokens"""
+
+    async def model():
+        yield ""
+        await asyncio.sleep(0.05)
+        for token in ["Hi", " there", "", ""]:
+            yield token
+
+    stream = TokenStream(model())
+    chunks = await _collect(stream, max_tokens=1, max_delay=10)
+
+    assert chunks == ["Hi", " there"]
+    assert stream.tokens == 2
+    assert stream.ttft >= 0.05
@@ -0,0 +1,90 @@
+"""
+Checks that the paths building long strings never concatenate them piece by
+piece, which copies the text built so far on every step (quadratic time).
+
+Tokens, history messages and exported blocks are passed as TrackedStr, which
+counts every `+` it takes part in; joins and StringIO writes are not counted.
+Unlike timing the paths, this gives the same result on any machine.
+"""
+
+import asyncio
+import os
+from unittest.mock import MagicMock, patch
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+os.environ.setdefault("DA_DB_URL", "sqlite:///:memory:")
+os.environ.setdefault("DA_OPENAI_API_KEY", "test-key-123")
+
+from app import main
+from app.chatbot import ChatbotService
+
+
+class TrackedStr(str):
+    concatenations = 0
+
+    def __add__(self, other):
+        TrackedStr.concatenations += 1
+        return str.__add__(self, other)
+
+    def __radd__(self, other):
+        # Called before str.__add__ of the left operand, as this is a subclass
+        TrackedStr.concatenations += 1
+        return str.__add__(other, self)
+
+
+def test_tracked_str_counts_concatenation():
+    TrackedStr.concatenations = 0
+    text = "a"
+    text += TrackedStr("b")
+    text = TrackedStr("c") + text
+
+    assert text == "cab"
+    assert TrackedStr.concatenations == 2
+
+
+def test_conversation_history_export_does_not_concatenate():
+    with patch.dict(os.environ, {"DA_OPENAI_API_KEY": "testkey"}):
+        service = ChatbotService(models=MagicMock())
+    messages = [
+        (HumanMessage if i % 2 else AIMessage)(content=f"message {i}")
+        for i in range(100)
+    ]
+    service.app = MagicMock()
+    service.app.get_state.return_value.values = {"messages": messages}
+
+    # One block per message, nothing carried over between them
+    blocks = list(service.iter_conversation_history("export"))
+    assert len(blocks) == 100
+    assert all(len(block) < 30 for block in blocks)
+
+    service.iter_conversation_history = lambda thread_id: map(TrackedStr, blocks)
+    TrackedStr.concatenations = 0
+
+    assert service.get_conversation_history("export") == "".join(blocks)
+    assert TrackedStr.concatenations == 0
+
+
+def test_streamed_turn_does_not_concatenate(monkeypatch):
+    async def stream(message, thread_id, system_prompt=None, model=None, **options):
+        for i in range(200):
+            yield TrackedStr(f"token{i} ")
+
+    async def consume():
+        conv = main.ConversationStart(
+            initial_message="start",
+            turns=2,
+            # Tokens are passed through as they are, without coalescing
+            flush_tokens=1,
+            history=[{"chatbot": "user", "message": TrackedStr("y" * 100)}] * 50,
+        )
+        return [e async for e in main.conversation_events(conv)]
+
+    monkeypatch.setattr(main.chatbot_a, "stream_chat", stream)
+    monkeypatch.setattr(main.chatbot_b, "stream_chat", stream)
+    TrackedStr.concatenations = 0
+
+    events = asyncio.run(consume())
+
+    assert sum(e["type"] == "end" for e in events) == 2
+    assert TrackedStr.concatenations == 0
@@ -0,0 +1,134 @@
+import os
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from langchain_core.messages import AIMessage
+from sqlalchemy import create_engine, select
+from sqlalchemy.exc import DataError, OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.chatbot import ChatbotService
+from app.db import models as db_models
+from app.resilience import ModelError
+from app.usage import UsageTracker
+
+
+def _reply(prompt, **options):
+    return AIMessage(
+        content="reply",
+        usage_metadata={"input_tokens": 30, "output_tokens": 10, "total_tokens": 40},
+    )
+
+
+@pytest.fixture
+def models(mocker):
+    mocker.patch.dict(os.environ, {"DA_OPENAI_API_KEY": "test-key"})
+    models = MagicMock()
+    models.get.return_value.ainvoke = AsyncMock(side_effect=_reply)
+    return models
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    db_file = tmp_path / "usage.db"
+    db_models.Base.metadata.create_all(bind=create_engine(f"sqlite:///{db_file}"))
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_file}")
+    return async_sessionmaker(bind=engine, expire_on_commit=False)
+
+
+@pytest.mark.asyncio
+async def test_chat_and_stream_calls_are_accounted(models):
+    usage = UsageTracker()
+    service = ChatbotService(models=models, usage=usage)
+
+    await service.chat_message("ping", "t1", model="gpt-4o", user_id="u1")
+    async for _ in service.stream_chat("ping", "t2", model="gpt-4o", user_id="u1"):
+        pass
+    await service.chat_message("ping", "t3", model="gpt-4o-mini")
+
+    assert usage.totals["gpt-4o"] == [2, 60, 20]
+    assert usage.totals["gpt-4o-mini"] == [1, 30, 10]
+    assert (await usage.user_stats("u1"))["tokens"] == 80
+    assert (await usage.user_stats("anonymous"))["tokens"] == 40
+
+
+@pytest.mark.asyncio
+async def test_user_over_quota_is_refused_before_the_model_is_called(models):
+    usage = UsageTracker(quota_tokens=50)
+    service = ChatbotService(models=models, usage=usage)
+    await service.chat_message("ping", "t1", user_id="u1")
+    await service.chat_message("ping", "t1", user_id="u1")
+
+    with pytest.raises(ModelError) as error:
+        await service.chat_message("ping", "t1", user_id="u1")
+
+    assert error.value.code == "quota_exceeded"
+    assert error.value.http_status == 429
+    assert 0 < error.value.retry_after <= 86400
+    assert models.get.return_value.ainvoke.await_count == 2
+    # Other users are not affected
+    await service.chat_message("ping", "t2", user_id="u2")
+
+
+@pytest.mark.asyncio
+async def test_totals_are_flushed_in_one_batch_with_cost(session_factory):
+    usage = UsageTracker(session_factory, prices={"gpt-4o": (2.5, 10)})
+    usage.record("u1", "t1", "gpt-4o", 1000, 100)
+    usage.record("u1", "t1", "gpt-4o", 1000, 100)
+    usage.record("u2", "t2", "gpt-5", 50, 5)
+
+    assert await usage.flush() == 2
+    assert await usage.flush() == 0
+
+    async with session_factory() as db:
+        rows = {r.user: r for r in await db.scalars(select(db_models.Usage))}
+    assert (rows["u1"].calls, rows["u1"].prompt_tokens) == (2, 2000)
+    assert rows["u1"].cost_usd == pytest.approx(0.007)
+    assert rows["u2"].cost_usd is None
+
+
+@pytest.mark.asyncio
+async def test_quota_counts_usage_flushed_by_other_workers(session_factory):
+    other = UsageTracker(session_factory)
+    other.record("u1", "t1", "gpt-4o", 40, 20)
+    await other.flush()
+
+    usage = UsageTracker(session_factory, quota_tokens=100)
+    await usage.check("u1")
+    usage.record("u1", "t2", "gpt-4o", 30, 10)
+
+    with pytest.raises(ModelError):
+        await usage.check("u1")
+    assert (await usage.user_stats("u1"))["tokens"] == 100
+
+
+@pytest.mark.asyncio
+async def test_rows_refused_by_the_database_do_not_block_the_others(
+    session_factory,
+):
+    usage = UsageTracker(session_factory)
+    insert = usage._insert
+
+    async def refusing_insert(rows):
+        if any(len(row["thread_id"]) > 100 for row in rows):
+            raise DataError("INSERT", {}, Exception("value too long"))
+        await insert(rows)
+
+    usage._insert = refusing_insert
+    usage.record("u1", "t" * 101, "gpt-4o", 10, 1)
+    usage.record("u2", "t2", "gpt-4o", 20, 2)
+
+    assert await usage.flush() == 1
+    assert usage.stats()["pending"] == 0
+    assert usage.stats()["dropped"] == 1
+    async with session_factory() as db:
+        assert [r.user for r in await db.scalars(select(db_models.Usage))] == ["u2"]
+
+    # Rows are kept while the database is unreachable
+    async def unreachable(rows):
+        raise OperationalError("INSERT", {}, Exception("connection refused"))
+
+    usage._insert = unreachable
+    usage.record("u2", "t2", "gpt-4o", 20, 2)
+    assert await usage.flush() == 0
+    assert usage.stats()["pending"] == 1
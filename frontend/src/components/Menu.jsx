@@ -3,7 +3,15 @@ import { useChatSession } from '../contexts/ChatSessionContext';
 import ThemeToggle from './ThemeToggle';
 
 const Menu = ({ onOpenUserGuide }) => {
-  const { conversationList, isLoadingConversationList, openChat, startNewChat } = useChatSession();
+  const {
+    conversationList,
+    isLoadingConversationList,
+    hasMoreConversations,
+    isLoadingMoreConversations,
+    loadMoreConversations,
+    openChat,
+    startNewChat,
+  } = useChatSession();
 
   const handleLogout = async () => {
     try {
@@ -124,6 +132,19 @@ const Menu = ({ onOpenUserGuide }) => {
                   </button>
                 );
               })}
+              {hasMoreConversations && (
+                <button
+                  className="btn btn-ghost btn-xs w-full opacity-70"
+                  onClick={loadMoreConversations}
+                  disabled={isLoadingMoreConversations}
+                >
+                  {isLoadingMoreConversations ? (
+                    <span className="loading loading-spinner loading-xs"></span>
+                  ) : (
+                    'Show older'
+                  )}
+                </button>
+              )}
             </div>
           </div>
         )}
@@ -7,6 +7,7 @@ const PromptManagerModal = ({
   setPromptManagerContext,
   savedPrompts,
   setSavedPrompts,
+  onLoadMorePrompts,
   showAlert,
 }) => {
   const modalRef = useRef(null);
@@ -53,6 +54,7 @@ const PromptManagerModal = ({
               setPromptManagerContext={setPromptManagerContext}
               savedPrompts={savedPrompts}
               setSavedPrompts={setSavedPrompts}
+              onLoadMore={onLoadMorePrompts}
               chatbot={promptManagerContext.chatbot}
               onClose={closeModal}
               showAlert={showAlert}
@@ -197,6 +199,7 @@ export const PromptMenu = ({
   setPromptManagerContext,
   savedPrompts,
   setSavedPrompts,
+  onLoadMore,
   chatbot,
   onClose,
   showAlert,
@@ -288,6 +291,11 @@ export const PromptMenu = ({
                   <hr className="text-base-300 bg-base-300 my-2 rounded-sm" />
                 </div>
               ))}
+              {onLoadMore && (
+                <button onClick={onLoadMore} className="btn btn-ghost btn-sm rounded-xl">
+                  Show more prompts
+                </button>
+              )}
             </ul>
           ) : (
             <p className="italic text-pretty tracking-wide opacity-80 text-sm">No saved prompts</p>
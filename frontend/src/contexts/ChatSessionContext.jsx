@@ -4,33 +4,36 @@ import { useBotConfig } from './BotConfigContext';
 
 const ChatSessionContext = createContext(null);
 
+// Conversations fetched per request, the rest is loaded on demand
+const PAGE_SIZE = 50;
+
+const fetchConversationPage = async (cursor) => {
+  const res = await axios.get('/api/conversations', {
+    params: { limit: PAGE_SIZE, ...(cursor && { cursor }) },
+    withCredentials: true,
+  });
+  return { conversations: res.data || [], cursor: res.headers?.['x-next-cursor'] ?? null };
+};
+
 export const ChatSessionProvider = ({ children }) => {
   const { resetPrompts } = useBotConfig();
 
   const [activeConversationId, setActiveConversationId] = useState(null);
   const [conversationList, setConversationList] = useState([]);
   const [isLoadingConversationList, setIsLoadingConversationList] = useState(false);
+  // Cursor of the next page of the list, null when everything is loaded
+  const [nextCursor, setNextCursor] = useState(null);
+  const [isLoadingMoreConversations, setIsLoadingMoreConversations] = useState(false);
 
   // Load Conversation List
   const refreshConversationList = useCallback(async () => {
     setIsLoadingConversationList(true);
     try {
-      const res = await axios.get('/api/conversations', { withCredentials: true });
-      const fullData = res.data || [];
-
-      // ⚠️ CRITICAL OPTIMIZATION ⚠️
-      // The backend currently sends the full history (heavy).
-      // We strip the 'messages' array here to keep the Context lightweight
-      // and prevent the Sidebar from holding megabytes of text data.
-      // Later lets make backend send only metadata (everything about a convo except messages) for the list endpoint.
-      const lightweightList = fullData.map((conv) => {
-        // Disable linter because we need to exclude 'messages'
-        // eslint-disable-next-line no-unused-vars
-        const { messages, ...metaData } = conv;
-        return metaData;
-      });
-
-      setConversationList(lightweightList);
+      // The list endpoint only returns conversation metadata, messages are
+      // fetched per conversation when a chat is opened.
+      const { conversations, cursor } = await fetchConversationPage();
+      setConversationList(conversations);
+      setNextCursor(cursor);
     } catch (err) {
       console.warn('Failed to load list', err);
     } finally {
@@ -38,6 +41,23 @@ export const ChatSessionProvider = ({ children }) => {
     }
   }, []);
 
+  const loadMoreConversations = useCallback(async () => {
+    if (!nextCursor) return;
+    setIsLoadingMoreConversations(true);
+    try {
+      const { conversations, cursor } = await fetchConversationPage(nextCursor);
+      setConversationList((prev) => {
+        const loaded = new Set(prev.map((c) => c.id));
+        return [...prev, ...conversations.filter((c) => !loaded.has(c.id))];
+      });
+      setNextCursor(cursor);
+    } catch (err) {
+      console.warn('Failed to load more conversations', err);
+    } finally {
+      setIsLoadingMoreConversations(false);
+    }
+  }, [nextCursor]);
+
   const startNewChat = useCallback(() => {
     setActiveConversationId(null);
     resetPrompts();
@@ -77,6 +97,9 @@ export const ChatSessionProvider = ({ children }) => {
         activeConversationId,
         conversationList,
         isLoadingConversationList,
+        hasMoreConversations: nextCursor !== null,
+        isLoadingMoreConversations,
+        loadMoreConversations,
         refreshConversationList,
         startNewChat,
         openChat,
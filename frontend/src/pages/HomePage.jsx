@@ -1,4 +1,4 @@
-import { useState, useRef, useEffect } from 'react';
+import { useState, useRef, useEffect, useCallback } from 'react';
 import { useBotConfig } from '../contexts/BotConfigContext';
 import axios from 'axios';
 import BotConfigurator from '../components/BotConfigurator';
@@ -14,6 +14,8 @@ const HomePage = () => {
   const { promptA, setPromptA, promptB, setPromptB, initPrompt } = useBotConfig();
 
   const [savedPrompts, setSavedPrompts] = useState(null);
+  // Cursor of the next page of saved prompts, null when all are loaded
+  const [promptsCursor, setPromptsCursor] = useState(null);
 
   const [promptManagerContext, setPromptManagerContext] = useState(null);
   const [isConvoActive, setIsConvoActive] = useState(false);
@@ -37,20 +39,27 @@ const HomePage = () => {
     userGuideModalRef.current.showModal();
   };
 
-  // Load Saved Prompts
+  // Load Saved Prompts, one page at a time
+  const loadSavedPrompts = useCallback(async (cursor = null) => {
+    try {
+      const { data, headers } = await axios.get('api/get_prompts', {
+        params: cursor ? { cursor } : {},
+      });
+      setPromptsCursor(headers?.['x-next-cursor'] ?? null);
+      setSavedPrompts((prev) =>
+        data.reduce(
+          (promptMap, prompt) => promptMap.set(prompt.id, prompt),
+          new Map(cursor ? prev : []),
+        ),
+      );
+    } catch (err) {
+      console.log(err);
+    }
+  }, []);
+
   useEffect(() => {
-    const loadSavedPrompts = async () => {
-      try {
-        const { data } = await axios.get('api/get_prompts');
-        setSavedPrompts(
-          data.reduce((promptMap, prompt) => promptMap.set(prompt.id, prompt), new Map()),
-        );
-      } catch (err) {
-        console.log(err);
-      }
-    };
     loadSavedPrompts();
-  }, []);
+  }, [loadSavedPrompts]);
 
   return (
     <div className="drawer lg:drawer-open">
@@ -130,6 +139,7 @@ const HomePage = () => {
           setPromptManagerContext={setPromptManagerContext}
           savedPrompts={savedPrompts}
           setSavedPrompts={setSavedPrompts}
+          onLoadMorePrompts={promptsCursor ? () => loadSavedPrompts(promptsCursor) : null}
           showAlert={showAlert}
         />
       )}